@@ -17,4 +17,7 @@
 # pylint: skip-file
 from .anilist import API
 from .auth import OAuth
+from .batch import QueryBatcher, Subquery
+from .cache import ResponseCache
+from .scheduler import Priority, RequestScheduler, SchedulerMetrics
 from .enums import *
@@ -15,18 +15,275 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """This module contains anilist API class."""
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 from datetime import date
-from functools import lru_cache
+from functools import partial
+from itertools import count
 from pathlib import Path
+from threading import Lock
+from time import sleep
 from typing import Dict, Iterable, List, Optional, Tuple
 
-from requests import HTTPError, Session
+from requests import HTTPError, Response, Session
 
 from ene.constants import CLIENT_ID, GRAPHQL_URL
 from ene.errors import APIError
 from ene.util import dict_filter
 from .auth import OAuth
+from .batch import QueryBatcher, Subquery
+from .cache import CacheEntry, ResponseCache, cache_key
 from .enums import MediaFormat, MediaListStatus, MediaSeason, MediaSort, MediaStatus
+from .scheduler import Priority, RequestScheduler
+
+# Number of pages query_pages requests ahead of the page being consumed
+PREFETCH = 4
+
+BROWSE_ANIME_QUERY = """\
+query (
+$page: Int = 1,
+$isAdult: Boolean = false,
+$search: String,
+$format: MediaFormat
+$status: MediaStatus,
+$season: MediaSeason,
+$year: String,
+$onList: Boolean,
+$yearLesser: FuzzyDateInt,
+$yearGreater: FuzzyDateInt,
+$licensedBy: [String],
+$includedGenres: [String],
+$excludedGenres: [String],
+$includedTags: [String],
+$excludedTags: [String],
+$sort: [MediaSort] = [SCORE_DESC, POPULARITY_DESC],
+$perPage: Int,
+) {
+    Page (page: $page, perPage: $perPage) {
+        pageInfo {
+            total
+            perPage
+            currentPage
+            lastPage
+            hasNextPage
+        }
+        media (
+            type: ANIME,
+            season: $season,
+            format: $format,
+            status: $status,
+            search: $search,
+            onList: $onList,
+            startDate_like: $year,
+            startDate_lesser: $yearLesser,
+            startDate_greater: $yearGreater,
+            licensedBy_in: $licensedBy,
+            genre_in: $includedGenres,
+            genre_not_in: $excludedGenres,
+            tag_in: $includedTags,
+            tag_not_in: $excludedTags,
+            sort: $sort,
+            isAdult: $isAdult
+        ) {
+            id
+            title {
+                userPreferred
+            }
+            coverImage {
+                large
+            }
+            bannerImage
+            startDate {
+                year
+                month
+                day
+            }
+            endDate {
+                year
+                month
+                day
+            }
+            season
+            description
+            type
+            format
+            status
+            genres
+            isAdult
+            averageScore
+            popularity
+            mediaListEntry {
+                status
+            }
+            nextAiringEpisode {
+                airingAt
+                timeUntilAiring
+                episode
+            }
+            studios (isMain: true) {
+                edges {
+                    isMain
+                    node {
+                        id
+                        name
+                    }
+                }
+            }
+        }
+    }
+}"""
+
+GET_SHOW_QUERY = """\
+query ($title: String) {
+    Media(search: $title, type: ANIME) {
+        id
+        coverImage {
+            large
+            medium
+        }
+    }
+}"""
+
+UPDATE_MEDIA_LIST_ENTRY_QUERY = """\
+mutation (
+    $mediaId: Int,
+    $status: MediaListStatus,
+    $score: Float,
+    $progress: Int,
+    $customLists: Json,
+    $private: Boolean,
+    $startedAt: FuzzyDate,
+    $completedAt: FuzzyDate,
+    $repeat: Int
+) {
+    SaveMediaListEntry (
+        mediaId: $mediaId,
+        status: $status,
+        score: $score,
+        progress: $progress,
+        customLists: $customLists,
+        private: $private,
+        startedAt: $startedAt,
+        completedAt: $completedAt,
+        repeat: $repeat
+    ) {
+        id
+        status
+        score
+        progress
+        customLists
+        private
+        startedAt
+        completedAt
+        repeat
+    }
+}"""
+
+
+def browse_anime_variables(  # pylint: disable=R0913,R0914
+        page: int = 1,
+        is_adult: bool = None,
+        search: str = None,
+        format_: MediaFormat = None,
+        status: MediaStatus = None,
+        season: MediaSeason = None,
+        year_range: Tuple[int, int] = None,
+        on_list: bool = None,
+        licensed_by: List[str] = None,
+        included_genres: List[str] = None,
+        excluded_genres: List[str] = None,
+        included_tags: List[str] = None,
+        excluded_tags: List[str] = None,
+        sort: List[MediaSort] = None
+) -> dict:
+    """
+    Builds the variables of BROWSE_ANIME_QUERY, see API.browse_anime for the
+    arguments
+
+    Returns:
+        The query variables
+    """
+    variables = dict_filter({
+        'page': page,
+        'isAdult': is_adult,
+        'search': search,
+        'format': format_.name if format_ else None,
+        'status': status.name if status else None,
+        'season': season.name if season else None,
+        'onList': on_list,
+        'licensedBy': licensed_by,
+        'includedGenres': included_genres,
+        'excludedGenres': excluded_genres,
+        'includedTags': included_tags,
+        'excludedTags': excluded_tags,
+    })
+    if sort:
+        variables['sort'] = [s.name for s in sort]
+    if year_range and year_range[0] and year_range[1]:
+        start, fin = year_range
+        if start == fin:
+            variables['year'] = f'{start}%'
+        else:
+            variables['yearGreater'] = start * 10000
+            variables['yearLesser'] = fin * 10000
+    return variables
+
+
+def media_list_entry_variables(  # pylint: disable=R0913
+        id_: int,
+        status: Optional[MediaListStatus] = None,
+        score: Optional[float] = None,
+        progress: Optional[int] = None,
+        custom_lists: Optional[Dict[str, bool]] = None,
+        private: Optional[bool] = None,
+        started_at: Optional[date] = None,
+        completed_at: Optional[date] = None,
+        repeat: Optional[int] = None
+) -> dict:
+    """
+    Builds the variables of UPDATE_MEDIA_LIST_ENTRY_QUERY, see
+    API.update_media_list_entry for the arguments
+
+    Returns:
+        The query variables
+    """
+    variables = dict_filter({
+        "mediaId": id_,
+        "status": status.name if status else None,
+        "score": score,
+        "progress": progress,
+        "customLists": custom_lists,
+        "private": private,
+        "startedAt": {
+            "year": started_at.year,
+            "month": started_at.month,
+            "day": started_at.day
+        } if started_at else None,
+        "completedAt": {
+            "year": completed_at.year,
+            "month": completed_at.month,
+            "day": completed_at.day
+        } if completed_at else None,
+        "repeat": repeat,
+    })
+    return variables
+
+
+def api_error(status: int, payload: Optional[dict], default: str) -> APIError:
+    """
+    Builds the error for a failed request
+
+    Args:
+        status: The HTTP status of the response
+        payload: The JSON body of the response, None if it is not JSON
+        default: The message used if the body has no error messages
+
+    Returns:
+        The error
+    """
+    errors = (payload or {}).get('errors', [])
+    msg = '\n'.join(err.get('message') for err in errors if err.get('message'))
+    return APIError(status, msg or default)
 
 
 class API:
@@ -34,22 +291,49 @@ class API:
     Handles requests to the Anilist API
     """
 
-    def __init__(self, data_home: Path):
+    def __init__(
+            self,
+            data_home: Path,
+            cache_home: Optional[Path] = None,
+            pool: Optional[Executor] = None
+    ):
+        """
+        Args:
+            data_home: Data directory path
+            cache_home: Cache directory path, None to not cache responses
+            pool: Executor to refresh stale cached responses on, None to
+                refresh them before returning
+        """
         self.token = OAuth.get_token(data_home, CLIENT_ID, '127.0.0.1', 50000)
+        self.url = GRAPHQL_URL
         self.session = Session()
         self.session.headers.update({
             'Authorization': f'Bearer {self.token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
+        self.scheduler = RequestScheduler()
+        # Batches are bulk work, interactive requests go before them
+        self.batcher = QueryBatcher(partial(self.query, priority=Priority.BACKGROUND))
+        self.cache = ResponseCache(cache_home / 'responses.db') if cache_home else None
+        self.pool = pool
+        self._refreshing = set()
+        self._refreshing_lock = Lock()
 
-    def query(self, query: str, variables: Optional[dict] = None) -> dict:
+    def query(
+            self,
+            query: str,
+            variables: Optional[dict] = None,
+            priority: Priority = Priority.INTERACTIVE
+    ) -> dict:
         """
-        Makes HTTP request to the Anilist API
+        Makes HTTP request to the Anilist API, waiting for the rate limit and
+        retrying responses with status 429 or 5xx
 
         Args:
             query: The GraphQL query to POST to the API
             variables: variables for the query, can be None
+            priority: The priority of the request
 
         Returns:
             The API response
@@ -57,42 +341,204 @@ class API:
         Raises:
             APIHTTPError if request failed
         """
+        return self._check(self._post(query, variables, priority)).json()
+
+    def cached_query(
+            self,
+            query: str,
+            variables: Optional[dict] = None,
+            kind: str = 'default',
+            priority: Priority = Priority.INTERACTIVE
+    ) -> dict:
+        """
+        Makes HTTP request to the Anilist API through the response cache.
+
+        Fresh responses are returned from the cache. Stale responses that
+        are still within their kind's stale time are returned from the
+        cache and refreshed in the background. Older responses are
+        revalidated with their ETag before returning.
+
+        Args:
+            query: The GraphQL query to POST to the API
+            variables: variables for the query, can be None
+            kind: The kind of the response, see ene.api.cache.TTLS
+            priority: The priority of the request
+
+        Returns:
+            The API response
+
+        Raises:
+            APIHTTPError if request failed
+        """
+        if self.cache is None:
+            return self.query(query, variables, priority)
+        # Per token, so one user's list statuses are not shown to another
+        key = cache_key(query, variables, self.token)
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh:
+            return entry.response
+        if entry is not None and entry.usable and self.pool is not None:
+            with self._refreshing_lock:
+                refresh = key not in self._refreshing
+                self._refreshing.add(key)
+            if refresh:
+                self.pool.submit(self._refresh, key, query, variables, kind, entry)
+            return entry.response
+        return self._revalidate(key, query, variables, kind, entry, priority)
+
+    def _refresh(self, key: str, query: str, variables: Optional[dict], kind: str,
+                 entry: CacheEntry):
+        """Refreshes a stale cached response in the background."""
+        try:
+            self._revalidate(key, query, variables, kind, entry, Priority.BACKGROUND)
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.discard(key)
+
+    def _revalidate(
+            self,
+            key: str,
+            query: str,
+            variables: Optional[dict],
+            kind: str,
+            entry: Optional[CacheEntry],
+            priority: Priority
+    ) -> dict:
+        """
+        Fetches a response and caches it, sending the ETag of the cached
+        response so an unchanged response does not need to be sent again
+
+        Args:
+            key: The cache key
+            query: The GraphQL query to POST to the API
+            variables: variables for the query, can be None
+            kind: The kind of the response
+            entry: The cached response, if any
+            priority: The priority of the request
+
+        Returns:
+            The API response
+        """
+        headers = {'If-None-Match': entry.etag} if entry is not None and entry.etag else None
+        res = self._post(query, variables, priority, headers)
+        if res.status_code == 304 and entry is not None:
+            self.cache.touch(key)
+            return entry.response
+        response = self._check(res).json()
+        if not response.get('errors'):
+            self.cache.put(key, kind, response, res.headers.get('ETag'))
+        return response
+
+    def _post(
+            self,
+            query: str,
+            variables: Optional[dict],
+            priority: Priority,
+            headers: Optional[dict] = None
+    ) -> Response:
+        """
+        Posts a query once the rate limit allows, retrying responses with
+        status 429 or 5xx
+
+        Args:
+            query: The GraphQL query to POST to the API
+            variables: variables for the query, can be None
+            priority: The priority of the request
+            headers: Extra request headers
+
+        Returns:
+            The last response
+        """
         post_json = {'query': query}
         if variables:
             post_json['variables'] = variables
 
-        res = self.session.post(GRAPHQL_URL, json=post_json)
+        for attempt in count():
+            self.scheduler.acquire(priority)
+            res = self.session.post(self.url, json=post_json, headers=headers)
+            self.scheduler.update(res.headers)
+            delay = self.scheduler.retry_delay(res.status_code, attempt)
+            if delay is None:
+                return res
+            sleep(delay)
+
+    @staticmethod
+    def _check(res: Response) -> Response:
+        """
+        Checks the status of a response
+
+        Args:
+            res: The response
+
+        Returns:
+            The response
+
+        Raises:
+            APIHTTPError if request failed
+        """
         try:
             res.raise_for_status()
         except HTTPError as http_ex:
             try:
-                json = res.json()
+                payload = res.json()
             except Exception as e:  # pylint: disable=W0703
-                msg = f'{http_ex}\n{e}'
-            else:
-                msg_lst = []
-                errors = json.get('errors', [])
-                if errors:
-                    for err in errors:
-                        msg_lst.append(err.get('message'))
-                msg = '\n'.join(m for m in msg_lst if m) or str(http_ex)
-            raise APIError(res.status_code, msg)
-        else:
-            return res.json()
+                raise APIError(res.status_code, f'{http_ex}\n{e}')
+            raise api_error(res.status_code, payload, str(http_ex))
+        return res
+
+    def query_batch(self, subqueries: List[Subquery], return_exceptions: bool = False) -> List:
+        """
+        Makes requests to the Anilist API for several queries at once, merging
+        them into aliased multi-field documents
+
+        Args:
+            subqueries: The queries
+            return_exceptions: True to return the errors of failed queries
+                in place of their results instead of raising them
+
+        Returns:
+            The data of every query, in the same order
+
+        Raises:
+            APIError if a query failed and return_exceptions is False
+        """
+        return self.batcher.run(subqueries, return_exceptions)
+
+    def submit(self, subquery: Subquery) -> Future:
+        """
+        Queues a query to be merged with other queries submitted within a
+        short window of it
+
+        Args:
+            subquery: The query
+
+        Returns:
+            A future for the data of the query
+        """
+        return self.batcher.submit(subquery)
 
     def query_pages(
             self,
             query: str,
             per_page: int,
-            variables: Optional[dict] = None
+            variables: Optional[dict] = None,
+            prefetch: int = PREFETCH
     ) -> Iterable[dict]:
         """
         Make paged requests to the Anilist API
 
+        Up to `prefetch` pages after the one being consumed are requested
+        concurrently, so at most that many pages are held in memory. Until
+        `pageInfo.lastPage` is known, pages are requested speculatively and
+        the ones past the end are discarded. Pages are always yielded in
+        order.
+
         Args:
             query: The GraphQL query to POST to the API
             per_page: Number of items per page
             variables: variables for the query, can be None
+            prefetch: Number of pages to request ahead, 1 to request
+                them one at a time
 
         Yields:
             Each page of the API response
@@ -101,16 +547,32 @@ class API:
             APIHTTPError if request failed
         """
         variables = variables.copy() if variables else {}
-        variables['page'] = 1
         variables['perPage'] = per_page
 
-        while True:
-            res = self.query(query, variables)
-            has_next = res['data']['Page']['pageInfo']['hasNextPage']
-            yield res
-            if not has_next:
-                return
-            variables['page'] += 1
+        def fetch(page):
+            return self.query(query, dict(variables, page=page))
+
+        with ThreadPoolExecutor(prefetch, 'Pager') as pool:
+            pending = deque([pool.submit(fetch, 1)])
+            next_page = 2
+            last_page = None
+            try:
+                while pending:
+                    res = pending.popleft().result()
+                    page_info = res['data']['Page']['pageInfo']
+                    if not page_info['hasNextPage']:
+                        yield res
+                        return
+                    last_page = page_info.get('lastPage') or last_page
+                    # lastPage can lag behind, keep going while there is a next page
+                    while len(pending) < prefetch and (
+                            not pending or last_page is None or next_page <= last_page):
+                        pending.append(pool.submit(fetch, next_page))
+                        next_page += 1
+                    yield res
+            finally:
+                for future in pending:
+                    future.cancel()
 
     def browse_anime(  # pylint: disable=R0914
             self,
@@ -152,127 +614,15 @@ class API:
         Returns:
             The page anime returned and if there's a next page
         """
-        query = """\
-query (
-$page: Int = 1,
-$isAdult: Boolean = false,
-$search: String,
-$format: MediaFormat
-$status: MediaStatus,
-$season: MediaSeason,
-$year: String,
-$onList: Boolean,
-$yearLesser: FuzzyDateInt,
-$yearGreater: FuzzyDateInt,
-$licensedBy: [String],
-$includedGenres: [String],
-$excludedGenres: [String],
-$includedTags: [String],
-$excludedTags: [String],
-$sort: [MediaSort] = [SCORE_DESC, POPULARITY_DESC],
-$perPage: Int,
-) {
-    Page (page: $page, perPage: $perPage) {
-        pageInfo {
-            total
-            perPage
-            currentPage
-            lastPage
-            hasNextPage
-        }
-        media (
-            type: ANIME,
-            season: $season,
-            format: $format,
-            status: $status,
-            search: $search,
-            onList: $onList,
-            startDate_like: $year,
-            startDate_lesser: $yearLesser,
-            startDate_greater: $yearGreater,
-            licensedBy_in: $licensedBy,
-            genre_in: $includedGenres,
-            genre_not_in: $excludedGenres,
-            tag_in: $includedTags,
-            tag_not_in: $excludedTags,
-            sort: $sort,
-            isAdult: $isAdult
-        ) {
-            id
-            title {
-                userPreferred
-            }
-            coverImage {
-                large
-            }
-            bannerImage
-            startDate {
-                year
-                month
-                day
-            }
-            endDate {
-                year
-                month
-                day
-            }
-            season
-            description
-            type
-            format
-            status
-            genres
-            isAdult
-            averageScore
-            popularity
-            mediaListEntry {
-                status
-            }
-            nextAiringEpisode {
-                airingAt
-                timeUntilAiring
-                episode
-            }
-            studios (isMain: true) {
-                edges {
-                    isMain
-                    node {
-                        id
-                        name
-                    }
-                }
-            }
-        }
-    }
-}"""
-        variables = dict_filter({
-            'page': page,
-            'isAdult': is_adult,
-            'search': search,
-            'format': format_.name if format_ else None,
-            'status': status.name if status else None,
-            'season': season.name if season else None,
-            'onList': on_list,
-            'licensedBy': licensed_by,
-            'includedGenres': included_genres,
-            'excludedGenres': excluded_genres,
-            'includedTags': included_tags,
-            'excludedTags': excluded_tags,
-        })
-        if sort:
-            variables['sort'] = [s.name for s in sort]
-        if year_range and year_range[0] and year_range[1]:
-            start, fin = year_range
-            if start == fin:
-                variables['year'] = f'{start}%'
-            else:
-                variables['yearGreater'] = start * 10000
-                variables['yearLesser'] = fin * 10000
-        res = self.query(query, variables).get('data', {}).get('Page', {})
+        variables = browse_anime_variables(
+            page, is_adult, search, format_, status, season, year_range, on_list, licensed_by,
+            included_genres, excluded_genres, included_tags, excluded_tags, sort
+        )
+        res = self.cached_query(BROWSE_ANIME_QUERY, variables, 'browse')
+        res = res.get('data', {}).get('Page', {})
         has_next = res.get('pageInfo', {}).get('hasNextPage', False)
         return res.get('media', []), has_next
 
-    @lru_cache(maxsize=None)
     def get_genres(self) -> List[str]:
         """
         Get all genres
@@ -281,10 +631,9 @@ $perPage: Int,
             List of genres
         """
         query = '{GenreCollection}'
-        res = self.query(query)
+        res = self.cached_query(query, kind='taxonomy')
         return res['data']['GenreCollection']
 
-    @lru_cache(maxsize=None)
     def get_tags(self) -> List[dict]:
         """
         Get all tags
@@ -303,7 +652,7 @@ $perPage: Int,
         isMediaSpoiler
     }
 }"""
-        res = self.query(query)
+        res = self.cached_query(query, kind='taxonomy')
         return res['data']['MediaTagCollection']
 
     def get_show(self, show):
@@ -317,21 +666,7 @@ $perPage: Int,
         Returns:
             Information about the show
         """
-        query = """\
-        query ($title: String) {
-            Media(search: $title, type: ANIME) {
-                id
-                coverImage {
-                    large
-                     medium
-                }
-            }
-        }"""
-        variables = {
-            'title': show
-        }
-        res = self.query(query, variables)
-        return res
+        return self.query(GET_SHOW_QUERY, {'title': show})
 
     def update_media_list_entry(  # pylint: disable=R0913
             self,
@@ -362,57 +697,7 @@ $perPage: Int,
         Returns:
             The updated media entry values.
         """
-        query = """\
-mutation (
-    $mediaId: Int,
-    $status: MediaListStatus,
-    $score: Float,
-    $progress: Int,
-    $customLists: Json,
-    $private: Boolean,
-    $startedAt: FuzzyDate,
-    $completedAt: FuzzyDate,
-    $repeat: Int
-) {
-    SaveMediaListEntry (
-        mediaId: $mediaId,
-        status: $status,
-        score: $score,
-        progress: $progress,
-        customLists: $customLists,
-        private: $private,
-        startedAt: $startedAt,
-        completedAt: $completedAt,
-        repeat: $repeat
-    ) {
-        id
-        status
-        score
-        progress
-        customLists
-        private
-        startedAt
-        completedAt
-        repeat
-    }
-}"""
-        variables = dict_filter({
-            "mediaId": id_,
-            "status": status.name if status else None,
-            "score": score,
-            "progress": progress,
-            "customLists": custom_lists,
-            "private": private,
-            "startedAt": {
-                "year": started_at.year,
-                "month": started_at.month,
-                "day": started_at.day
-            } if started_at else None,
-            "completedAt": {
-                "year": completed_at.year,
-                "month": completed_at.month,
-                "day": completed_at.day
-            } if completed_at else None,
-            "repeat": repeat,
-        })
-        return self.query(query, variables)
+        variables = media_list_entry_variables(
+            id_, status, score, progress, custom_lists, private, started_at, completed_at, repeat
+        )
+        return self.query(UPDATE_MEDIA_LIST_ENTRY_QUERY, variables)
@@ -0,0 +1,280 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module batches GraphQL queries into aliased multi-field requests."""
+import re
+from concurrent.futures import Future
+from threading import Condition, Thread
+from time import monotonic
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from ene.errors import APIError
+
+# Maximum number of queries merged into a single request
+BATCH_SIZE = 10
+# Maximum length in characters of a merged query document
+MAX_QUERY_LENGTH = 16 * 1024
+# Seconds submitted queries wait for others to be merged with
+WINDOW = 0.05
+# HTTP statuses a single bad query can cause, only these split a request
+SPLIT_STATUSES = frozenset((400, 404))
+
+_VARIABLE = re.compile(r'\$(\w+)')
+
+
+class Subquery(NamedTuple):
+    """
+    A single root field to query as part of a batch, for example
+    `Media(id: $id) { id }` with variables {'id': 1} of types {'id': 'Int'}
+    """
+    field: str
+    variables: Optional[Dict[str, Any]] = None
+    types: Optional[Dict[str, str]] = None
+
+
+def merge(subqueries: List[Subquery], operation: str = 'query') -> Tuple[str, dict]:
+    """
+    Merges queries into one document, the i-th query is aliased as ai and its
+    variables are prefixed with ai_
+
+    Args:
+        subqueries: The queries
+        operation: The operation type, 'mutation' to merge mutations, which
+            the API runs in order
+
+    Returns:
+        The merged query and its variables
+    """
+    params = []
+    fields = []
+    variables = {}
+    for i, sub in enumerate(subqueries):
+        alias = f'a{i}'
+        params.extend(f'${alias}_{name}: {type_}' for name, type_ in (sub.types or {}).items())
+        variables.update((f'{alias}_{name}', value)
+                         for name, value in (sub.variables or {}).items())
+        field = _VARIABLE.sub(lambda match: f'${alias}_{match.group(1)}', sub.field)
+        fields.append(f'{alias}: {field}')
+    header = f'{operation} ({", ".join(params)})' if params else operation
+    body = '\n'.join(fields)
+    return f'{header} {{\n{body}\n}}', variables
+
+
+def split(response: dict, count: int) -> List[Union[Any, APIError]]:
+    """
+    Splits the response to a merged query back into the result of every query
+
+    Args:
+        response: The API response
+        count: The number of merged queries
+
+    Returns:
+        The data of every query, or an APIError for the queries that failed
+    """
+    data = response.get('data') or {}
+    errors = {}
+    for error in response.get('errors') or ():
+        path = error.get('path') or ('',)
+        errors.setdefault(path[0], []).append(error.get('message') or 'Unknown error')
+    res = []
+    for i in range(count):
+        alias = f'a{i}'
+        if data.get(alias) is None and alias in errors:
+            res.append(APIError('\n'.join(errors[alias])))
+        else:
+            res.append(data.get(alias))
+    return res
+
+
+def error_status(error: APIError) -> Optional[int]:
+    """
+    Finds the HTTP status of a failed request
+
+    Args:
+        error: The error
+
+    Returns:
+        The status, None if the error does not have one
+    """
+    status = getattr(error, 'status', None)
+    if status is None and error.args and isinstance(error.args[0], int):
+        status = error.args[0]
+    return status
+
+
+class QueryBatcher:
+    """
+    Sends several queries in as few requests as possible.
+
+    Queries are merged into aliased documents of at most `max_size` queries
+    and `max_length` characters. If a merged request fails as a whole, it is
+    split in half and retried so only the failing queries see the error.
+
+    Queries can also be submitted one at a time from any thread. Queries
+    submitted within `window` seconds of each other are sent together.
+    """
+
+    def __init__(
+            self,
+            query: Callable[[str, dict], dict],
+            max_size: int = BATCH_SIZE,
+            max_length: int = MAX_QUERY_LENGTH,
+            window: float = WINDOW
+    ):
+        """
+        Args:
+            query: Function sending a query and its variables to the API
+            max_size: Maximum number of queries merged into a single request
+            max_length: Maximum length in characters of a merged query
+            window: Seconds submitted queries wait for others to be merged with
+        """
+        self.query = query
+        self.max_size = max_size
+        self.max_length = max_length
+        self.window = window
+        self._pending: List[Tuple[Subquery, Future]] = []
+        self._cond = Condition()
+        self._thread = None
+
+    def run(self, subqueries: List[Subquery], return_exceptions: bool = False) -> List:
+        """
+        Sends queries in batches and waits for the results
+
+        Args:
+            subqueries: The queries
+            return_exceptions: True to return the errors of failed queries
+                in place of their results instead of raising them
+
+        Returns:
+            The data of every query, in the same order
+
+        Raises:
+            APIError if a query failed and return_exceptions is False
+            OSError if a request could not be sent and return_exceptions is
+            False
+        """
+        res = []
+        error = None
+        for chunk in self._chunks(subqueries):
+            if error is None:
+                try:
+                    res.extend(self._send(chunk))
+                    continue
+                except (APIError, OSError) as e:
+                    # Rate limited, server error or offline, the queries not
+                    # sent yet would fail the same way
+                    error = e
+            res.extend([error] * len(chunk))
+        if not return_exceptions:
+            for item in res:
+                if isinstance(item, (APIError, OSError)):
+                    raise item
+        return res
+
+    def submit(self, subquery: Subquery) -> Future:
+        """
+        Queues a query to be sent together with other queries submitted
+        shortly after it
+
+        Args:
+            subquery: The query
+
+        Returns:
+            A future for the data of the query
+        """
+        future = Future()
+        with self._cond:
+            self._pending.append((subquery, future))
+            if self._thread is None:
+                self._thread = Thread(target=self._flush, name='QueryBatcher', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _chunks(self, subqueries: List[Subquery]) -> Iterator[List[Subquery]]:
+        """
+        Splits queries into batches within the size and length caps
+
+        Args:
+            subqueries: The queries
+
+        Yields:
+            Lists of queries to merge into a single request
+        """
+        chunk = []
+        length = 0
+        for sub in subqueries:
+            size = len(sub.field) + sum(len(name) + len(type_) + 12
+                                        for name, type_ in (sub.types or {}).items())
+            if chunk and (len(chunk) >= self.max_size or length + size > self.max_length):
+                yield chunk
+                chunk = []
+                length = 0
+            chunk.append(sub)
+            length += size
+        if chunk:
+            yield chunk
+
+    def _send(self, subqueries: List[Subquery]) -> List[Union[Any, APIError]]:
+        """
+        Sends queries in a single request, splitting it if it fails
+
+        Args:
+            subqueries: The queries
+
+        Returns:
+            The data of every query, or an APIError for the queries that failed
+
+        Raises:
+            APIError if the request failed for a reason no single query
+            causes, such as rate limits or server errors
+        """
+        query, variables = merge(subqueries)
+        try:
+            response = self.query(query, variables)
+        except APIError as e:
+            if error_status(e) not in SPLIT_STATUSES:
+                raise
+            if len(subqueries) == 1:
+                return [e]
+            mid = len(subqueries) // 2
+            return self._send(subqueries[:mid]) + self._send(subqueries[mid:])
+        return split(response, len(subqueries))
+
+    def _flush(self):
+        """Sends submitted queries once the window closes or a batch is full."""
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = monotonic() + self.window
+                while len(self._pending) < self.max_size:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_size]
+                self._pending = self._pending[self.max_size:]
+            try:
+                results = self.run([sub for sub, _ in batch], return_exceptions=True)
+            except Exception as e:  # pylint: disable=W0703
+                results = [e] * len(batch)
+            for (_, future), res in zip(batch, results):
+                if isinstance(res, Exception):
+                    future.set_exception(res)
+                else:
+                    future.set_result(res)
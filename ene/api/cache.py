@@ -0,0 +1,188 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module caches API responses on disk."""
+import json
+import sqlite3
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# Seconds a response of each kind is fresh, and seconds it may be served
+# stale while it is refreshed in the background
+TTLS: Dict[str, Tuple[int, int]] = {
+    'taxonomy': (7 * 24 * 60 * 60, 30 * 24 * 60 * 60),  # Genres and tags
+    'browse': (10 * 60, 24 * 60 * 60),  # Media browser pages
+    'default': (60, 60 * 60),
+}
+# Maximum total size of the cached responses in bytes
+MAX_BYTES = 64 * 1024 * 1024
+# Fraction of the maximum size eviction shrinks the cache to
+EVICT_TO = 0.9
+
+
+class CacheEntry(NamedTuple):
+    """A cached response."""
+    response: dict
+    etag: Optional[str]
+    age: float
+    fresh: bool
+    usable: bool
+
+
+def cache_key(query: str, variables: Optional[dict], viewer: Optional[str] = None) -> str:
+    """
+    Gets the cache key of a query
+
+    Args:
+        query: The GraphQL query
+        variables: The variables of the query
+        viewer: The access token the query is sent with, responses can hold
+            fields of the viewer such as their list entries
+
+    Returns:
+        A hash of the query, its variables and the viewer
+    """
+    payload = json.dumps([query, variables or {}, viewer], sort_keys=True)
+    return sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Disk cache of API responses in a sqlite database.
+
+    Responses are keyed by the hash of their query, variables and viewer. Each
+    response has a kind that decides how long it stays fresh and how long it
+    may be served stale, see TTLS. Once the cache grows over `max_bytes` the
+    least recently used responses are evicted.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = MAX_BYTES, ttls=None):
+        """
+        Args:
+            path: The cache database file
+            max_bytes: Maximum total size of the cached responses in bytes
+            ttls: Fresh and stale seconds of each kind, defaults to TTLS
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttls = dict(TTLS, **(ttls or {}))
+        self._lock = Lock()
+        self._connection = sqlite3.connect(str(path), isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS Response(
+            key TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            body TEXT NOT NULL,
+            etag TEXT,
+            stored_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            size INTEGER NOT NULL
+            )""")
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS Response_accessed_at ON Response(accessed_at)'
+        )
+        self._size = self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM Response'
+        ).fetchone()[0]
+
+    def __del__(self):
+        self._connection.close()
+
+    @property
+    def size(self) -> int:
+        """The total size of the cached responses in bytes."""
+        return self._size
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Gets a cached response
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cached response, None if it is not cached
+        """
+        now = time()
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT kind, body, etag, stored_at FROM Response WHERE key=?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute('UPDATE Response SET accessed_at=? WHERE key=?', (now, key))
+        kind, body, etag, stored_at = row
+        fresh, stale = self.ttls.get(kind, self.ttls['default'])
+        age = now - stored_at
+        return CacheEntry(json.loads(body), etag, age, age < fresh, age < fresh + stale)
+
+    def put(self, key: str, kind: str, response: dict, etag: Optional[str] = None):
+        """
+        Caches a response, evicting the least recently used responses if the
+        cache grows too large
+
+        Args:
+            key: The cache key
+            kind: The kind of the response, a key of the TTLs
+            response: The response
+            etag: The ETag header of the response
+        """
+        body = json.dumps(response)
+        now = time()
+        with self._lock:
+            old = self._connection.execute('SELECT size FROM Response WHERE key=?',
+                                           (key,)).fetchone()
+            self._connection.execute("""INSERT OR REPLACE INTO Response(
+                key, kind, body, etag, stored_at, accessed_at, size)
+                VALUES (?,?,?,?,?,?,?)""", (key, kind, body, etag, now, now, len(body)))
+            self._size += len(body) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def touch(self, key: str):
+        """
+        Marks a cached response as fresh again after it was revalidated
+
+        Args:
+            key: The cache key
+        """
+        now = time()
+        with self._lock:
+            self._connection.execute(
+                'UPDATE Response SET stored_at=?, accessed_at=? WHERE key=?', (now, now, key)
+            )
+
+    def _evict(self):
+        """
+        Evicts the least recently used responses until the cache is below
+        EVICT_TO of its maximum size, so eviction does not run on every put
+        """
+        rows = self._connection.execute(
+            'SELECT key, size FROM Response ORDER BY accessed_at'
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._size <= self.max_bytes * EVICT_TO:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._connection.executemany('DELETE FROM Response WHERE key=?', evicted)
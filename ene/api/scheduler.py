@@ -0,0 +1,240 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module schedules requests within the AniList rate limit."""
+import heapq
+import random
+from enum import IntEnum
+from itertools import count
+from threading import Condition, Lock
+from time import monotonic, time
+from typing import Dict, Mapping, Optional
+
+# Requests per minute allowed by AniList
+RATE_LIMIT = 90
+# Number of times a request is retried after a 429 or 5xx response
+MAX_RETRIES = 4
+# Seconds of the first retry delay, doubled for every retry after it
+BASE_DELAY = 1.0
+# Maximum seconds of a single retry delay
+MAX_DELAY = 60.0
+
+
+class Priority(IntEnum):
+    """Priority of a request, lower values are sent first."""
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class SchedulerMetrics:
+    """
+    Counters describing the requests a scheduler sent
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.queued: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of requests waiting to be sent."""
+        return sum(self.queued.values())
+
+    @property
+    def mean_wait(self) -> float:
+        """The mean seconds requests waited before being sent."""
+        return self.total_wait / self.requests if self.requests else 0.0
+
+    def record_wait(self, seconds: float):
+        """
+        Records a request that was sent
+
+        Args:
+            seconds: The seconds the request waited for
+        """
+        with self._lock:
+            self.requests += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def record_retry(self, throttled: bool):
+        """
+        Records a request that is retried
+
+        Args:
+            throttled: True if it was rejected by the rate limit
+        """
+        with self._lock:
+            self.retries += 1
+            if throttled:
+                self.throttled += 1
+
+    def __repr__(self):
+        return (f'SchedulerMetrics(queue_depth={self.queue_depth}, '
+                f'requests={self.requests}, retries={self.retries}, '
+                f'throttled={self.throttled}, mean_wait={self.mean_wait:.3f}, '
+                f'max_wait={self.max_wait:.3f})')
+
+
+class RequestScheduler:
+    """
+    Token bucket limiting the rate requests are sent at.
+
+    The bucket holds up to `limit` tokens and refills at `limit` tokens per
+    minute. The rate limit headers of every response correct the bucket to
+    the budget the server reports, and a Retry-After header holds back every
+    request until it passed. Waiting requests are sent in order of priority,
+    then in the order they arrived.
+    """
+
+    def __init__(
+            self,
+            limit: int = RATE_LIMIT,
+            max_retries: int = MAX_RETRIES,
+            base_delay: float = BASE_DELAY,
+            max_delay: float = MAX_DELAY
+    ):
+        """
+        Args:
+            limit: Requests per minute
+            max_retries: Number of times a request is retried
+            base_delay: Seconds of the first retry delay
+            max_delay: Maximum seconds of a single retry delay
+        """
+        self.limit = limit
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = SchedulerMetrics()
+        self._tokens = float(limit)
+        self._refilled = monotonic()
+        self._blocked_until = 0.0
+        self._waiting = []
+        self._tickets = count()
+        self._cond = Condition()
+
+    @property
+    def tokens(self) -> float:
+        """The number of requests that can be sent right now."""
+        with self._cond:
+            self._refill()
+            return self._tokens
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.limit, self._tokens + (now - self._refilled) * self.limit / 60)
+        self._refilled = now
+
+    def acquire(self, priority: Priority = Priority.INTERACTIVE) -> float:
+        """
+        Blocks until a request may be sent
+
+        Args:
+            priority: The priority of the request
+
+        Returns:
+            The seconds waited
+        """
+        start = monotonic()
+        with self._cond:
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            self.metrics.queued[priority] += 1
+            try:
+                while True:
+                    self._refill()
+                    now = monotonic()
+                    if self._waiting[0] != ticket:
+                        self._cond.wait()
+                    elif now < self._blocked_until:
+                        self._cond.wait(self._blocked_until - now)
+                    elif self._tokens < 1:
+                        self._cond.wait((1 - self._tokens) * 60 / self.limit)
+                    else:
+                        self._tokens -= 1
+                        break
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self.metrics.queued[priority] -= 1
+                self._cond.notify_all()
+        waited = monotonic() - start
+        self.metrics.record_wait(waited)
+        return waited
+
+    def update(self, headers: Mapping[str, str]):
+        """
+        Corrects the bucket with the rate limit headers of a response
+
+        Args:
+            headers: The response headers
+        """
+        limit = _int_header(headers, 'X-RateLimit-Limit')
+        remaining = _int_header(headers, 'X-RateLimit-Remaining')
+        retry_after = _int_header(headers, 'Retry-After')
+        reset = _int_header(headers, 'X-RateLimit-Reset')
+        with self._cond:
+            self._refill()
+            if limit:
+                self.limit = limit
+            if remaining is not None:
+                self._tokens = min(self._tokens, remaining)
+            if retry_after is None and remaining == 0 and reset is not None:
+                retry_after = reset - time()
+            if retry_after is not None and retry_after > 0:
+                self._tokens = 0
+                self._blocked_until = max(self._blocked_until, monotonic() + retry_after)
+            self._cond.notify_all()
+
+    def retry_delay(self, status: int, attempt: int) -> Optional[float]:
+        """
+        Gets how long to wait before retrying a failed request
+
+        Args:
+            status: The HTTP status of the response
+            attempt: The number of retries made so far
+
+        Returns:
+            The seconds to wait, None if the request should not be retried
+        """
+        if attempt >= self.max_retries or not (status == 429 or 500 <= status < 600):
+            return None
+        self.metrics.record_retry(status == 429)
+        # Full jitter: a random delay up to the exponential backoff
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def _int_header(headers: Mapping[str, str], name: str) -> Optional[int]:
+    """
+    Reads an integer header
+
+    Args:
+        headers: The headers
+        name: The header name
+
+    Returns:
+        The header value, None if it is missing or not an integer
+    """
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
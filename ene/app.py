@@ -51,9 +51,10 @@ class App(QApplication):
             path.mkdir(parents=True, exist_ok=True)
         self.config = Config(config_home)
         self.pool = ThreadPoolExecutor()
-        self.api = API(data_home)
+        self.api = API(data_home, cache_home, self.pool)
         self.main_window = MainWindow(self)
         self.settings_window = SettingsWindow(self)
+        self.settings_window.settings_saved_signal.connect(self.main_window.on_settings_changed)
         self.main_window.action_prefences.triggered.connect(self.settings_window.show)
 
 
@@ -68,7 +69,7 @@ def launch(config_home=CONFIG_HOME, data_home=DATA_HOME, cache_home=CACHE_HOME,
         test: True to use test mode, default False
     """
     if test:
-        API.query = lambda *args, **kwargs: {}
+        API.query = API.cached_query = lambda *args, **kwargs: {}
     app = App(config_home, data_home, cache_home)
     if test:
         QTimer.singleShot(5000, app.quit)
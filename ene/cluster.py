@@ -0,0 +1,245 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module groups near-duplicate show titles into series."""
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from Levenshtein import ratio
+
+# Minimum Levenshtein ratio of two normalized titles to merge them
+THRESHOLD = 0.9
+# Number of following titles each title is compared to inside a block
+WINDOW = 16
+
+_ORDINALS = {
+    'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5,
+    'sixth': 6, 'seventh': 7, 'eighth': 8, 'ninth': 9, 'tenth': 10,
+}
+_ORDINAL_WORDS = '|'.join(_ORDINALS)
+_NOT_WORD = re.compile(r'[\W_]+')  # Punctuation and separators
+_SEASON_PATTERNS = (
+    re.compile(r'\b(\d+)(?:st|nd|rd|th) season\b'),  # 2nd Season
+    re.compile(rf'\b({_ORDINAL_WORDS}) season\b'),  # Second Season
+    re.compile(r'\bseason (\d+)\b'),  # Season 2
+    re.compile(r'\bs(\d+)\b'),  # S2
+)
+_NUMBER = re.compile(r'\d+')
+# Symbols after the last word that mark a sequel, such as Gintama' or K-On!!
+_SUFFIX = re.compile(r'[^\w\s.)\]]+$')
+_ROMAN = re.compile(r'^(?=[ivx])x{0,3}(ix|iv|v?i{0,3})$')
+# Words that number a sequel when they are the only difference between titles
+_NUMBER_WORDS = frozenset(
+    ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+     'ichi', 'ni', 'san', 'shi', 'yon', 'go', 'roku', 'nana', 'shichi', 'hachi', 'kyuu',
+     'ku', 'juu', 'zoku', 'final']
+).union(_ORDINALS)
+
+
+class TitleKey(NamedTuple):
+    """A title normalized for comparison."""
+    base: str
+    season: int
+    numbers: Tuple[str, ...]
+    suffix: str = ''
+
+
+def title_key(title: str) -> TitleKey:
+    """
+    Normalizes a title for comparison. The title is lower cased, punctuation
+    is removed and the season is taken out, so "Show S2", "Show Season 2" and
+    "Show 2nd Season" all get the same key.
+
+    Args:
+        title: The title
+
+    Returns:
+        The normalized title without the season, the season, the other
+        numbers in the title and the symbols it ends with
+    """
+    title = title.strip().lower()
+    match = _SUFFIX.search(title)
+    suffix = match.group() if match else ''
+    text = _NOT_WORD.sub(' ', title)
+    season = 1
+    for pattern in _SEASON_PATTERNS:
+        match = pattern.search(text)
+        if match is not None:
+            value = match.group(1)
+            season = _ORDINALS[value] if value in _ORDINALS else int(value)
+            text = text[:match.start()] + text[match.end():]
+            break
+    base = ' '.join(text.split())
+    return TitleKey(base, season, tuple(_NUMBER.findall(base)), suffix)
+
+
+def _blocking_keys(key: TitleKey) -> Iterable[tuple]:
+    """
+    Gets the blocks a title is compared in. Titles only ever merge with
+    titles of the same season, numbers and suffix, a typo in the first word is
+    caught by the block of the last word and vice versa.
+
+    Args:
+        key: The normalized title
+
+    Yields:
+        The blocking keys
+    """
+    words = key.base.split()
+    if not words:
+        return
+    yield key.season, key.numbers, key.suffix, 'first', words[0][:3]
+    if len(words) > 1:
+        yield key.season, key.numbers, key.suffix, 'last', words[-1][:3]
+
+
+class _UnionFind:
+    """Disjoint sets of titles."""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        parent = self.parent.setdefault(item, item)
+        if parent != item:
+            parent = self.parent[item] = self.find(parent)
+        return parent
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+
+def _is_number_word(word: str) -> bool:
+    """
+    Args:
+        word: A word of a normalized title
+
+    Returns:
+        True if the word is a roman numeral or a number word
+    """
+    return word in _NUMBER_WORDS or _ROMAN.match(word) is not None
+
+
+def _similar(a: str, b: str, threshold: float) -> bool:
+    """
+    Checks if two normalized titles only differ by spelling inside the same
+    words and are within the Levenshtein threshold.
+
+    Titles with a word more or less, or differing in a roman numeral or
+    number word, are different shows, such as "Show" and "Show II" or
+    "Show San" and "Show Shi".
+
+    Args:
+        a: A normalized title
+        b: Another normalized title
+        threshold: The minimum ratio
+
+    Returns:
+        True if the titles are similar enough to merge
+    """
+    shorter, longer = sorted((len(a), len(b)))
+    if 2 * shorter < threshold * (shorter + longer):
+        return False
+    words_a = a.split()
+    words_b = b.split()
+    if len(words_a) != len(words_b):
+        return False
+    for word_a, word_b in zip(words_a, words_b):
+        if word_a != word_b and (_is_number_word(word_a) or _is_number_word(word_b)):
+            return False
+    return ratio(a, b) >= threshold
+
+
+def same_show(a: str, b: str, threshold: float = THRESHOLD) -> bool:
+    """
+    Checks if two titles are near-duplicates that cluster_titles merges
+
+    Args:
+        a: A title
+        b: Another title
+        threshold: Minimum Levenshtein ratio of normalized titles to merge
+
+    Returns:
+        True if the titles belong to the same show
+    """
+    key_a = title_key(a)
+    key_b = title_key(b)
+    if key_a == key_b:
+        return True
+    if key_a[1:] != key_b[1:]:
+        return False
+    return _similar(key_a.base, key_b.base, threshold)
+
+
+def cluster_titles(
+        titles: Iterable[str],
+        weights: Optional[Dict[str, int]] = None,
+        threshold: float = THRESHOLD,
+        window: int = WINDOW
+) -> Dict[str, str]:
+    """
+    Groups near-duplicate titles.
+
+    Titles with the same normalized key are grouped directly. Distinct keys
+    are only compared inside blocks of keys sharing a season, numbers and a
+    word prefix, and inside a block each key is only compared to the next
+    `window` keys in sorted order, so the number of comparisons grows
+    linearly with the number of titles.
+
+    Args:
+        titles: The titles
+        weights:
+            Weight of every title, the heaviest title of a group is used as
+            the name of the group. Ties go to the shortest title.
+        threshold: Minimum Levenshtein ratio of normalized titles to merge
+        window: Number of following keys each key is compared to in a block
+
+    Returns:
+        Mapping of every title to the name of its group
+    """
+    weights = weights or {}
+    keys = {title: title_key(title) for title in titles}
+    sets = _UnionFind()
+    by_key = {}
+    for title, key in keys.items():
+        if key in by_key:
+            sets.union(title, by_key[key])
+        else:
+            by_key[key] = title
+            sets.find(title)
+
+    blocks = defaultdict(list)
+    for key in by_key:
+        for block in _blocking_keys(key):
+            blocks[block].append(key)
+    for block in blocks.values():
+        block.sort()
+        for i, key in enumerate(block):
+            for other in block[i + 1:i + 1 + window]:
+                if _similar(key.base, other.base, threshold):
+                    sets.union(by_key[key], by_key[other])
+
+    groups: Dict[str, List[str]] = defaultdict(list)
+    for title in keys:
+        groups[sets.find(title)].append(title)
+    res = {}
+    for members in groups.values():
+        name = min(members, key=lambda title: (-weights.get(title, 0), len(title), title))
+        for title in members:
+            res[title] = name
+    return res
@@ -15,9 +15,258 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """ This module handles database access"""
+import json
+import os
+import re
 import sqlite3
 from collections import defaultdict
+from contextlib import contextmanager
+from itertools import count
 from pathlib import Path, PosixPath
+from threading import Lock, local
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from Levenshtein import ratio
+
+# Pragmas applied to every connection
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',  # Readers do not block the writer and vice versa
+    'PRAGMA synchronous = NORMAL',  # Safe with WAL, no fsync per commit
+    'PRAGMA cache_size = -16000',  # 16 MiB page cache per connection
+    'PRAGMA mmap_size = 268435456',  # Read pages through a 256 MiB memory map
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA foreign_keys = on',
+)
+
+# Columns of MediaListEntry, in the order they are read and written
+MEDIA_LIST_COLUMNS = ('media_ID, entry_ID, status, progress, score, repeat, private, '
+                      'started_at, completed_at, updated_at')
+
+# Seconds to wait for another connection's write lock before raising
+BUSY_TIMEOUT = 30
+
+_MEMORY_IDS = count()
+
+
+def _add_missing_columns(cursor, table, columns):
+    """
+    Adds columns that were introduced after a table was first created
+
+    Args:
+        cursor:
+            The database cursor
+        table:
+            The table name
+        columns:
+            A dictionary of column names to their types
+    """
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, type_ in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {type_}')
+
+
+# Frozen copy of the title comparison of ene.cluster as of migration 8, so
+# tuning the clustering later does not change what the migration did
+_M8_THRESHOLD = 0.9
+_M8_ORDINALS = {
+    'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5,
+    'sixth': 6, 'seventh': 7, 'eighth': 8, 'ninth': 9, 'tenth': 10,
+}
+_M8_NOT_WORD = re.compile(r'[\W_]+')
+_M8_SEASON_PATTERNS = (
+    re.compile(r'\b(\d+)(?:st|nd|rd|th) season\b'),
+    re.compile(r'\b({}) season\b'.format('|'.join(_M8_ORDINALS))),
+    re.compile(r'\bseason (\d+)\b'),
+    re.compile(r'\bs(\d+)\b'),
+)
+_M8_NUMBER = re.compile(r'\d+')
+_M8_SUFFIX = re.compile(r'[^\w\s.)\]]+$')
+_M8_ROMAN = re.compile(r'^(?=[ivx])x{0,3}(ix|iv|v?i{0,3})$')
+_M8_NUMBER_WORDS = frozenset(
+    ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+     'ichi', 'ni', 'san', 'shi', 'yon', 'go', 'roku', 'nana', 'shichi', 'hachi', 'kyuu',
+     'ku', 'juu', 'zoku', 'final']
+).union(_M8_ORDINALS)
+
+
+def _m8_title_key(title: str) -> tuple:
+    """
+    Args:
+        title: The title
+
+    Returns:
+        The normalized title without the season, the season, the other
+        numbers in the title and the symbols it ends with
+    """
+    title = title.strip().lower()
+    match = _M8_SUFFIX.search(title)
+    suffix = match.group() if match else ''
+    text = _M8_NOT_WORD.sub(' ', title)
+    season = 1
+    for pattern in _M8_SEASON_PATTERNS:
+        match = pattern.search(text)
+        if match is not None:
+            value = match.group(1)
+            season = _M8_ORDINALS[value] if value in _M8_ORDINALS else int(value)
+            text = text[:match.start()] + text[match.end():]
+            break
+    base = ' '.join(text.split())
+    return base, season, tuple(_M8_NUMBER.findall(base)), suffix
+
+
+def _m8_same_show(a: str, b: str) -> bool:
+    """
+    Args:
+        a: A title
+        b: Another title
+
+    Returns:
+        True if the titles are near-duplicates of the same show
+    """
+    key_a = _m8_title_key(a)
+    key_b = _m8_title_key(b)
+    if key_a == key_b:
+        return True
+    if key_a[1:] != key_b[1:]:
+        return False
+    base_a, base_b = key_a[0], key_b[0]
+    shorter, longer = sorted((len(base_a), len(base_b)))
+    if 2 * shorter < _M8_THRESHOLD * (shorter + longer):
+        return False
+    words_a = base_a.split()
+    words_b = base_b.split()
+    if len(words_a) != len(words_b):
+        return False
+    for word_a, word_b in zip(words_a, words_b):
+        if word_a != word_b and any(word in _M8_NUMBER_WORDS or _M8_ROMAN.match(word)
+                                    for word in (word_a, word_b)):
+            return False
+    return ratio(base_a, base_b) >= _M8_THRESHOLD
+
+
+def _split_sequel_aliases(cursor):
+    """
+    Moves sequels that were merged into the show of an earlier season back
+    into their own show. Aliases too different to have been merged
+    automatically are renames made by the user and are kept.
+
+    Args:
+        cursor:
+            The database cursor
+    """
+    aliases = cursor.execute('SELECT alias, show_name FROM ShowAlias').fetchall()
+    for alias, show in aliases:
+        if _m8_same_show(alias, show):
+            continue
+        if ratio(_m8_title_key(alias)[0], _m8_title_key(show)[0]) < _M8_THRESHOLD:
+            continue
+        cursor.execute('DELETE FROM ShowAlias WHERE alias=?', (alias,))
+        cursor.execute('INSERT OR IGNORE INTO Show(show_name) VALUES (?)', (alias,))
+        episodes = cursor.execute("""SELECT episode_ID, episode_path FROM Episode
+            WHERE show_ID=(SELECT show_ID FROM Show WHERE show_name=?)""", (show,)).fetchall()
+        moved = []
+        for episode_id, path in episodes:
+            row = cursor.execute('SELECT title FROM FileParse WHERE filename=?',
+                                 (os.path.basename(path),)).fetchone()
+            if row is not None and row[0] == alias:
+                moved.append((alias, episode_id))
+        cursor.executemany("""UPDATE Episode SET show_ID=(
+            SELECT show_ID FROM Show WHERE show_name=?) WHERE episode_ID=?""", moved)
+
+
+# Schema migrations, the database's user_version is the number of migrations
+# applied to it. Each migration is a sequence of SQL statements or functions
+# that take a cursor, run in a single transaction.
+# Never edit a migration that has been released, append a new one instead.
+MIGRATIONS = (
+    (  # 1: Initial schema, databases from before versioning start here too
+        """CREATE TABLE IF NOT EXISTS Show(
+            show_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            show_name TEXT UNIQUE
+            )""",
+        """CREATE TABLE IF NOT EXISTS Episode(
+            episode_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            episode_path,
+            show_ID REFERENCES Show(show_ID)
+            )""",
+        """CREATE TABLE IF NOT EXISTS FileParse(
+            filename TEXT PRIMARY KEY,
+            title TEXT,
+            episode INTEGER,
+            season INTEGER,
+            release_group TEXT,
+            version INTEGER,
+            resolution INTEGER,
+            checksum TEXT
+            )""",
+        lambda cur: _add_missing_columns(cur, 'FileParse', {
+            'resolution': 'INTEGER',
+            'checksum': 'TEXT'
+        }),
+    ),
+    (  # 2: Unique episode paths and per show episode lookups
+        """DELETE FROM Episode WHERE episode_ID NOT IN (
+            SELECT MIN(episode_ID) FROM Episode GROUP BY episode_path
+            )""",
+        'CREATE UNIQUE INDEX IF NOT EXISTS Episode_episode_path ON Episode(episode_path)',
+        'CREATE INDEX IF NOT EXISTS Episode_show_ID ON Episode(show_ID)',
+    ),
+    (  # 3: Inverted index of title tokens to the video files in the library
+        """CREATE TABLE IF NOT EXISTS FileToken(
+            token TEXT NOT NULL,
+            episode_path TEXT NOT NULL,
+            PRIMARY KEY (token, episode_path)
+            ) WITHOUT ROWID""",
+        'CREATE INDEX IF NOT EXISTS FileToken_episode_path ON FileToken(episode_path)',
+    ),
+    (  # 4: Titles parsed from file names that belong to a show of another name
+        """CREATE TABLE IF NOT EXISTS ShowAlias(
+            alias TEXT PRIMARY KEY,
+            show_name TEXT NOT NULL
+            )""",
+    ),
+    (  # 5: AniList media matched to local shows, media_ID is NULL if nothing matched
+        """CREATE TABLE IF NOT EXISTS ShowMatch(
+            show_name TEXT PRIMARY KEY,
+            media_ID INTEGER,
+            confidence REAL NOT NULL,
+            matched_at INTEGER NOT NULL
+            )""",
+    ),
+    (  # 6: Mirror of the user's AniList anime list
+        """CREATE TABLE IF NOT EXISTS MediaListEntry(
+            media_ID INTEGER PRIMARY KEY,
+            entry_ID INTEGER NOT NULL,
+            status TEXT,
+            progress INTEGER,
+            score REAL,
+            repeat INTEGER,
+            private INTEGER,
+            started_at TEXT,
+            completed_at TEXT,
+            updated_at INTEGER NOT NULL
+            )""",
+        """CREATE TABLE IF NOT EXISTS MediaListSync(
+            user_ID INTEGER PRIMARY KEY,
+            synced_at INTEGER NOT NULL
+            )""",
+    ),
+    (  # 7: List entry updates waiting to be sent, one row per media
+        """CREATE TABLE IF NOT EXISTS MediaListOutbox(
+            media_ID INTEGER PRIMARY KEY,
+            changes TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            queued_at INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            retry_at REAL NOT NULL DEFAULT 0
+            )""",
+    ),
+    (  # 8: Undo merges of sequels with the show of an earlier season
+        _split_sequel_aliases,
+    ),
+)
 
 
 class Database:
@@ -26,34 +275,100 @@ class Database:
     """
 
     def __init__(self, db_path: Path):
-        setup = not db_path.is_file()
+        """
+        Each thread that uses the database gets its own connection, so
+        background threads can write while the UI thread reads.
+
+        Args:
+            db_path: Path to the database file, ':memory:' for an in memory
+                database shared by all threads of this instance. In memory
+                databases use a shared cache, which fails instead of waiting
+                when threads write to the same table concurrently
+        """
         sqlite3.register_adapter(PosixPath, str)
-        self.connection = sqlite3.connect(str(db_path), isolation_level=None)
-        self.cursor = self.connection.cursor()
-        self.cursor.execute('PRAGMA foreign_keys = on;')
-        if setup:
-            self.initial_setup()
+        if str(db_path) == ':memory:':
+            self._database = f'file:ene-{next(_MEMORY_IDS)}?mode=memory&cache=shared'
+            self._uri = True
+        else:
+            self._database = str(db_path)
+            self._uri = False
+        self._local = local()
+        self._connections = []
+        self._connections_lock = Lock()
+        self.initial_setup()
 
     def __del__(self):
-        self.cursor.close()
-        self.connection.close()
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection of the current thread."""
+        try:
+            return self._local.connection
+        except AttributeError:
+            pass
+        connection = sqlite3.connect(
+            self._database,
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+            uri=self._uri
+        )
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        with self._connections_lock:
+            self._connections.append(connection)
+        self._local.connection = connection
+        self._local.cursor = connection.cursor()
+        return connection
+
+    @property
+    def cursor(self) -> sqlite3.Cursor:
+        """The cursor of the current thread's connection."""
+        try:
+            return self._local.cursor
+        except AttributeError:
+            self.connection  # pylint: disable=W0104
+            return self._local.cursor
 
     def initial_setup(self):
         """
-        Sets up the database for use, creating any tables if needed
+        Sets up the database for use, creating any tables if needed and
+        applying the migrations newer than the database's user_version
         """
-        script = """
-        CREATE TABLE IF NOT EXISTS Show(
-            show_ID INTEGER PRIMARY KEY AUTOINCREMENT,
-            show_name TEXT UNIQUE
-            );
-        CREATE TABLE IF NOT EXISTS Episode(
-            episode_ID INTEGER PRIMARY KEY AUTOINCREMENT,
-            episode_path,
-            show_ID REFERENCES Show(show_ID)
-            );
+        cur = self.connection.cursor()
+        version = cur.execute('PRAGMA user_version').fetchone()[0]
+        for version, migration in enumerate(MIGRATIONS[version:], version + 1):
+            with self.transaction():
+                for step in migration:
+                    if callable(step):
+                        step(cur)
+                    else:
+                        cur.execute(step)
+                cur.execute(f'PRAGMA user_version = {version}')
+
+    @contextmanager
+    def transaction(self):
         """
-        self.cursor.executescript(script)
+        Context manager to run statements in a single transaction.
+
+        Commits when the scope exits and rolls back if it raises, nested
+        scopes join the outer transaction.
+        """
+        if self.connection.in_transaction:
+            yield
+            return
+        self.cursor.execute('BEGIN')
+        try:
+            yield
+        except BaseException:
+            self.cursor.execute('ROLLBACK')
+            raise
+        else:
+            self.cursor.execute('COMMIT')
 
     def add_show(self, show):
         """
@@ -112,29 +427,51 @@ class Database:
             shows:
                 A list of shows to compare and add
         """
-        cur = set(self.get_all_shows())
-        delta = (set(shows) - set(cur))
-        for show in sorted(delta):
-            self.add_show(show)
+        with self.transaction():
+            self.cursor.executemany('INSERT OR IGNORE INTO Show(show_name) VALUES (?)',
+                                    ((show,) for show in sorted(set(shows))))
 
     def write_all_episodes_delta(self, series):
         """
         Finds the delta of the input episodes for each show compared to what is
         already in the database and adds any newly added episodes
 
+        Episode paths are unique, so the delta is done by SQLite in a single
+        transaction. An episode already in the database under another show is
+        left there
+
         Args:
             series:
                 A dictionary with show names as keys and lists of episodes
         """
-        for show in series:
-            key = self.get_show_id_by_name(show)
-            if key is None:
-                key = self.add_show(show)
-            episodes = set(series[show])
-            cur = set(self.get_episodes_by_show_id(key))
-            delta = episodes - cur
-            for episode in sorted(delta):
-                self.add_episode_by_show_id(str(episode), key)
+        with self.transaction():
+            self.cursor.executemany('INSERT OR IGNORE INTO Show(show_name) VALUES (?)',
+                                    ((show,) for show in series))
+            self.cursor.executemany(
+                """INSERT OR IGNORE INTO Episode(episode_path, show_ID)
+                SELECT ?, show_ID FROM Show WHERE show_name=?""",
+                ((episode, show)
+                 for show in series
+                 for episode in sorted(set(map(str, series[show]))))
+            )
+
+    def _query(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """
+        Runs a query on a new cursor of the current thread's connection.
+
+        Rows are returned as plain tuples, conversion is left to the caller so
+        there is no Python callback per row.
+
+        Args:
+            sql: The query
+            params: The query parameters
+
+        Returns:
+            The cursor to read the rows from
+        """
+        cur = self.connection.cursor()
+        cur.execute(sql, params)
+        return cur
 
     def get_show_id_by_name(self, show):
         """
@@ -147,21 +484,20 @@ class Database:
         Returns:
             The show ID for the show
         """
-        self.connection.row_factory = single_factory
-        cur = self.connection.cursor()
-        cur.execute('SELECT show_ID FROM Show WHERE show_name=?', (show,))
-        res = cur.fetchone()
-        if res is not None:
-            return res
+        row = self._query('SELECT show_ID FROM Show WHERE show_name=?', (show,)).fetchone()
+        if row is not None:
+            return row[0]
         return None
 
-    def get_episodes_by_show_name(self, show):
+    def get_episodes_by_show_name(self, show, as_path=True):
         """
         Gets all episodes for a given show using the shows name
 
         Args:
             show:
                 The name of the show
+            as_path:
+                Return the episodes as Path objects instead of strings
 
         Returns:
             A list of episodes or None if the show does not exist
@@ -169,41 +505,48 @@ class Database:
         show_id = self.get_show_id_by_name(show)
         if show_id is None:
             return None
-        return self.get_episodes_by_show_id(show_id)
+        return self.get_episodes_by_show_id(show_id, as_path)
 
-    def get_episodes_by_show_id(self, show_id):
+    def get_episodes_by_show_id(self, show_id, as_path=True):
         """
         Gets all episodes for a given show using the shows ID
 
         Args:
             show_id:
                 The ID of the show
+            as_path:
+                Return the episodes as Path objects instead of strings
 
         Returns:
             A list of episodes for the given show
         """
-        self.connection.row_factory = episode_factory
-        cur = self.connection.cursor()
-        cur.execute('SELECT episode_path FROM Episode where show_ID = ?', (show_id,))
-        return cur.fetchall()
+        cur = self._query('SELECT episode_path FROM Episode WHERE show_ID = ? ORDER BY episode_ID',
+                          (show_id,))
+        episodes = [episode for episode, in cur]
+        return list(map(Path, episodes)) if as_path else episodes
 
-    def get_all(self):
+    def get_all(self, as_path=True):
         """
         Gets all episodes and shows from the database
 
+        Args:
+            as_path:
+                Return the episodes as Path objects instead of strings
+
         Returns:
-            A list of tuples with the show name as the first element and the
-            episode path as the second element
+            A dictionary with show names as keys and lists of episodes
         """
-        self.connection.row_factory = pair_factory
-        cur = self.connection.cursor()
-        cur.execute("""SELECT show_name, episode_path
+        cur = self._query("""SELECT show_name, episode_path
             FROM Show S
             INNER JOIN Episode E
-            ON E.show_ID=S.show_ID""")
+            ON E.show_ID=S.show_ID
+            ORDER BY E.episode_ID""")
         res = defaultdict(list)
-        for show, episode in cur.fetchall():
+        for show, episode in cur:
             res[show].append(episode)
+        if as_path:
+            for show, episodes in res.items():
+                res[show] = list(map(Path, episodes))
         return res
 
     def get_all_shows(self):
@@ -211,107 +554,385 @@ class Database:
         Gets all the shows from the database
 
         Returns:
-            A list of tuples containing all shows in the database
+            A list of all show names in the database
         """
-        self.connection.row_factory = single_factory
-        cur = self.connection.cursor()
-        cur.execute('SELECT show_name FROM Show')
-        return cur.fetchall()
+        return [show for show, in self._query('SELECT show_name FROM Show ORDER BY show_ID')]
 
-    def get_all_episodes(self):
+    def get_episode_counts(self) -> Dict[str, int]:
+        """
+        Gets the number of episodes of every show in the database
+
+        Returns:
+            A dictionary with show names as keys and episode counts as values
+        """
+        cur = self._query("""SELECT show_name, COUNT(E.episode_ID)
+            FROM Show S
+            LEFT JOIN Episode E
+            ON E.show_ID=S.show_ID
+            GROUP BY S.show_ID
+            ORDER BY S.show_ID""")
+        return dict(cur.fetchall())
+
+    def get_all_episodes(self, as_path=True):
         """
         Gets all the episodes from the database
 
+        Args:
+            as_path:
+                Return the episodes as Path objects instead of strings
+
         Returns:
-            A list of tuples containing all the episodes in the database
+            A list of all the episodes in the database
         """
-        self.connection.row_factory = episode_factory
-        cur = self.connection.cursor()
-        cur.execute('SELECT episode_path FROM Episode')
+        cur = self._query('SELECT episode_path FROM Episode ORDER BY episode_ID')
+        episodes = [episode for episode, in cur]
+        return list(map(Path, episodes)) if as_path else episodes
+
+    def get_file_parses(self) -> Dict[str, Tuple]:
+        """
+        Gets all cached file name parses from the database
+
+        Returns:
+            A dictionary of file name to a tuple of title, episode number,
+            season, release group, version, resolution and checksum. The title
+            is None for files that are not episodes
+        """
+        cur = self._query("""SELECT filename, title, episode, season, release_group, version,
+            resolution, checksum
+            FROM FileParse""")
+        return {row[0]: row[1:] for row in cur}
+
+    def add_file_parses(self, parses: Iterable[Tuple]):
+        """
+        Caches file name parses in the database
+
+        Args:
+            parses:
+                Tuples of file name, title, episode number, season, release
+                group, version, resolution and checksum
+        """
+        with self.transaction():
+            self.cursor.executemany("""INSERT OR REPLACE INTO FileParse(
+                filename, title, episode, season, release_group, version,
+                resolution, checksum)
+                VALUES (?,?,?,?,?,?,?,?)""", parses)
+
+    def get_file_tokens(self) -> Iterable[Tuple[str, Path]]:
+        """
+        Gets the inverted token index of the library
+
+        Yields:
+            Tuples of token and the path of a file it appears in
+        """
+        for token, path in self._query('SELECT token, episode_path FROM FileToken'):
+            yield token, Path(path)
+
+    def add_file_tokens(self, tokens: Iterable[Tuple[str, Path]]):
+        """
+        Adds entries to the inverted token index of the library
+
+        Args:
+            tokens:
+                Tuples of token and the path of a file it appears in
+        """
+        with self.transaction():
+            self.cursor.executemany(
+                'INSERT OR IGNORE INTO FileToken(token, episode_path) VALUES (?,?)',
+                ((token, str(path)) for token, path in tokens)
+            )
+
+    def delete_file_tokens(self, paths: Iterable):
+        """
+        Removes files from the inverted token index of the library
+
+        Args:
+            paths:
+                The paths of the files to remove
+        """
+        with self.transaction():
+            self.cursor.executemany('DELETE FROM FileToken WHERE episode_path=?',
+                                    ((str(path),) for path in paths))
+
+    def get_show_matches(self) -> Dict[str, Tuple]:
+        """
+        Gets the AniList media matched to local shows
+
+        Returns:
+            A dictionary of show name to a tuple of media ID, confidence and
+            the unix time of the match. The media ID is None if nothing matched
+        """
+        cur = self._query('SELECT show_name, media_ID, confidence, matched_at FROM ShowMatch')
+        return {row[0]: row[1:] for row in cur}
+
+    def add_show_matches(self, matches: Iterable[Tuple]):
+        """
+        Stores AniList media matched to local shows, replacing older matches
+
+        Args:
+            matches:
+                Tuples of show name, media ID, confidence and the unix time of
+                the match
+        """
+        with self.transaction():
+            self.cursor.executemany("""INSERT OR REPLACE INTO ShowMatch(
+                show_name, media_ID, confidence, matched_at)
+                VALUES (?,?,?,?)""", matches)
+
+    def get_media_list_entry(self, media_id: int) -> Optional[Tuple]:
+        """
+        Gets the mirrored list entry of a media
+
+        Args:
+            media_id: The AniList media ID
+
+        Returns:
+            A tuple of the entry's columns, None if the media is not on the list
+        """
+        return self._query(f'SELECT {MEDIA_LIST_COLUMNS} FROM MediaListEntry WHERE media_ID=?',
+                           (media_id,)).fetchone()
+
+    def get_media_list(self, status: Optional[str] = None) -> List[Tuple]:
+        """
+        Gets the mirrored list entries
+
+        Args:
+            status: Only get the entries with this status, None for all
+
+        Returns:
+            Tuples of the entries' columns, most recently updated first
+        """
+        if status is None:
+            cur = self._query(f'SELECT {MEDIA_LIST_COLUMNS} FROM MediaListEntry '
+                              f'ORDER BY updated_at DESC')
+        else:
+            cur = self._query(f'SELECT {MEDIA_LIST_COLUMNS} FROM MediaListEntry '
+                              f'WHERE status=? ORDER BY updated_at DESC', (status,))
         return cur.fetchall()
 
-    def delete_show(self, show):
+    def get_media_list_updated_at(self) -> int:
         """
-        Deletes the given show from the database
+        Returns:
+            The unix time of the most recently updated list entry, 0 if the
+            list is empty
+        """
+        return self._query('SELECT MAX(updated_at) FROM MediaListEntry').fetchone()[0] or 0
+
+    def add_media_list_entries(self, entries: Iterable[Tuple]):
+        """
+        Stores list entries, replacing older versions of the same media
+
         Args:
-            show:
-                The show to delete
+            entries: Tuples of the entries' columns, see MEDIA_LIST_COLUMNS
         """
-        show_id = self.get_show_id_by_name(show)
-        self.cursor.execute('DELETE FROM Episode WHERE show_ID = ?', (show_id,))
-        self.cursor.execute('DELETE FROM Show WHERE show_ID = ?', (show_id,))
+        with self.transaction():
+            self.cursor.executemany(f"""INSERT OR REPLACE INTO MediaListEntry(
+                {MEDIA_LIST_COLUMNS}) VALUES (?,?,?,?,?,?,?,?,?,?)""", entries)
 
-    def rename_show(self, old, new):
+    def replace_media_list(self, user_id: int, entries: Iterable[Tuple], synced_at: int):
         """
-        Renames a show in the database
+        Replaces the whole mirrored list, after fetching all of it
+
         Args:
-            old:
-                The old name of the show
-            new:
-                The new name of the show
+            user_id: The AniList user ID the list belongs to
+            entries: Tuples of the entries' columns, see MEDIA_LIST_COLUMNS
+            synced_at: The unix time the list was fetched
+        """
+        with self.transaction():
+            self.cursor.execute('DELETE FROM MediaListEntry')
+            self.cursor.execute('DELETE FROM MediaListSync')
+            self.add_media_list_entries(entries)
+            self.cursor.execute('INSERT INTO MediaListSync(user_ID, synced_at) VALUES (?,?)',
+                                (user_id, synced_at))
+
+    def get_media_list_sync(self) -> Optional[Tuple[int, int]]:
+        """
         Returns:
+            The user ID and unix time of the last time the whole list was
+            fetched, None if it never was
+        """
+        return self._query('SELECT user_ID, synced_at FROM MediaListSync').fetchone()
+
+    def queue_media_list_update(self, media_id: int, changes: dict, queued_at: int) -> dict:
+        """
+        Queues changes to a list entry, merged into the changes already queued
+        for the same media so only the latest value of every field is sent
+
+        Args:
+            media_id: The AniList media ID
+            changes: The SaveMediaListEntry arguments to change
+            queued_at: The unix time of the change
 
+        Returns:
+            All the changes queued for the media
+        """
+        with self.transaction():
+            # Writing first takes the write lock before the queued changes are read
+            self.cursor.execute("""INSERT OR IGNORE INTO MediaListOutbox(
+                media_ID, changes, version, queued_at) VALUES (?,'{}',0,?)""",
+                                (media_id, queued_at))
+            queued = json.loads(self.cursor.execute(
+                'SELECT changes FROM MediaListOutbox WHERE media_ID=?', (media_id,)
+            ).fetchone()[0])
+            queued.update(changes)
+            self.cursor.execute("""UPDATE MediaListOutbox
+                SET changes=?, version=version+1, attempts=0, retry_at=0
+                WHERE media_ID=?""", (json.dumps(queued), media_id))
+        return queued
+
+    def get_media_list_outbox(self, now: Optional[float] = None) -> List[Tuple]:
         """
-        old_id = self.get_show_id_by_name(old)
-        new_id = self.get_show_id_by_name(new)
+        Gets the queued list entry changes
+
+        Args:
+            now: The current unix time to only get the changes due to be sent,
+                None to get all of them
 
-        if new_id is not None:
-            # New name is in use, transfer the episodes over
-            self.cursor.execute('UPDATE Episode SET show_ID = ?'
-                                'WHERE show_ID = ?', (new_id, old_id))
-            self.delete_show(old)
+        Returns:
+            Tuples of media ID, changes, version and number of failed attempts,
+            oldest first
+        """
+        sql = 'SELECT media_ID, changes, version, attempts FROM MediaListOutbox'
+        if now is None:
+            cur = self._query(f'{sql} ORDER BY queued_at')
         else:
-            # New name is not in use, just update the entry
-            self.cursor.execute('UPDATE Show SET show_name = ?'
-                                'WHERE show_ID = ?', (new, old_id))
+            cur = self._query(f'{sql} WHERE retry_at<=? ORDER BY queued_at', (now,))
+        return [(media_id, json.loads(changes), version, attempts)
+                for media_id, changes, version, attempts in cur]
 
+    def delete_media_list_outbox(self, entries: Iterable[Tuple[int, int]]):
+        """
+        Removes sent changes from the queue, unless newer changes to the same
+        media were queued since they were read
 
-# pylint: disable=W0613
-def episode_factory(cursor, row):
-    """
-    Builds an episode path based off of a database row
+        Args:
+            entries: Tuples of media ID and the version that was sent
+        """
+        with self.transaction():
+            self.cursor.executemany('DELETE FROM MediaListOutbox WHERE media_ID=? AND version=?',
+                                    entries)
 
-    Args:
-        cursor:
-            Unused
-        row:
-            The database row
+    def retry_media_list_outbox(self, entries: Iterable[Tuple[int, int, float]]):
+        """
+        Records a failed attempt to send changes, unless newer changes to the
+        same media were queued since they were read
 
-    Returns:
-        The path to the episode from the database row
-    """
-    return Path(row[0])
+        Args:
+            entries: Tuples of media ID, the version that was sent and the
+                unix time to try again at
+        """
+        with self.transaction():
+            self.cursor.executemany("""UPDATE MediaListOutbox
+                SET attempts=attempts+1, retry_at=?
+                WHERE media_ID=? AND version=?""",
+                                    ((retry_at, media_id, version)
+                                     for media_id, version, retry_at in entries))
 
+    def delete_show(self, show):
+        """
+        Deletes the given show from the database
+        Args:
+            show:
+                The show to delete
+        """
+        show_id = self.get_show_id_by_name(show)
+        self.cursor.execute('DELETE FROM Episode WHERE show_ID = ?', (show_id,))
+        self.cursor.execute('DELETE FROM Show WHERE show_ID = ?', (show_id,))
 
-# pylint: disable=W0613
-def single_factory(cursor, row):
-    """
-    Converts the row tuple into a single value
+    def delete_episodes(self, episodes: Iterable):
+        """
+        Deletes episodes from the database by their paths
 
-    Args:
-        cursor:
-            Unused.
-        row:
-            The database row
+        Args:
+            episodes:
+                The paths of the episodes to delete
+        """
+        with self.transaction():
+            self.cursor.executemany('DELETE FROM Episode WHERE episode_path=?',
+                                    ((str(episode),) for episode in episodes))
 
-    Returns:
-        The first column of the row
-    """
-    return row[0]
+    def get_episode_shows(self, episodes: Iterable) -> Dict[str, List[Path]]:
+        """
+        Gets the shows the given episodes belong to
 
+        Args:
+            episodes:
+                The paths of the episodes, paths not in the database are ignored
 
-# pylint: disable=W0613
-def pair_factory(cursor, row):
-    """
-    Builds a show-episode pair from a given database row
+        Returns:
+            A dictionary with show names as keys and lists of the given
+            episodes as values
+        """
+        res = defaultdict(list)
+        for episode in episodes:
+            row = self._query("""SELECT show_name FROM Episode E
+                JOIN Show S ON E.show_ID=S.show_ID
+                WHERE episode_path=?""", (str(episode),)).fetchone()
+            if row is not None:
+                res[row[0]].append(Path(episode))
+        return dict(res)
+
+    def get_episodes_under(self, directory) -> Dict[str, List[Path]]:
+        """
+        Gets all episodes inside a directory or any of its sub directories
 
-    Args:
-        cursor:
-            Unused.
-        row:
-            The database row to build the pair from
+        Args:
+            directory:
+                The directory path
 
-    Returns:
-        A pair in the form (string, path)
-    """
-    return row[0], Path(row[1])
+        Returns:
+            A dictionary with show names as keys and lists of episodes as values
+        """
+        directory = str(directory).rstrip(os.sep)
+        # Every path starting with directory + sep sorts between these two,
+        # which lets the range use the unique index on episode_path.
+        cur = self._query("""SELECT show_name, episode_path FROM Episode E
+            JOIN Show S ON E.show_ID=S.show_ID
+            WHERE episode_path >= ? AND episode_path < ?
+            ORDER BY episode_path""",
+                          (directory + os.sep, directory + chr(ord(os.sep) + 1)))
+        res = defaultdict(list)
+        for show, episode in cur:
+            res[show].append(Path(episode))
+        return dict(res)
+
+    def rename_show(self, old, new):
+        """
+        Renames a show in the database
+        Args:
+            old:
+                The old name of the show
+            new:
+                The new name of the show
+        Returns:
+
+        """
+        with self.transaction():
+            old_id = self.get_show_id_by_name(old)
+            new_id = self.get_show_id_by_name(new)
+
+            if new_id is not None:
+                # New name is in use, transfer the episodes over
+                self.cursor.execute('UPDATE Episode SET show_ID = ?'
+                                    'WHERE show_ID = ?', (new_id, old_id))
+                self.delete_show(old)
+            else:
+                # New name is not in use, just update the entry
+                self.cursor.execute('UPDATE Show SET show_name = ?'
+                                    'WHERE show_ID = ?', (new, old_id))
+            self.cursor.execute('UPDATE ShowAlias SET show_name = ? WHERE show_name = ?',
+                                (new, old))
+            self.cursor.execute('INSERT OR REPLACE INTO ShowAlias(alias, show_name) VALUES (?,?)',
+                                (old, new))
+            # The new name is a show of its own now, not an alias of another
+            self.cursor.execute('DELETE FROM ShowAlias WHERE alias = ?', (new,))
+            self.cursor.execute('DELETE FROM ShowAlias WHERE alias = show_name')
+
+    def get_show_aliases(self) -> Dict[str, str]:
+        """
+        Gets the titles that belong to a show of another name, either because
+        the show was renamed or merged with a near-duplicate title
+
+        Returns:
+            A dictionary of titles to the names of the shows they belong to
+        """
+        return dict(self._query('SELECT alias, show_name FROM ShowAlias').fetchall())
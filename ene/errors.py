@@ -40,3 +40,7 @@ class APIHTTPError(APIError):
 class AuthError(EneError):
     """Class for auth errors."""
     pass
+
+
+class PlayerError(EneError):
+    """Class for errors reported by a media player."""
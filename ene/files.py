@@ -17,46 +17,301 @@
 """This module handles local video files."""
 
 import re
-from collections import defaultdict
-from os import walk
+from collections import OrderedDict, defaultdict
+from collections.abc import MutableMapping
+from concurrent.futures import Executor
+from functools import lru_cache
+from itertools import chain
+from os.path import splitext
 from pathlib import Path
-from typing import Iterable
+from typing import Dict, Iterable, Optional, Set, Tuple
 
 
+from ene.cluster import cluster_titles, same_show
 from ene.database import Database
+from ene.scanner import DirectoryIndex, LibraryScanner, ScanStats, TokenIndex
 
 EXTENSIONS = ['.mkv',
               '.mp4',
               '.avi',
               '.m4v']
 
+OP_OR_ED = re.compile(r'(NCOP)|(NCED)|(\sOP[0-9]+)|(\sED[0-9]+)')
+
+# Patterns used by clean_title
+# Adding detailed comments because coming back to regex after a break is confusing
+_SEPARATORS = str.maketrans('_,', '  ')
+_SQUARE_BRACKETS = re.compile(r'\[[^]]*\]')  # Removes things between square brackets
+_PARENTHESIS = re.compile(r'\([^O)]*\)')  # Parenthesis
+_SEASON_ONE = re.compile(r'[sS]0?1')  # Remove season if its season one
+_LEADING_EPISODE = re.compile(r'^[0-9]+\.')  # Episode number at the beginning
+_EPISODE_ONWARDS = re.compile(r'[eE][pP]?[0-9]+.*')  # Anything after an episode number
+_TRAILING_EPISODE = re.compile(r'-?\s+[0-9v]*\s*$')  # Removes trailing episode numbers
+_DASH_EPISODE = re.compile(r'-\s(Episode)?\s?([0-9v])+.*')  # '- 08 - episode name
+_SEASON = re.compile(r'[sS]0?([2-9])')  # Replace S02 with Season 2
+
+# Patterns used by parse_episode
+_TAGS = re.compile(r'\[[^]]*\]|\([^)]*\)')  # Anything in brackets, e.g. [1080p] (BD)
+_RELEASE_GROUP = re.compile(r'^\s*\[([^]]+)\]')  # [Group] at the start
+_VERSION = re.compile(r'(?:(?<=\d)|\b)v(\d{1,2})\b')  # 12v2, [v2]
+_SEASON_EPISODE = re.compile(r'\bS(\d{1,2})\s?E[pP]?(\d{1,4})', re.I)  # S01E03
+_SEASON_NUMBER = re.compile(  # S2, Season 2, 2nd Season
+    r'\b(?:S|Season\s?)(\d{1,2})\b|\b(\d{1,2})(?:st|nd|rd|th)\sSeason\b', re.I
+)
+_EPISODE_MARKER = re.compile(r'\b(?:E|Ep|Episode)\s?(\d{1,4})', re.I)  # E05, Ep 7
+_DASH_EPISODE_NUMBER = re.compile(r'\s-\s(\d{1,4})(?:v\d{1,2})?\b')  # - 08
+_LEADING_EPISODE_NUMBER = re.compile(r'^\s*(\d{1,4})\.\s')  # 01. title
+_NUMBER = re.compile(r'(?<![\w.])(\d{1,4})(?:v\d{1,2})?(?![\w.])')  # any stand alone number
+_RESOLUTION = re.compile(r'\b(?:\d{3,4}x(\d{3,4})|(\d{3,4})[pPiI])\b')  # 1080p, 1920x1080
+_CHECKSUM = re.compile(r'[\[(]([0-9A-Fa-f]{8})[\])]')  # [ABCD1234]
+
+
+class EpisodeInfo:
+    """
+    Details of an episode parsed out of its file name, fields that are not in
+    the file name are None
+    """
+    __slots__ = ('title', 'episode', 'season', 'group', 'version', 'resolution', 'checksum')
+
+    def __init__(  # pylint: disable=R0913
+            self,
+            title: str,
+            episode: Optional[int] = None,
+            season: Optional[int] = None,
+            group: Optional[str] = None,
+            version: Optional[int] = None,
+            resolution: Optional[int] = None,
+            checksum: Optional[str] = None
+    ):
+        self.title = title
+        self.episode = episode
+        self.season = season
+        self.group = group
+        self.version = version
+        self.resolution = resolution
+        self.checksum = checksum
+
+    def __eq__(self, other):
+        if not isinstance(other, EpisodeInfo):
+            return NotImplemented
+        return self.to_row() == other.to_row()
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'EpisodeInfo({fields})'
+
+    @property
+    def sort_key(self) -> Tuple[int, float, int]:
+        """Key to sort episodes of a show by season, episode and version."""
+        return (
+            self.season or 1,
+            self.episode if self.episode is not None else float('inf'),
+            self.version or 1
+        )
+
+    def to_row(self) -> tuple:
+        """
+        Returns:
+            The fields in the column order of the FileParse table
+        """
+        return (self.title, self.episode, self.season, self.group, self.version,
+                self.resolution, self.checksum)
+
+
+class LazySeries(MutableMapping):
+    """
+    Mapping of show names to episode lists that loads the episodes of a show
+    from the database the first time it is accessed.
+
+    Show names are loaded up front. At most `max_loaded` episode lists that
+    match the database are kept in memory, evicting the least recently used.
+    Lists changed in memory are pinned until they are written to the database
+    and marked clean. Accessing a show that does not exist creates it with no
+    episodes, like a defaultdict.
+    """
+
+    def __init__(self, db: Database, max_loaded: int = 64):
+        """
+        Args:
+            db: The database to load episodes from
+            max_loaded: Maximum number of unchanged episode lists kept in memory
+        """
+        self.db = db
+        self.max_loaded = max_loaded
+        self._counts = {}
+        self._loaded = OrderedDict()
+        self._dirty = {}
+
+    def load_names(self):
+        """Loads all show names and their episode counts from the database."""
+        for show, count in self.db.get_episode_counts().items():
+            self._counts.setdefault(show, count)
+
+    def cache(self, show, episodes):
+        """
+        Puts episodes that match the database into the mapping
+
+        Args:
+            show: The show name
+            episodes: The episodes of the show
+        """
+        if show in self._dirty:
+            return
+        self._counts[show] = len(episodes)
+        self._loaded[show] = episodes
+        self._loaded.move_to_end(show)
+        self._evict()
+
+    def count(self, show) -> int:
+        """
+        Gets the number of episodes of a show without loading them
+
+        Args:
+            show: The show name
+
+        Returns:
+            The number of episodes
+        """
+        episodes = self._dirty.get(show, self._loaded.get(show))
+        if episodes is not None:
+            return len(episodes)
+        return self._counts.get(show, 0)
+
+    def mark_dirty(self, show):
+        """
+        Pins a show whose episode list was changed in memory
+
+        Args:
+            show: The show name
+        """
+        episodes = self[show]
+        self._loaded.pop(show, None)
+        self._dirty[show] = episodes
+
+    def dirty(self) -> Dict[str, list]:
+        """
+        Returns:
+            The shows whose episode lists were changed since the last
+            mark_clean
+        """
+        return dict(self._dirty)
+
+    def mark_clean(self):
+        """Unpins all changed shows once they are written to the database."""
+        dirty, self._dirty = self._dirty, {}
+        for show, episodes in dirty.items():
+            self.cache(show, episodes)
+
+    def discard(self, show, episodes):
+        """
+        Removes episodes from a show without loading its episode list
+
+        Args:
+            show: The show name
+            episodes: Episodes of the show to remove
+        """
+        episodes = set(episodes)
+        current = self._dirty.get(show, self._loaded.get(show))
+        if current is not None:
+            current[:] = [episode for episode in current if episode not in episodes]
+        elif show in self._counts:
+            self._counts[show] = max(self._counts[show] - len(episodes), 0)
+
+    def loaded(self) -> int:
+        """
+        Returns:
+            The number of episode lists in memory
+        """
+        return len(self._loaded) + len(self._dirty)
+
+    def _evict(self):
+        while len(self._loaded) > self.max_loaded:
+            show, episodes = self._loaded.popitem(last=False)
+            self._counts[show] = len(episodes)
+
+    def __getitem__(self, show):
+        try:
+            return self._dirty[show]
+        except KeyError:
+            pass
+        try:
+            self._loaded.move_to_end(show)
+            return self._loaded[show]
+        except KeyError:
+            pass
+        if show in self._counts:
+            episodes = self.db.get_episodes_by_show_name(show) or []
+            self.cache(show, episodes)
+        else:
+            episodes = []
+            self._counts[show] = 0
+            self._dirty[show] = episodes
+        return episodes
+
+    def __setitem__(self, show, episodes):
+        self._counts[show] = len(episodes)
+        self._loaded.pop(show, None)
+        self._dirty[show] = episodes
+
+    def __delitem__(self, show):
+        del self._counts[show]
+        self._loaded.pop(show, None)
+        self._dirty.pop(show, None)
+
+    def __contains__(self, show):
+        return show in self._counts
+
+    def __iter__(self):
+        return iter(list(self._counts))
+
+    def __len__(self):
+        return len(self._counts)
+
 
 class FileManager:
     """
     Class to manage video files.
     """
 
-    def __init__(self, cfg, data_home: Path):
+    def __init__(self, cfg, data_home: Path, pool: Optional[Executor] = None):
+        """
+        Args:
+            cfg: The config
+            data_home: Data directory path
+            pool: Executor to scan directories on, None to scan serially
+        """
         self.config = cfg
         self.dirs = [Path(x) for x in self.config.get('Local Paths', [])]
         self.db = Database(data_home / 'ene.db')
-        self.series = defaultdict(list)
+        self.series = LazySeries(self.db)
+        self.parses = {}
+        self._new_parses = []
+        self.aliases = None
+        self.tokens = TokenIndex()
+        self._tokens_loaded = False
+        self._new_tokens = []
+        self._removed_tokens = []
+        self.scanner = LibraryScanner(
+            DirectoryIndex(data_home / 'dir_index.json'), self._parse_name,
+            self._record_parse, pool
+        )
 
     def build_shows_from_db(self):
         """
         Fetches all shows from the database and adds them to the series
-        dictionary without episode paths
+        dictionary, their episodes are loaded when first accessed
         """
-        shows = self.db.get_all_shows()
-        for show in shows:
-            self.series[show] = []
+        self.series.load_names()
 
     def build_all_from_db(self):
         """
         Fetches all shows and episodes from the database and builds up the full
-        dictionary of series
+        dictionary of series, keeping as many episode lists in memory as the
+        series dictionary allows
         """
-        self.series.update(self.db.get_all())
+        self.series.load_names()
+        for show, episodes in self.db.get_all().items():
+            self.series.cache(show, episodes)
 
     def fetch_db_episodes_for_show(self, show):
         """
@@ -67,27 +322,63 @@ class FileManager:
             show:
                 The show to fetch episodes for
         """
-        if len(self.series[show]) is 0:
-            episodes = self.db.get_episodes_by_show_name(show)
-            episodes.sort()
-            for episode in episodes:
-                self.series[show].append(Path(episode))
+        self.sort_episodes(show)
+
+    def episode_count(self, show) -> int:
+        """
+        Gets the number of episodes of a show without loading them
+
+        Args:
+            show:
+                The show
+
+        Returns:
+            The number of episodes
+        """
+        return self.series.count(show)
 
     def dump_to_db(self):
         """
-        Dumps the current dictionary to the database
+        Dumps the shows and changed episode lists to the database in a single
+        transaction
         """
-        self.db.write_all_shows_delta(self.series.keys())
-        self.db.write_all_episodes_delta(self.series)
+        with self.db.transaction():
+            self.db.write_all_shows_delta(self.series.keys())
+            self.db.write_all_episodes_delta(self.series.dirty())
+        self.series.mark_clean()
 
-    def refresh_shows(self):
+    def refresh_shows(self) -> ScanStats:
         """
         Discovers episodes from each path defined in the config and tidies up
-        their titles
+        their titles. Only directories that changed since the last refresh are
+        walked again.
+
+        Returns:
+            The stats of the scan
         """
         self.dirs = [Path(x) for x in self.config.get('Local Paths', [])]
-        for directory in self.dirs:
-            self.discover_episodes(directory)
+        stats = self._scan(self.dirs)
+        self.cluster_shows()
+        return stats
+
+    def cluster_shows(self) -> Dict[str, str]:
+        """
+        Merges shows whose titles are near-duplicates of each other, such as
+        "Show S2" and "Show 2nd Season", into the show with the most episodes.
+        The merged titles are kept as aliases so episodes found later go to
+        the same show.
+
+        Returns:
+            Mapping of merged show names to the show they were merged into
+        """
+        titles = list(self.series)
+        weights = {title: self.series.count(title) for title in titles}
+        merged = {title: name for title, name in cluster_titles(titles, weights).items()
+                  if title != name}
+        with self.db.transaction():
+            for title, name in merged.items():
+                self.rename_show(title, name)
+        return merged
 
     def refresh_single_show(self, show):
         """
@@ -101,60 +392,332 @@ class FileManager:
         Returns:
             A list of new shows
         """
-        res = []
-        for directory in self.dirs:
-            print(directory)
-            print(type(directory))
-            res.extend(self.find_episodes(show, directory))
-        new = set(res) - set(self.series[show])
-        self.series[show].extend(new)
-        self.series[show].sort()
-        return sorted(new)
+        # Only directories changed since the last scan are listed again
+        self._scan(self.dirs, add_episodes=False)
+        self._load_aliases()
+        names = {show}.union(alias for alias, name in self.aliases.items() if name == show)
+        res = set()
+        for name in names:
+            for directory in self.dirs:
+                res.update(self.find_episodes(name, directory))
+        # The tokens of a title also match its sequels, keep the episodes of this
+        # show and every episode in a folder named after it
+        res = {path for path in res if self._belongs_to(path, show, names)}
+        new = res - set(self.series[show])
+        if new:
+            self.series[show].extend(new)
+            self.series.mark_dirty(show)
+        self.sort_episodes(show)
+        return sorted(new, key=self._episode_sort_key)
+
+    def _belongs_to(self, path: Path, show: str, names: Set[str]) -> bool:
+        """
+        Checks if an episode found by the names of a show belongs to it
+
+        Args:
+            path: The episode path
+            show: The show name
+            names: The show name and its aliases
+
+        Returns:
+            True if the episode's title resolves to the show or its folder is
+            named after the show
+        """
+        if self._resolve(self._parse_title(path.name)) == show:
+            return True
+        return any(same_show(path.parent.name, name) for name in names)
+
+    def episode_info(self, path: Path) -> Optional[EpisodeInfo]:
+        """
+        Gets the details of an episode parsed from its file name when it was
+        discovered, parsing it now if it has not been seen before
+
+        Args:
+            path: The path of the episode
+
+        Returns:
+            The episode details, None if the file is not an episode
+        """
+        if not self.parses:
+            self.parses = self._get_file_parses()
+        name = path.name
+        if name not in self.parses:
+            self._parse_title(name)
+        return self.parses.get(name)
+
+    def show_of(self, path: Path) -> Optional[str]:
+        """
+        Gets the name of the show an episode belongs to
+
+        Args:
+            path: The path of the episode
+
+        Returns:
+            The show name, None if the file is not an episode
+        """
+        info = self.episode_info(path)
+        return self._resolve(info.title) if info else None
+
+    def sort_episodes(self, show):
+        """
+        Sorts the episodes of a show by season, episode number and version
+
+        Args:
+            show:
+                The show to sort the episodes of
+
+        Returns:
+            The sorted episode list
+        """
+        episodes = self.series[show]
+        episodes.sort(key=self._episode_sort_key)
+        return episodes
+
+    def _episode_sort_key(self, path: Path):
+        info = self.episode_info(path)
+        return (info.sort_key if info else (1, float('inf'), 1)), path
 
     def find_episodes(self, name, directory):
         """
-        Finds all episodes in the set directory that match the given name
+        Finds all indexed episodes in a directory or its sub directories whose
+        name, folder name or title contain every word of the given name
 
         Args:
             name: Name of the show to find episodes for
-            directory: None for default directory, otherwise searches a sub folder
+            directory: The directory to search in
 
         Returns:
             episodes: A list of all episodes found
         """
-        regex = _build_regex(name)
-        episodes = []
-        for path in directory.iterdir():
-            # check each file in the set directory
-            if regex.match(path.name.lower()):
-                if path.is_dir():
-                    # if a folder matches the regex, assume it contains the episodes for that show
-                    episodes += self.find_episodes(name, path)
-                    break
-                else:
-                    # otherwise just append it to the list
-                    episodes.append(path)
-            elif path.is_dir() and self.config.get('Search Subfolders', default=False):
-                # If folders are sorted differently, e.g. Ongoing/Winter 2018/Plan to Watch
-                episodes += self.find_episodes(name, path)
-
-        return episodes
+        directory = Path(directory)
+        return [path for path in self.tokens.lookup(name) if directory in path.parents]
 
     def discover_episodes(self, directory):
         """
         Search through a directory to find all files which have a close enough
         name to be considered a part of the same series
         """
-        op_or_ed = re.compile(r'(NCOP)|(NCED)|(\sOP[0-9]+)|(\sED[0-9]+)')
-        for path, dirs, files in walk(directory):  # pylint: disable=W0612
-            for file in files:
-                episode = Path(file)
-                if episode.suffix not in EXTENSIONS:
-                    continue
-                if op_or_ed.search(episode.name):
-                    continue
-                title = clean_title(episode.stem)
-                self.series[title].append(path / episode)
+        self._scan([directory])
+
+    def _scan(self, roots, add_episodes=True) -> ScanStats:
+        """
+        Scans directories for episodes, adds them to the series and updates
+        the token index.
+
+        File names are looked up in the parse cache of the database first,
+        the parses of new file names are written back to it after the scan.
+
+        Args:
+            roots: The directories to scan
+            add_episodes: False to only update the token index
+
+        Returns:
+            The stats of the scan
+        """
+        if not self.parses:
+            self.parses = self._get_file_parses()
+        self._load_tokens()
+        seen = set()
+        for path, title in self.scanner.scan(roots):
+            seen.add(path)
+            self._index_episode(title, path)
+            if add_episodes:
+                self._add_episode(title, path)
+        self.scanner.index.save()
+        self._removed_tokens.extend(self.tokens.prune(roots, seen))
+        with self.db.transaction():
+            self._write_caches()
+        return self.scanner.stats
+
+    def _load_tokens(self):
+        """Loads the token index from the database the first time it is needed."""
+        if self._tokens_loaded:
+            return
+        for token, path in self.db.get_file_tokens():
+            self.tokens.insert(path, (token,))
+        self._tokens_loaded = True
+
+    def _index_episode(self, title, path):
+        """
+        Adds an episode to the token index
+
+        Args:
+            title: The title of the show
+            path: The path of the episode
+        """
+        self._new_tokens.extend((token, path) for token in self.tokens.add(path, title))
+
+    def _write_caches(self):
+        """Writes new file parses and token index changes to the database."""
+        if self._new_parses:
+            new, self._new_parses = self._new_parses, []
+            self.db.add_file_parses(new)
+        if self._removed_tokens:
+            removed, self._removed_tokens = self._removed_tokens, []
+            self.db.delete_file_tokens(removed)
+        if self._new_tokens:
+            new, self._new_tokens = self._new_tokens, []
+            self.db.add_file_tokens(new)
+
+    def apply_changes(self, changes) -> Set[str]:
+        """
+        Applies a batch of changes reported by the library watcher to the
+        series and the database without scanning the library
+
+        Args:
+            changes: The changes, see ene.watcher.Changes
+
+        Returns:
+            The shows whose episodes changed
+        """
+        if changes.rescan:
+            old = {show: self.series.count(show) for show in self.series}
+            self.refresh_shows()
+            self.dump_to_db()
+            return {show for show in self.series if self.series.count(show) != old.get(show)}
+
+        if not self.parses:
+            self.parses = self._get_file_parses()
+        self._load_tokens()
+        known = set(self.series)
+        shows = set()
+        # A directory deleted and created again within a batch is reported as
+        # both, the files created in it must stay
+        for path in changes.deleted:
+            if self.tokens.remove(path):
+                self._removed_tokens.append(path)
+        for directory in changes.deleted_dirs:
+            self._removed_tokens.extend(self.tokens.remove_under(directory))
+
+        for path in changes.created:
+            title = self._parse_title(path.name)
+            if title is not None and path.is_file():
+                self._index_episode(title, path)
+                self._add_episode(title, path)
+                shows.add(self._resolve(title))
+
+        removed = defaultdict(set)
+        for show, episodes in self.db.get_episode_shows(changes.deleted).items():
+            removed[show].update(episodes)
+        for directory in changes.deleted_dirs:
+            for show, episodes in self.db.get_episodes_under(directory).items():
+                removed[show].update(episodes)
+        # Episodes found since the last dump are not in the database yet
+        for show, episodes in self.series.dirty().items():
+            for episode in episodes:
+                if episode in changes.deleted or not changes.deleted_dirs.isdisjoint(
+                        episode.parents):
+                    removed[show].add(episode)
+        for show, episodes in removed.items():
+            episodes -= changes.created
+            if episodes:
+                self.series.discard(show, episodes)
+                shows.add(show)
+
+        dirty = self.series.dirty()
+        with self.db.transaction():
+            self.db.delete_episodes(chain.from_iterable(removed.values()))
+            self.db.write_all_shows_delta(dirty.keys())
+            self.db.write_all_episodes_delta(dirty)
+            self._write_caches()
+        self.series.mark_clean()
+        if not shows.issubset(known):
+            merged = self.cluster_shows()
+            shows = {merged.get(show, show) for show in shows}
+            self.dump_to_db()
+        return shows
+
+    def _parse_title(self, name: str) -> Optional[str]:
+        """
+        Gets the title of the show a file belongs to using the parse cache,
+        recording the parse if it is new
+
+        Args:
+            name: The file name
+
+        Returns:
+            The title of the series, or None if the file is not an episode
+        """
+        title, parse = self._parse_name(name)
+        if parse is not None:
+            self._record_parse(parse)
+        return title
+
+    def _parse_name(self, name: str) -> Tuple[Optional[str], Optional[tuple]]:
+        """
+        Gets the title of the show a file belongs to using the parse cache
+        without changing it. Called from the scanner, possibly on multiple
+        threads at once.
+
+        Args:
+            name: The file name
+
+        Returns:
+            The title of the series, or None if the file is not an episode,
+            and the FileParse row of the file if it was not parsed before
+        """
+        if splitext(name)[1] not in EXTENSIONS:
+            return None, None
+        if name in self.parses:
+            info = self.parses[name]
+            return (info.title if info else None), None
+        info = parse_episode(name)
+        row = (name,) + (info.to_row() if info else (None,) * 7)
+        return (info.title if info else None), row
+
+    def _record_parse(self, row: tuple):
+        """
+        Adds a new parse to the parse cache, to be written to the database
+
+        Args:
+            row: The FileParse row of the file
+        """
+        name = row[0]
+        if name in self.parses:
+            return
+        self.parses[name] = EpisodeInfo(*row[1:]) if row[1] is not None else None
+        self._new_parses.append(row)
+
+    def _get_file_parses(self) -> Dict[str, Optional[EpisodeInfo]]:
+        """
+        Returns:
+            The cached file name parses from the database, None for files that
+            are not episodes
+        """
+        return {name: EpisodeInfo(*row) if row[0] is not None else None
+                for name, row in self.db.get_file_parses().items()}
+
+    def _add_episode(self, title, path):
+        """
+        Adds an episode to a show if it is not already in it
+
+        Args:
+            title: The title of the show
+            path: The path of the episode
+        """
+        title = self._resolve(title)
+        episodes = self.series[title]
+        if path not in episodes:
+            episodes.append(path)
+            self.series.mark_dirty(title)
+
+    def _load_aliases(self):
+        """Loads the show aliases from the database the first time they are needed."""
+        if self.aliases is None:
+            self.aliases = self.db.get_show_aliases()
+
+    def _resolve(self, title):
+        """
+        Gets the name of the show a parsed title belongs to
+
+        Args:
+            title: The parsed title
+
+        Returns:
+            The show name, the title itself if it is not an alias
+        """
+        self._load_aliases()
+        return self.aliases.get(title, title)
 
     def get_readable_names(self, show: str) -> Iterable[str]:
         """
@@ -182,7 +745,14 @@ class FileManager:
         Returns:
             The episode list for the new show
         """
-        self.series[new].append(self.series.pop(old))
+        self._load_aliases()
+        for alias, name in list(self.aliases.items()):
+            if name == old:
+                self.aliases[alias] = new
+        self.aliases[old] = new
+        self.aliases.pop(new, None)
+        self.series[new].extend(self.series.pop(old))
+        self.series.mark_dirty(new)
         self.db.rename_show(old, new)
         return self.series[new]
 
@@ -198,10 +768,75 @@ class FileManager:
         self.series.pop(show)
 
 
+def parse_title(name: str) -> Optional[str]:
+    """
+    Gets the title of the show a file belongs to
+
+    Args:
+        name:
+            The file name
+
+    Returns:
+        The title of the series, or None if the file is not an episode
+    """
+    stem, ext = splitext(name)
+    if ext not in EXTENSIONS or OP_OR_ED.search(name):
+        return None
+    return clean_title(stem)
+
+
+def parse_episode(name: str) -> Optional[EpisodeInfo]:
+    """
+    Parses the show title and episode details out of a file name
+
+    Args:
+        name:
+            The file name
+
+    Returns:
+        The episode details, or None if the file is not an episode
+    """
+    title = parse_title(name)
+    if title is None:
+        return None
+    stem = splitext(name)[0]
+    group = _RELEASE_GROUP.match(stem)
+    group = group[1].strip() or None if group else None
+    version = _VERSION.search(stem)
+    version = int(version[1]) if version else None
+    resolution = _RESOLUTION.search(stem)
+    resolution = int(resolution[1] or resolution[2]) if resolution else None
+    checksum = _CHECKSUM.search(stem)
+    checksum = checksum[1].upper() if checksum else None
+
+    text = _TAGS.sub(' ', stem.translate(_SEPARATORS))
+    season_episode = _SEASON_EPISODE.search(text)
+    if season_episode:
+        return EpisodeInfo(title, int(season_episode[2]), int(season_episode[1]), group,
+                           version, resolution, checksum)
+
+    season = _SEASON_NUMBER.search(text)
+    season_span = season.span() if season else (-1, -1)
+    season = int(season[1] or season[2]) if season else None
+    episode = _EPISODE_MARKER.search(text) or _DASH_EPISODE_NUMBER.search(text)
+    if episode is None:
+        episode = _LEADING_EPISODE_NUMBER.match(text)
+    if episode is None:
+        numbers = [m for m in _NUMBER.finditer(text)
+                   if not season_span[0] <= m.start() < season_span[1]]
+        episode = numbers[-1] if numbers else None
+    episode = int(episode[1]) if episode else None
+    return EpisodeInfo(title, episode, season, group, version, resolution, checksum)
+
+
+@lru_cache(maxsize=2 ** 16)
 def clean_title(title):
     """
     Removes things from a file name that are not part of the title
 
+    The substitutions are applied in order since earlier ones can expose text
+    for later ones, patterns that can not match the title are skipped
+
     Args:
         title:
             The original title to reformat
@@ -210,24 +845,18 @@ def clean_title(title):
         The title of the series without extra things
     """
     # pull out a few common things that should not be part of a title
-    # Adding detailed comments because coming back to regex after a break is confusing
-    title = re.sub(r'[_,]', ' ', title)
-    title = re.sub(r'\[[^]]*\]', '', title)  # Removes things between square brackets
-    title = re.sub(r'\([^O)]*\)', '', title)  # Parenthesis
-    title = re.sub(r'[sS]0?1', '', title)  # Remove season if its season one
-    title = re.sub(r'^[0-9]+\.', '', title)  # Episode number at the beginning
-    title = re.sub(r'[eE][pP]?[0-9]+.*', '', title)  # Anything after an episode number
-    title = re.sub(r'-?\s+[0-9v]*\s*$', '', title)  # Removes trailing episode numbers
-    title = re.sub(r'-\s(Episode)?\s?([0-9v])+.*', '', title)  # '- 08 - episode name
-    title = re.sub(r'[sS]0?([2-9])', r'Season \1', title)  # Replace S02 with Season 2
+    title = title.translate(_SEPARATORS)
+    if '[' in title:
+        title = _SQUARE_BRACKETS.sub('', title)
+    if '(' in title:
+        title = _PARENTHESIS.sub('', title)
+    title = _SEASON_ONE.sub('', title)
+    if '0' <= title[:1] <= '9':
+        title = _LEADING_EPISODE.sub('', title, 1)
+    title = _EPISODE_ONWARDS.sub('', title)
+    title = _TRAILING_EPISODE.sub('', title)
+    if '-' in title:
+        title = _DASH_EPISODE.sub('', title)
+    title = _SEASON.sub(r'Season \1', title)
     title = title.strip()
     return title
-
-
-def _build_regex(name):
-    pattern = '.*'
-    title = name.split(' ')
-    for word in title:
-        pattern += word.lower()
-        pattern += '.*'
-    return re.compile(pattern)
@@ -0,0 +1,222 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module matches local shows to AniList media."""
+from threading import Lock
+from time import time
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from fuzzywuzzy import fuzz
+
+from ene.api import Subquery
+from ene.database import Database
+
+# Number of search results considered for every show name
+CANDIDATES = 3
+# Minimum confidence for a match to be used
+MIN_CONFIDENCE = 0.6
+# Seconds before show names without a match are searched for again
+RETRY_AFTER = 7 * 24 * 60 * 60
+
+MEDIA_FIELDS = """\
+id
+title {
+    romaji
+    english
+    native
+    userPreferred
+}
+synonyms"""
+
+
+class ShowMatch(NamedTuple):
+    """The AniList media matched to a local show."""
+    show_name: str
+    media_id: Optional[int]
+    confidence: float
+    matched_at: int
+
+
+def match_subquery(show: str) -> Subquery:
+    """
+    Builds the search for a show name, to be merged with other searches
+
+    Args:
+        show: The show name
+
+    Returns:
+        The query for the top search results of the show name
+    """
+    field = (f'Page (perPage: {CANDIDATES}) {{ media (search: $search, type: ANIME) {{\n'
+             f'{MEDIA_FIELDS}\n}} }}')
+    return Subquery(field, {'search': show}, {'search': 'String'})
+
+
+def confidence(show: str, media: dict) -> float:
+    """
+    Scores how well a media matches a local show name
+
+    Args:
+        show: The local show name
+        media: The media, with its titles and synonyms
+
+    Returns:
+        The best fuzzy ratio between the show name and any title of the
+        media, from 0 to 1
+    """
+    titles = [title for title in (media.get('title') or {}).values() if title]
+    titles.extend(media.get('synonyms') or ())
+    show = show.lower()
+    return max((fuzz.token_sort_ratio(show, title.lower()) for title in titles), default=0) / 100
+
+
+class ShowMatcher:
+    """
+    Matches local show names to AniList media IDs.
+
+    Matches are stored in the database so they are returned without any
+    request on later runs. Show names that are not stored yet are searched
+    for with API.query_batch, which merges the searches into as few requests
+    as possible. Names without a match are searched for again after
+    `retry_after` seconds.
+    """
+
+    def __init__(self, api, db: Database, retry_after: int = RETRY_AFTER):
+        """
+        Args:
+            api: The Anilist API
+            db: The database to store matches in
+            retry_after: Seconds before names without a match are searched again
+        """
+        self.api = api
+        self.db = db
+        self.retry_after = retry_after
+        self._matches = None
+        self._lock = Lock()
+
+    def _load(self) -> Dict[str, ShowMatch]:
+        """
+        Returns:
+            The stored matches, loaded from the database the first time
+        """
+        with self._lock:
+            if self._matches is None:
+                self._matches = {show: ShowMatch(show, *row)
+                                 for show, row in self.db.get_show_matches().items()}
+            return self._matches
+
+    def cached(self, show: str) -> Optional[ShowMatch]:
+        """
+        Gets the stored match of a show without making any requests
+
+        Args:
+            show: The show name
+
+        Returns:
+            The match, None if the show was never searched for
+        """
+        return self._load().get(show)
+
+    def media_id(self, show: str, min_confidence: float = MIN_CONFIDENCE) -> Optional[int]:
+        """
+        Gets the media ID of a show, searching for it if needed
+
+        Args:
+            show: The show name
+            min_confidence: The minimum confidence of the match
+
+        Returns:
+            The media ID, None if no media matched with enough confidence
+        """
+        match = self.match([show])[show]
+        return match.media_id if match.confidence >= min_confidence else None
+
+    def match(self, shows: Iterable[str]) -> Dict[str, ShowMatch]:
+        """
+        Gets the matches of shows, searching for the ones not stored yet
+
+        Args:
+            shows: The show names
+
+        Returns:
+            A dictionary of show name to its match
+
+        Raises:
+            APIError or OSError if a search failed, the matches of the other
+            searches are still stored
+        """
+        matches = self._load()
+        now = int(time())
+        res = {}
+        pending = []
+        for show in dict.fromkeys(shows):
+            match = matches.get(show)
+            if match is None or self._expired(match, now):
+                pending.append(show)
+            else:
+                res[show] = match
+        if not pending:
+            return res
+        results = self.api.query_batch([match_subquery(show) for show in pending],
+                                       return_exceptions=True)
+        found = {}
+        errors = []
+        for show, result in zip(pending, results):
+            if isinstance(result, Exception):
+                errors.append(result)
+            else:
+                found[show] = self._best_match(show, result, now)
+        self.db.add_show_matches(found.values())
+        with self._lock:
+            matches.update(found)
+        res.update(found)
+        if errors:
+            raise errors[0]
+        return res
+
+    def _expired(self, match: ShowMatch, now: int) -> bool:
+        """
+        Checks if a show without a match should be searched for again
+
+        Args:
+            match: The stored match
+            now: The current unix time
+
+        Returns:
+            True if nothing matched and the search is older than retry_after
+        """
+        return match.media_id is None and now - match.matched_at >= self.retry_after
+
+    @staticmethod
+    def _best_match(show: str, result: Optional[dict], now: int) -> ShowMatch:
+        """
+        Picks the search result that matches a show name best
+
+        Args:
+            show: The show name
+            result: The search results
+            now: The unix time of the match
+
+        Returns:
+            The best match, with no media ID if there were no results
+        """
+        best = ShowMatch(show, None, 0.0, now)
+        for media in (result or {}).get('media') or ():
+            score = confidence(show, media)
+            if score > best.confidence:
+                best = ShowMatch(show, media['id'], score, now)
+        return best
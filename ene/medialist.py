@@ -0,0 +1,354 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module mirrors the user's AniList anime list in the database."""
+from datetime import date
+from threading import Lock
+from time import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ene.api import MediaListStatus
+from ene.database import Database
+
+# Seconds before the whole list is fetched again, to drop deleted entries
+FULL_REFRESH_AFTER = 24 * 60 * 60
+# Number of entries per page when fetching recently updated entries
+PER_PAGE = 50
+
+MEDIA_LIST_FIELDS = """\
+id
+mediaId
+status
+score
+progress
+repeat
+private
+startedAt {
+    year
+    month
+    day
+}
+completedAt {
+    year
+    month
+    day
+}
+updatedAt"""
+
+VIEWER_QUERY = """\
+query {
+    Viewer {
+        id
+    }
+}"""
+
+COLLECTION_QUERY = f"""\
+query ($userId: Int) {{
+    MediaListCollection (userId: $userId, type: ANIME) {{
+        lists {{
+            entries {{
+{MEDIA_LIST_FIELDS}
+            }}
+        }}
+    }}
+}}"""
+
+UPDATED_QUERY = f"""\
+query ($userId: Int, $page: Int, $perPage: Int) {{
+    Page (page: $page, perPage: $perPage) {{
+        pageInfo {{
+            hasNextPage
+        }}
+        mediaList (userId: $userId, type: ANIME, sort: UPDATED_TIME_DESC) {{
+{MEDIA_LIST_FIELDS}
+        }}
+    }}
+}}"""
+
+
+class MediaListEntry(NamedTuple):
+    """An entry of the user's anime list."""
+    media_id: int
+    entry_id: int
+    status: Optional[MediaListStatus]
+    progress: int
+    score: float
+    repeat: int
+    private: bool
+    started_at: Optional[date]
+    completed_at: Optional[date]
+    updated_at: int
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> 'MediaListEntry':
+        """
+        Args:
+            row: The database row
+
+        Returns:
+            The entry stored in the row
+        """
+        (media_id, entry_id, status, progress, score, repeat, private, started_at,
+         completed_at, updated_at) = row
+        return cls(
+            media_id,
+            entry_id,
+            MediaListStatus[status] if status else None,
+            progress or 0,
+            score or 0.0,
+            repeat or 0,
+            bool(private),
+            _iso_date(started_at),
+            _iso_date(completed_at),
+            updated_at
+        )
+
+    @classmethod
+    def from_api(cls, entry: dict) -> 'MediaListEntry':
+        """
+        Args:
+            entry: The MediaList object returned by the API
+
+        Returns:
+            The entry
+        """
+        status = entry.get('status')
+        return cls(
+            entry['mediaId'],
+            entry['id'],
+            MediaListStatus[status] if status else None,
+            entry.get('progress') or 0,
+            entry.get('score') or 0.0,
+            entry.get('repeat') or 0,
+            bool(entry.get('private')),
+            _fuzzy_date(entry.get('startedAt')),
+            _fuzzy_date(entry.get('completedAt')),
+            entry.get('updatedAt') or 0
+        )
+
+    def to_row(self) -> Tuple:
+        """
+        Returns:
+            The database row of the entry
+        """
+        return (
+            self.media_id,
+            self.entry_id,
+            self.status.name if self.status else None,
+            self.progress,
+            self.score,
+            self.repeat,
+            int(self.private),
+            self.started_at.isoformat() if self.started_at else None,
+            self.completed_at.isoformat() if self.completed_at else None,
+            self.updated_at
+        )
+
+
+def _iso_date(value: Optional[str]) -> Optional[date]:
+    """
+    Args:
+        value: A date stored as YYYY-MM-DD
+
+    Returns:
+        The date, None if it is not set
+    """
+    return date(*map(int, value.split('-'))) if value else None
+
+
+def _fuzzy_date(value: Optional[dict]) -> Optional[date]:
+    """
+    Converts an AniList FuzzyDate, missing months and days are taken as the
+    first of the year or month
+
+    Args:
+        value: The FuzzyDate
+
+    Returns:
+        The date, None if the year is not set
+    """
+    if not value or not value.get('year'):
+        return None
+    return date(value['year'], value.get('month') or 1, value.get('day') or 1)
+
+
+class MediaListMirror:
+    """
+    Local copy of the authenticated user's anime list.
+
+    Lookups only read the database, so they are fast and work offline. The
+    mirror is brought up to date by refresh, which only fetches the entries
+    updated since the most recently updated entry it has. Entries deleted on
+    AniList are only noticed when the whole list is fetched, which refresh
+    does once every `full_refresh_after` seconds.
+    """
+
+    def __init__(self, api, db: Database, full_refresh_after: int = FULL_REFRESH_AFTER):
+        """
+        Args:
+            api: The Anilist API
+            db: The database the list is stored in
+            full_refresh_after: Seconds before the whole list is fetched again
+        """
+        self.api = api
+        self.db = db
+        self.full_refresh_after = full_refresh_after
+        self._user_id = None
+        self._lock = Lock()
+
+    def entry(self, media_id: int) -> Optional[MediaListEntry]:
+        """
+        Gets the list entry of a media without making any requests
+
+        Args:
+            media_id: The AniList media ID
+
+        Returns:
+            The entry, None if the media is not on the list
+        """
+        row = self.db.get_media_list_entry(media_id)
+        return MediaListEntry.from_row(row) if row else None
+
+    def progress(self, media_id: int) -> Optional[int]:
+        """
+        Gets the number of episodes of a media watched without making any
+        requests
+
+        Args:
+            media_id: The AniList media ID
+
+        Returns:
+            The progress, None if the media is not on the list
+        """
+        entry = self.entry(media_id)
+        return entry.progress if entry else None
+
+    def entries(self, status: Optional[MediaListStatus] = None) -> List[MediaListEntry]:
+        """
+        Gets the list entries without making any requests
+
+        Args:
+            status: Only get the entries with this status, None for all
+
+        Returns:
+            The entries, most recently updated first
+        """
+        rows = self.db.get_media_list(status.name if status else None)
+        return [MediaListEntry.from_row(row) for row in rows]
+
+    def statuses(self) -> Dict[int, MediaListStatus]:
+        """
+        Returns:
+            A dictionary of media ID to the status of its list entry
+        """
+        return {entry.media_id: entry.status for entry in self.entries()}
+
+    def store(self, entries: Iterable[dict]):
+        """
+        Stores entries returned by the API, such as the result of a mutation
+
+        Args:
+            entries: The MediaList objects returned by the API
+        """
+        self.db.add_media_list_entries(MediaListEntry.from_api(entry).to_row()
+                                       for entry in entries)
+
+    def refresh(self, full: bool = False) -> int:
+        """
+        Fetches the entries updated since the last refresh
+
+        Args:
+            full: True to fetch the whole list
+
+        Returns:
+            The number of entries fetched
+
+        Raises:
+            APIError if a request failed, the mirror is left as it was
+        """
+        with self._lock:
+            user_id = self.user_id()
+            now = int(time())
+            sync = self.db.get_media_list_sync()
+            if full or sync is None or sync[0] != user_id or self._expired(sync[1], now):
+                return self._refresh_full(user_id, now)
+            return self._refresh_updated(user_id)
+
+    def user_id(self) -> int:
+        """
+        Returns:
+            The ID of the authenticated user, requested the first time
+        """
+        if self._user_id is None:
+            self._user_id = self.api.query(VIEWER_QUERY)['data']['Viewer']['id']
+        return self._user_id
+
+    def _expired(self, synced_at: int, now: int) -> bool:
+        """
+        Args:
+            synced_at: The unix time the whole list was last fetched
+            now: The current unix time
+
+        Returns:
+            True if the whole list should be fetched again
+        """
+        return now - synced_at >= self.full_refresh_after
+
+    def _refresh_full(self, user_id: int, now: int) -> int:
+        """
+        Fetches the whole list and replaces the mirror with it
+
+        Args:
+            user_id: The user ID
+            now: The current unix time
+
+        Returns:
+            The number of entries fetched
+        """
+        res = self.api.query(COLLECTION_QUERY, {'userId': user_id})
+        lists = res['data']['MediaListCollection']['lists'] or []
+        # An entry is in every custom list it is added to
+        entries = {entry['mediaId']: MediaListEntry.from_api(entry)
+                   for list_ in lists for entry in list_['entries'] or ()}
+        self.db.replace_media_list(user_id, (entry.to_row() for entry in entries.values()), now)
+        return len(entries)
+
+    def _refresh_updated(self, user_id: int) -> int:
+        """
+        Fetches the entries updated since the most recently updated entry in
+        the mirror, newest first, until an older entry is reached
+
+        Args:
+            user_id: The user ID
+
+        Returns:
+            The number of entries fetched
+        """
+        since = self.db.get_media_list_updated_at()
+        entries = []
+        # Pages are only needed until an old entry shows up, do not fetch ahead
+        pages = self.api.query_pages(UPDATED_QUERY, PER_PAGE, {'userId': user_id}, prefetch=1)
+        for res in pages:
+            page = res['data']['Page']['mediaList'] or []
+            # Entries updated in the same second as `since` may not be stored yet
+            new = [entry for entry in page if (entry.get('updatedAt') or 0) >= since]
+            entries.extend(MediaListEntry.from_api(entry) for entry in new)
+            if len(new) < len(page):
+                pages.close()
+                break
+        self.db.add_media_list_entries(entry.to_row() for entry in entries)
+        return len(entries)
@@ -0,0 +1,268 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module queues list entry updates and sends them in the background."""
+import random
+import threading
+from datetime import date
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+from ene.api import MediaListStatus, Priority, Subquery
+from ene.api.anilist import media_list_entry_variables
+from ene.api.batch import SPLIT_STATUSES, error_status, merge, split
+from ene.database import Database
+from ene.errors import APIError
+from ene.medialist import MEDIA_LIST_FIELDS
+
+# Maximum number of updates merged into a single request
+BATCH_SIZE = 10
+# Seconds between attempts to send the queue when nothing new was queued
+FLUSH_INTERVAL = 60.0
+# Seconds queued updates wait for more updates to be sent with
+FLUSH_DELAY = 2.0
+# Backoff after failed attempts, in seconds
+BASE_DELAY = 5.0
+MAX_DELAY = 15 * 60.0
+# Updates rejected by the API this many times are dropped
+MAX_ATTEMPTS = 8
+
+# GraphQL types of the SaveMediaListEntry arguments
+SAVE_ENTRY_TYPES = {
+    'mediaId': 'Int',
+    'status': 'MediaListStatus',
+    'score': 'Float',
+    'progress': 'Int',
+    'customLists': '[String]',
+    'private': 'Boolean',
+    'startedAt': 'FuzzyDateInput',
+    'completedAt': 'FuzzyDateInput',
+    'repeat': 'Int',
+}
+
+
+def save_entry_subquery(media_id: int, changes: dict) -> Subquery:
+    """
+    Builds the SaveMediaListEntry mutation of queued changes, to be merged
+    with other mutations
+
+    Args:
+        media_id: The AniList media ID
+        changes: The SaveMediaListEntry arguments
+
+    Returns:
+        The mutation
+    """
+    variables = dict(changes, mediaId=media_id)
+    args = ', '.join(f'{name}: ${name}' for name in variables)
+    field = f'SaveMediaListEntry ({args}) {{\n{MEDIA_LIST_FIELDS}\n}}'
+    return Subquery(field, variables, {name: SAVE_ENTRY_TYPES[name] for name in variables})
+
+
+class MediaListOutbox:
+    """
+    Durable queue of updates to the user's anime list.
+
+    Updates are stored in the database, one row per media, so they survive
+    being offline and restarts. Queuing an update to a media that already has
+    one queued merges them, so a burst of progress changes is sent as a
+    single mutation with the latest progress.
+
+    A background thread sends the queue, merging up to `batch_size` mutations
+    into a request. Updates that could not be sent are retried with
+    exponential backoff. Updates the API rejected are dropped after
+    MAX_ATTEMPTS attempts, updates that failed because the request did not go
+    through, was rate limited or hit a server error are kept until it does.
+    """
+
+    def __init__(
+            self,
+            api,
+            db: Database,
+            media_list=None,
+            batch_size: int = BATCH_SIZE,
+            interval: float = FLUSH_INTERVAL,
+            delay: float = FLUSH_DELAY
+    ):
+        """
+        Args:
+            api: The Anilist API
+            db: The database the queue is stored in
+            media_list: The MediaListMirror to store sent updates in, if any
+            batch_size: Maximum number of updates merged into a single request
+            interval: Seconds between attempts to send the queue
+            delay: Seconds queued updates wait for more updates
+        """
+        self.api = api
+        self.db = db
+        self.media_list = media_list
+        self.batch_size = batch_size
+        self.interval = interval
+        self.delay = delay
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def queue(  # pylint: disable=R0913
+            self,
+            id_: int,
+            status: Optional[MediaListStatus] = None,
+            score: Optional[float] = None,
+            progress: Optional[int] = None,
+            custom_lists: Optional[List[str]] = None,
+            private: Optional[bool] = None,
+            started_at: Optional[date] = None,
+            completed_at: Optional[date] = None,
+            repeat: Optional[int] = None
+    ) -> dict:
+        """
+        Queues an update to a list entry, see API.update_media_list_entry for
+        the arguments. Arguments left as None are not changed
+
+        Returns:
+            All the changes queued for the media
+        """
+        changes = media_list_entry_variables(
+            id_, status, score, progress, custom_lists, private, started_at, completed_at, repeat
+        )
+        del changes['mediaId']
+        queued = self.db.queue_media_list_update(id_, changes, int(time()))
+        self._wake.set()
+        return queued
+
+    def pending(self) -> Dict[int, dict]:
+        """
+        Returns:
+            A dictionary of media ID to the changes queued for it
+        """
+        return {media_id: changes
+                for media_id, changes, _, _ in self.db.get_media_list_outbox()}
+
+    def flush(self) -> int:
+        """
+        Sends the queued updates that are due
+
+        Returns:
+            The number of updates sent
+        """
+        with self._flush_lock:
+            rows = self.db.get_media_list_outbox(time())
+            sent = 0
+            for i in range(0, len(rows), self.batch_size):
+                sent += self._send(rows[i:i + self.batch_size])
+            return sent
+
+    def _send(self, rows: List[Tuple]) -> int:
+        """
+        Sends updates in a single request. A request rejected as a whole
+        because of a bad update is split in halves to find that update
+
+        Args:
+            rows: The queued updates
+
+        Returns:
+            The number of updates sent
+        """
+        query, variables = merge([save_entry_subquery(media_id, changes)
+                                  for media_id, changes, _, _ in rows], 'mutation')
+        try:
+            results = split(self.api.query(query, variables, priority=Priority.BACKGROUND),
+                            len(rows))
+        except APIError as e:
+            if error_status(e) not in SPLIT_STATUSES:
+                self._retry(rows)
+                return 0
+            if len(rows) > 1:
+                mid = len(rows) // 2
+                return self._send(rows[:mid]) + self._send(rows[mid:])
+            results = [e]
+        except OSError:
+            self._retry(rows)
+            return 0
+        done = []
+        retry = []
+        entries = []
+        for (media_id, _, version, attempts), result in zip(rows, results):
+            if isinstance(result, APIError) and attempts + 1 < MAX_ATTEMPTS:
+                retry.append((media_id, version, self._retry_at(attempts)))
+                continue
+            done.append((media_id, version))
+            if isinstance(result, dict):
+                entries.append(result)
+        self.db.delete_media_list_outbox(done)
+        self.db.retry_media_list_outbox(retry)
+        if self.media_list is not None and entries:
+            self.media_list.store(entries)
+        return len(entries)
+
+    def _retry(self, rows: List[Tuple]):
+        """
+        Schedules updates to be sent again when the request failed for a
+        reason that is not theirs, such as being offline, rate limits or
+        server errors. Nothing is dropped
+
+        Args:
+            rows: The queued updates
+        """
+        self.db.retry_media_list_outbox(
+            (media_id, version, self._retry_at(attempts))
+            for media_id, _, version, attempts in rows
+        )
+
+    @staticmethod
+    def _retry_at(attempts: int) -> float:
+        """
+        Args:
+            attempts: The number of failed attempts so far
+
+        Returns:
+            The unix time to try again at
+        """
+        # Full jitter: a random delay up to the exponential backoff
+        return time() + random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempts))
+
+    def start(self):
+        """Starts sending the queue on a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._wake.set()
+        self._thread = threading.Thread(target=self._run, name='MediaListOutbox', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and waits for it to exit."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._wake.wait(self.interval):
+                self._wake.clear()
+                # Let a burst of updates collapse before sending
+                if self._stop.wait(self.delay):
+                    break
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=W0703
+                # Keep the thread alive, the updates stay queued
+                pass
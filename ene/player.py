@@ -14,22 +14,76 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+
 """This module handles video playback on different players."""
+import json
 import os
+import shutil
+import socket
 import subprocess
+import tempfile
+import threading
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future
+from enum import Enum, auto
+from itertools import count
 from shutil import which
-from threading import Event
-from time import sleep
-from typing import Union
+from time import monotonic, sleep
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 import requests
 
 
 from ene.constants import IS_MAC, IS_WIN
+from ene.errors import PlayerError
+
+
+class PlaybackEventType(Enum):
+    """The kinds of playback events."""
+    POSITION = auto()
+    PAUSED = auto()
+    RESUMED = auto()
+    ENDED = auto()
+    # The player took the media file, or could not play it
+    READY = auto()
+    FAILED = auto()
+
+
+class PlaybackEvent(NamedTuple):
+    """
+    Something that happened to the media file playing, position is the
+    fraction of the file played from 0 to 1, None if unknown
+    """
+    type: PlaybackEventType
+    path: Optional[str]
+    position: Optional[float] = None
 
 
 class AbstractPlayer(ABC):
-    """Base media player class."""
+    """
+    Base media player class.
+
+    Players that can tell what is happening emit PlaybackEvents to on_event
+    as they happen, and report the furthest fraction of the file played to
+    on_progress.
+
+    Switching files is not instant, events of the old file can still arrive
+    after play was called. Events are dropped from start_playback until the
+    player calls confirm_playback once it knows the new file is playing.
+    Players that load the file in the background emit READY or FAILED once
+    they know, those are never dropped.
+    """
+
+    def __init__(self):
+        # Called with every PlaybackEvent
+        self.on_event: Optional[Callable[[PlaybackEvent], None]] = None
+        # Called with the path of the media file playing and the furthest
+        # fraction of it played
+        self.on_progress: Optional[Callable[[str, float], None]] = None
+        self.path = None
+        self.watched = 0.0
+        self.loading = False
+        self.ended = threading.Event()
 
     @abstractmethod
     def play(self, path: Union[str, os.PathLike]):
@@ -46,16 +100,63 @@ class AbstractPlayer(ABC):
         """Stop playing."""
         raise NotImplementedError()
 
-    @abstractmethod
-    def wait_for_playback_end(self):
-        """Wait for the playback to end."""
-        raise NotImplementedError()
+    def wait_for_playback_end(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the playback to end.
+
+        Args:
+            timeout: Seconds to wait for, None to wait until it ends
+
+        Returns:
+            True if the playback ended
+        """
+        return self.ended.wait(timeout)
 
     @abstractmethod
     def needs_destruction(self):
         """Should the instance be destroyed"""
         raise NotImplementedError()
 
+    def close(self):
+        """Releases the resources of the player before it is dropped."""
+
+    def start_playback(self, path: Union[str, os.PathLike]):
+        """
+        Resets the playback state before a media file starts loading, events
+        are dropped until confirm_playback is called
+
+        Args:
+            path: The location of the media file
+        """
+        self.loading = True
+        self.path = str(path)
+        self.watched = 0.0
+        self.ended.clear()
+
+    def confirm_playback(self):
+        """Marks the media file passed to start_playback as playing."""
+        self.loading = False
+
+    def emit(self, type_: PlaybackEventType, position: Optional[float] = None):
+        """
+        Emits a playback event of the media file playing
+
+        Args:
+            type_: The kind of event
+            position: The fraction of the file played, None if unknown
+        """
+        if self.loading and type_ not in (PlaybackEventType.READY, PlaybackEventType.FAILED):
+            # Still about the file playing before
+            return
+        if position is not None and position > self.watched:
+            self.watched = position
+            if self.on_progress is not None:
+                self.on_progress(self.path, position)
+        if type_ in (PlaybackEventType.ENDED, PlaybackEventType.FAILED):
+            self.ended.set()
+        if self.on_event is not None:
+            self.on_event(PlaybackEvent(type_, self.path, position))
+
 
 class VlcPlayer(AbstractPlayer):
     """
@@ -63,11 +164,39 @@ class VlcPlayer(AbstractPlayer):
     """
 
     def __init__(self):
+        super().__init__()
         import vlc
         self.instance = vlc.Instance('--extraintf=hotkeys')
         self.player = self.instance.media_player_new()
         self.player.video_set_key_input(True)
         self.player.video_set_mouse_input(True)
+        self.setup_listeners(vlc.EventType)
+
+    def setup_listeners(self, event_type):
+        """
+        Attaches listeners to libvlc's event manager. They run on a libvlc
+        thread and must not call back into libvlc
+
+        Args:
+            event_type: vlc.EventType
+        """
+        events = self.player.event_manager()
+        events.event_attach(
+            event_type.MediaPlayerPositionChanged,
+            lambda event: self.emit(PlaybackEventType.POSITION, event.u.new_position)
+        )
+        events.event_attach(event_type.MediaPlayerPaused,
+                            lambda event: self.emit(PlaybackEventType.PAUSED))
+        events.event_attach(event_type.MediaPlayerPlaying, self._on_playing)
+        events.event_attach(event_type.MediaPlayerEndReached,
+                            lambda event: self.emit(PlaybackEventType.ENDED, 1.0))
+
+    def _on_playing(self, event):  # pylint: disable=unused-argument
+        # The media set by play stopped the old one, so it is the one playing
+        if self.loading:
+            self.confirm_playback()
+        else:
+            self.emit(PlaybackEventType.RESUMED)
 
     def play(self, path):
         """
@@ -75,6 +204,7 @@ class VlcPlayer(AbstractPlayer):
         Args:
             path: Path to the media file
         """
+        self.start_playback(path)
         media = self.instance.media_new(path)
         self.player.set_media(media)
         self.player.play()
@@ -82,20 +212,192 @@ class VlcPlayer(AbstractPlayer):
     def stop(self):
         self.player.stop()
 
-    def wait_for_playback_end(self):
-        sleep(30)
-
     def needs_destruction(self):
         return False
 
 
+class StatusPoller:
+    """
+    Polls the status of a player on a background thread.
+
+    The status is polled every `min_interval` seconds while it keeps
+    changing, and the interval doubles up to `max_interval` while it stays the
+    same, such as when playback is paused or stopped. wake polls right away
+    and goes back to the minimum interval, for after a command was sent.
+    call runs a function on the polling thread, for commands that have to
+    wait for the player.
+    """
+
+    MIN_INTERVAL = 0.25
+    MAX_INTERVAL = 2.0
+
+    def __init__(
+            self,
+            fetch: Callable[[], Optional[dict]],
+            callback: Callable[[Optional[dict], dict], None],
+            alive: Callable[[], bool] = lambda: True,
+            min_interval: float = MIN_INTERVAL,
+            max_interval: float = MAX_INTERVAL
+    ):
+        """
+        Args:
+            fetch: Function returning the status, None if it is not available
+            callback: Called with the previous and the new status when it
+                changes
+            alive: Function returning False once the player is gone, which
+                stops polling
+            min_interval: Seconds between polls while the status changes
+            max_interval: Maximum seconds between polls
+        """
+        self.fetch = fetch
+        self.callback = callback
+        self.alive = alive
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.status = None
+        self.ready = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._calls = deque()
+        self._lock = threading.Lock()
+        self._running = False
+
+    def start(self):
+        """Starts polling on a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='StatusPoller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops polling and waits for the background thread to exit."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def wake(self):
+        """Polls right away."""
+        self._wake.set()
+
+    def call(self, func: Callable[[], None]):
+        """
+        Runs func on the polling thread before the next poll, or right away
+        if polling stopped. Calls still pending when polling stops run before
+        the thread exits
+
+        Args:
+            func: The function to run
+        """
+        with self._lock:
+            running = self._running
+            if running:
+                self._calls.append(func)
+        if running:
+            self._wake.set()
+        else:
+            func()
+
+    def _run_calls(self):
+        while self._calls:
+            self._calls.popleft()()
+
+    def _run(self):
+        interval = self.min_interval
+        while not self._stop.is_set() and self.alive():
+            self._run_calls()
+            status = self.fetch()
+            if status is not None:
+                self.ready.set()
+            if status is not None and status != self.status:
+                old, self.status = self.status, status
+                self.callback(old, status)
+                interval = self.min_interval
+            else:
+                interval = min(interval * 2, self.max_interval)
+            if self._wake.wait(interval):
+                self._wake.clear()
+                interval = self.min_interval
+        with self._lock:
+            self._running = False
+        self._run_calls()
+
+
+def status_events(
+        old: Optional[dict],
+        new: dict
+) -> List[Tuple[PlaybackEventType, Optional[float]]]:
+    """
+    Translates a change of the status of VLC's HTTP interface to events
+
+    Args:
+        old: The previous status.json, None if there was none
+        new: The new status.json
+
+    Returns:
+        Tuples of event type and position
+    """
+    old = old or {}
+    old_state = old.get('state')
+    state = new.get('state')
+    position = new.get('position')
+    events = []
+    if state == 'playing' and position is not None and position != old.get('position'):
+        events.append((PlaybackEventType.POSITION, position))
+    if state == 'paused' and old_state == 'playing':
+        events.append((PlaybackEventType.PAUSED, position))
+    elif state == 'playing' and old_state == 'paused':
+        events.append((PlaybackEventType.RESUMED, position))
+    elif state == 'stopped' and old_state in ('playing', 'paused'):
+        events.append((PlaybackEventType.ENDED, None))
+    return events
+
+
+def status_filename(status: dict) -> Optional[str]:
+    """
+    Args:
+        status: The status.json of VLC's HTTP interface
+
+    Returns:
+        The file name of the media playing, None if there is none
+    """
+    information = status.get('information') or {}
+    meta = (information.get('category') or {}).get('meta') or {}
+    return meta.get('filename')
+
+
 class HttpVlcPlayer(AbstractPlayer):
-    """An implementation of the Vlc player using HTTP requests"""
+    """
+    An implementation of the Vlc player using HTTP requests.
+
+    Requests go through one keep-alive session. The HTTP interface has no
+    push notifications, so its status is watched by a StatusPoller. play
+    returns right away, the file is sent from the polling thread once the
+    interface answers, followed by a READY or FAILED event. Every
+    answered request marks the interface as alive for LIVENESS_TTL seconds,
+    so needs_destruction rarely needs a request of its own.
+    """
 
     # The HTTP interface requires a password so its gonna be ene for now
     PASSWORD = 'ene'
+    # Seconds to wait for the interface to come up before sending a command
+    READY_TIMEOUT = 10.0
+    # Backoff between readiness probes, in seconds
+    PROBE_DELAY = 0.05
+    PROBE_MAX_DELAY = 1.0
+    # Seconds an answered request counts as proof the interface is alive
+    LIVENESS_TTL = 2.0
+    # Seconds to wait for the interface to answer a request
+    REQUEST_TIMEOUT = 5.0
 
     def __init__(self, ip, binary=None):
+        super().__init__()
         if not binary and IS_WIN:
             binary = which('vlc.exe')
         elif not binary:
@@ -110,29 +412,137 @@ class HttpVlcPlayer(AbstractPlayer):
         args.append('--extraintf=http')
         args.append('--http-password=' + self.PASSWORD)
 
-        self.base = f'http://:{self.PASSWORD}@{ip}/requests/'
+        self.base = f'http://{ip}/requests/'
+        self.session = requests.Session()
+        self.session.auth = ('', self.PASSWORD)
+        self._alive_at = None
         self.process = subprocess.Popen(args)
-        sleep(1)
+        self.poller = StatusPoller(self._fetch_status, self._on_status,
+                                   lambda: self.process.poll() is None)
+        self.poller.start()
+
+    def _get(self, **params) -> Optional[requests.Response]:
+        """
+        Sends a request to the interface, recording if it answered
+
+        Args:
+            **params: The query parameters, such as the command
+
+        Returns:
+            The response, None if the interface could not be reached
+        """
+        try:
+            res = self.session.get(f'{self.base}status.json', params=params,
+                                   timeout=self.REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException:
+            return None
+        if res.status_code == 200:
+            self._alive_at = monotonic()
+        return res
+
+    def _fetch_status(self) -> Optional[dict]:
+        """
+        Returns:
+            The status of the player, None if the interface did not answer
+        """
+        res = self._get()
+        if res is None or res.status_code != 200:
+            return None
+        try:
+            return res.json()
+        except ValueError:
+            return None
+
+    def _on_status(self, old: Optional[dict], new: dict):
+        if self.loading:
+            if status_filename(new) != os.path.basename(self.path):
+                # Still the status of the file playing before
+                return
+            self.confirm_playback()
+        for type_, position in status_events(old, new):
+            self.emit(type_, position)
+
+    def _alive(self) -> bool:
+        """
+        Returns:
+            True if the interface answered within the last LIVENESS_TTL seconds
+        """
+        return self._alive_at is not None and monotonic() - self._alive_at < self.LIVENESS_TTL
+
+    def wait_ready(self, timeout: float = READY_TIMEOUT) -> bool:
+        """
+        Probes the interface with exponential backoff until it answers
+
+        Args:
+            timeout: Seconds to wait for
+
+        Returns:
+            True if the interface answered, False if it did not in time or
+            VLC exited
+        """
+        deadline = monotonic() + timeout
+        delay = self.PROBE_DELAY
+        while True:
+            if self._alive():
+                return True
+            if self.process.poll() is not None:
+                return False
+            res = self._get()
+            if res is not None and res.status_code == 200:
+                return True
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            # The poller answering first ends the wait early
+            self.poller.ready.wait(min(delay, remaining))
+            delay = min(delay * 2, self.PROBE_MAX_DELAY)
 
     def play(self, path: Union[str, os.PathLike]):
-        url = f'{self.base}status.json?command=in_play&input={path}'
-        response = requests.get(url)
-        print(response.status_code)
+        self.start_playback(path)
+        path = self.path
+        self.poller.call(lambda: self._send_play(path))
+
+    def _send_play(self, path: str):
+        """
+        Sends the media file to VLC once the interface answers, runs on the
+        polling thread
+
+        Args:
+            path: The location of the media file
+        """
+        if path != self.path:
+            # Another file was played since
+            return
+        if not self.wait_ready(self.READY_TIMEOUT):
+            self.emit(PlaybackEventType.FAILED)
+            return
+        res = self._get(command='in_play', input=path)
+        if path != self.path:
+            return
+        if res is None or res.status_code != 200:
+            self.emit(PlaybackEventType.FAILED)
+        else:
+            self.emit(PlaybackEventType.READY)
 
     def stop(self):
-        requests.get(f'{self.base}?command=pl_empty')
+        self._get(command='pl_empty')
+        self.poller.wake()
 
-    def wait_for_playback_end(self):
-        pass
+    def close(self):
+        """Stops watching the status, VLC itself is left open."""
+        self.poller.stop()
+        self.session.close()
 
     def needs_destruction(self):
-        try:
-            # if a request gives a non 200 status code just destroy it
-            res = requests.get(f'{self.base}status.json')
-            return res.status_code != 200
-        except requests.exceptions.ConnectionError:
-            # more likely is a connection failure. destroy it in this case
+        if self.process.poll() is not None:
             return True
+        if self._alive() or not self.poller.ready.is_set():
+            # Answered recently, or still starting up
+            return False
+        # if a request gives a non 200 status code just destroy it, more
+        # likely is a connection failure. destroy it in this case too
+        res = self._get()
+        return res is None or res.status_code != 200
 
 
 class MpvPlayer(AbstractPlayer):
@@ -144,12 +554,16 @@ class MpvPlayer(AbstractPlayer):
         """
         Sets up a new MPV instance with the default keybindings
         """
+        super().__init__()
         # Importing mpv at the top causes a segfault when creating an MpvPlayer
         # from Ene, so it's here now
         import mpv
         self.player = mpv.MPV(input_default_bindings=True, input_vo_keyboard=True)
-        self.eof = Event()
         self.closed = False
+        # Files passed to play and files mpv started, each only written by
+        # one thread. A file is confirmed once every file passed started
+        self.loads = 0
+        self.starts = 0
         self.setup_listeners()
 
     def play(self, path):
@@ -159,6 +573,8 @@ class MpvPlayer(AbstractPlayer):
         Args:
             path: The location of the media file to play
         """
+        self.start_playback(path)
+        self.loads += 1
         self.player.play(path)
 
     def stop(self):
@@ -174,18 +590,256 @@ class MpvPlayer(AbstractPlayer):
             self.stop()
             self.closed = True
 
+        @self.player.event_callback('start_file')
+        def on_file_start(event):  # pylint: disable=unused-argument,unused-variable
+            self.starts += 1
+
+        @self.player.event_callback('file_loaded')
+        def on_file_loaded(event):  # pylint: disable=unused-argument,unused-variable
+            if self.starts >= self.loads:
+                self.confirm_playback()
+
         @self.player.event_callback('end_file')
         def on_file_end(event):  # pylint: disable=unused-argument,unused-variable
-            self.eof.set()
+            self.emit(PlaybackEventType.ENDED)
 
-    def wait_for_playback_end(self):
+        @self.player.property_observer('percent-pos')
+        def on_position(name, value):  # pylint: disable=unused-argument,unused-variable
+            if value is not None:
+                self.emit(PlaybackEventType.POSITION, value / 100)
+
+        @self.player.property_observer('pause')
+        def on_pause(name, value):  # pylint: disable=unused-argument,unused-variable
+            self.emit(PlaybackEventType.PAUSED if value else PlaybackEventType.RESUMED)
+
+    def needs_destruction(self):
+        return self.closed
+
+
+class MpvIpcPlayer(AbstractPlayer):
+    """
+    An implementation of the MPV player driving one long lived mpv process
+    over its JSON IPC socket.
+
+    The process is started with --idle, so it stays up between files and
+    playing another episode is a loadfile on the warm process. Commands are
+    sent with a request_id and return futures, which a reader thread
+    resolves as replies arrive. The same thread turns mpv's events and
+    property changes into PlaybackEvents.
+
+    Only Unix sockets are supported, mpv uses named pipes on Windows.
+    """
+
+    # Seconds to wait for mpv to create its socket
+    CONNECT_TIMEOUT = 10.0
+    # Backoff between connection attempts, in seconds
+    CONNECT_DELAY = 0.02
+    CONNECT_MAX_DELAY = 0.5
+    # Observed property IDs
+    _POSITION = 1
+    _PAUSE = 2
+
+    def __init__(
+            self,
+            socket_path: str,
+            process: Optional[subprocess.Popen] = None,
+            socket_dir: Optional[str] = None
+    ):
         """
-        Waits until the media stream reaches end of file
+        Args:
+            socket_path: The path of mpv's IPC socket
+            process: The mpv process, if it was started by ene
+            socket_dir: Private directory holding the socket, removed on close
         """
-        self.eof.wait()
+        super().__init__()
+        self.socket_path = socket_path
+        self.process = process
+        self.socket_dir = socket_dir
+        self.closed = False
+        # Files passed to play and files mpv started, each only written by
+        # one thread. A file is confirmed once every file passed started
+        self.loads = 0
+        self.starts = 0
+        self._ids = count(1)
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self.sock = self._connect()
+        self._reader = threading.Thread(target=self._read, name='MpvIpcReader', daemon=True)
+        self._reader.start()
+        self.command('observe_property', self._POSITION, 'percent-pos')
+        self.command('observe_property', self._PAUSE, 'pause')
+
+    @classmethod
+    def launch(cls, binary: Optional[str] = None) -> 'MpvIpcPlayer':
+        """
+        Starts an idle mpv process and connects to it
+
+        Args:
+            binary: The mpv executable, None to find it on the PATH
+
+        Returns:
+            The player
+        """
+        binary = binary or which('mpv')
+        # Only the user can reach a socket in a directory made by mkdtemp
+        socket_dir = tempfile.mkdtemp(prefix='ene-mpv-')
+        socket_path = os.path.join(socket_dir, 'mpv.sock')
+        process = subprocess.Popen([
+            binary,
+            '--idle=yes',
+            '--force-window=yes',
+            '--input-ipc-server=' + socket_path,
+        ])
+        try:
+            return cls(socket_path, process, socket_dir)
+        except PlayerError:
+            process.kill()
+            shutil.rmtree(socket_dir, ignore_errors=True)
+            raise
+
+    def _connect(self) -> socket.socket:
+        """
+        Connects to the IPC socket, retrying with exponential backoff while
+        mpv starts up
+
+        Returns:
+            The connected socket
+
+        Raises:
+            PlayerError if mpv exited or did not create the socket in time
+        """
+        deadline = monotonic() + self.CONNECT_TIMEOUT
+        delay = self.CONNECT_DELAY
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                return sock
+            except OSError as e:
+                sock.close()
+                if self.process is not None and self.process.poll() is not None:
+                    raise PlayerError('mpv exited before it could be connected to') from e
+                if monotonic() >= deadline:
+                    raise PlayerError(f'Could not connect to mpv: {e}') from e
+            sleep(delay)
+            delay = min(delay * 2, self.CONNECT_MAX_DELAY)
+
+    def command(self, *args) -> Future:
+        """
+        Sends a command without waiting for it to run
+
+        Args:
+            *args: The command name and its arguments
+
+        Returns:
+            A future for the data returned by the command, it raises
+            PlayerError if the command failed
+        """
+        future = Future()
+        with self._lock:
+            if self.closed:
+                future.set_exception(PlayerError('mpv is closed'))
+                return future
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            message = json.dumps({'command': list(args), 'request_id': request_id})
+            try:
+                self.sock.sendall(message.encode('utf-8') + b'\n')
+            except OSError as e:
+                del self._pending[request_id]
+                future.set_exception(PlayerError(f'Could not send to mpv: {e}'))
+        return future
+
+    def _read(self):
+        """Reads replies and events until the connection closes."""
+        with self.sock.makefile('rb') as lines:
+            for line in lines:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if 'request_id' in message:
+                    self._reply(message)
+                elif 'event' in message:
+                    self._on_event(message)
+        with self._lock:
+            self.closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(PlayerError('mpv closed the connection'))
+
+    def _reply(self, message: dict):
+        """
+        Resolves the future of a command
+
+        Args:
+            message: The reply
+        """
+        with self._lock:
+            future = self._pending.pop(message['request_id'], None)
+        if future is None:
+            return
+        if message.get('error', 'success') == 'success':
+            future.set_result(message.get('data'))
+        else:
+            future.set_exception(PlayerError(message['error']))
+
+    def _on_event(self, message: dict):
+        """
+        Emits the playback events of an mpv event
+
+        Args:
+            message: The event
+        """
+        event = message['event']
+        if event == 'property-change':
+            value = message.get('data')
+            if message.get('id') == self._POSITION and value is not None:
+                self.emit(PlaybackEventType.POSITION, value / 100)
+            elif message.get('id') == self._PAUSE and value is not None:
+                self.emit(PlaybackEventType.PAUSED if value else PlaybackEventType.RESUMED)
+        elif event == 'start-file':
+            self.starts += 1
+        elif event == 'file-loaded' and self.starts >= self.loads:
+            self.confirm_playback()
+        # Replacing the file ends the old one with reason stop, which is not
+        # the end of the playback
+        elif event == 'end-file' and message.get('reason') in ('eof', 'quit', 'error'):
+            self.emit(PlaybackEventType.ENDED)
+
+    def play(self, path):
+        """
+        Plays the media file given by path, replacing the one playing
+
+        Args:
+            path: The location of the media file to play
+        """
+        self.start_playback(path)
+        self.loads += 1
+        self.command('loadfile', str(path), 'replace')
+
+    def stop(self):
+        self.command('stop')
+
+    def close(self):
+        """Quits mpv and closes the connection."""
+        self.command('quit')
+        if self.process is not None:
+            try:
+                self.process.wait(self.CONNECT_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.join()
+        self.sock.close()
+        if self.socket_dir is not None:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
 
     def needs_destruction(self):
-        return self.closed
+        return self.closed or (self.process is not None and self.process.poll() is not None)
 
 
 class GenericPlayer(AbstractPlayer):
@@ -195,6 +849,7 @@ class GenericPlayer(AbstractPlayer):
     """
 
     def __init__(self, path):
+        super().__init__()
         self.player_path = path
         self.player = None
 
@@ -206,15 +861,22 @@ class GenericPlayer(AbstractPlayer):
             path: The location of the media file to play
         """
         if self.player is None:
+            self.start_playback(path)
             self.player = subprocess.Popen([self.player_path, path])
+            self.confirm_playback()
 
     def stop(self):
         if self.player is not None:
             self.player.terminate()
 
-    def wait_for_playback_end(self):
-        if self.player is not None:
-            self.player.wait()
+    def wait_for_playback_end(self, timeout=None):
+        if self.player is None:
+            return False
+        try:
+            self.player.wait(timeout)
+        except subprocess.TimeoutExpired:
+            return False
+        return True
 
     def needs_destruction(self):
         return True
@@ -237,6 +899,8 @@ def get_player(config):
             return HttpVlcPlayer('127.0.0.1:8080')
         return VlcPlayer()
     elif option == 'mpv':
+        if config.get('MPV IPC') and not IS_WIN:
+            return MpvIpcPlayer.launch()
         return MpvPlayer()
     else:
         return GenericPlayer(config.get('Player Path'))
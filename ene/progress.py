@@ -0,0 +1,183 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module syncs watched episodes to the user's AniList list."""
+from concurrent.futures import Executor, Future
+from os import PathLike
+from pathlib import Path
+from threading import Lock
+from typing import Optional, Union
+
+from ene.api import MediaListStatus
+
+# Fraction of an episode that has to be played for it to count as watched
+WATCHED_THRESHOLD = 0.85
+
+
+class ProgressTracker:
+    """
+    Queues progress updates for episodes as they are watched.
+
+    An episode counts as watched once the player reports, through update,
+    that the played fraction crossed `threshold`. The show's AniList media ID
+    comes from the ShowMatcher and the episode number from the name of the
+    file, both normally cached already. The update goes to the MediaListOutbox, which
+    sends it in the background, so nothing here blocks the UI or playback.
+
+    Progress is never lowered. Episodes at or below the progress on the list
+    mirror, or the progress already queued, are skipped.
+    """
+
+    def __init__(
+            self,
+            files,
+            matcher,
+            outbox,
+            pool: Executor,
+            media_list=None,
+            threshold: float = WATCHED_THRESHOLD
+    ):
+        """
+        Args:
+            files: The FileManager of the local library
+            matcher: The ShowMatcher of local shows to AniList media
+            outbox: The MediaListOutbox to queue updates in
+            pool: Executor the work is done on
+            media_list: The MediaListMirror to compare progress with, if any
+            threshold: Fraction of an episode that has to be played for it
+                to count as watched
+        """
+        self.files = files
+        self.matcher = matcher
+        self.outbox = outbox
+        self.pool = pool
+        self.media_list = media_list
+        self.threshold = threshold
+        self._synced = set()
+        self._lock = Lock()
+
+    @classmethod
+    def from_config(cls, config, *args, **kwargs) -> 'ProgressTracker':
+        """
+        Creates a tracker with the watched threshold set in the config
+
+        Args:
+            config: The configuration, 'Watched Threshold' is a fraction from
+                0 to 1
+            *args: The other arguments of the tracker
+            **kwargs: The other arguments of the tracker
+
+        Returns:
+            The tracker
+        """
+        return cls(*args, threshold=config.get('Watched Threshold', WATCHED_THRESHOLD), **kwargs)
+
+    def update(
+            self,
+            path: Union[str, PathLike],
+            position: float,
+            show: Optional[str] = None
+    ) -> Optional[Future]:
+        """
+        Reports how much of an episode has been played, queuing the progress
+        in the background once it crosses the watched threshold. Fits
+        AbstractPlayer.on_progress.
+
+        The episode and its show are looked up on the calling thread, as the
+        FileManager is not thread safe, and only the first report over the
+        threshold submits work to the pool.
+
+        Args:
+            path: The path of the episode
+            position: The fraction of the episode played, from 0 to 1
+            show: The show the episode belongs to, None to look it up
+
+        Returns:
+            A future for the progress queued, None if the episode does not
+            count as watched yet or was already submitted
+        """
+        path = Path(path)
+        if position < self.threshold:
+            return None
+        with self._lock:
+            if path in self._synced:
+                return None
+            self._synced.add(path)
+        try:
+            info = self.files.episode_info(path)
+            if info is None or info.episode is None:
+                return None
+            show = show or self.files.show_of(path)
+        except Exception:
+            self._forget(path)
+            raise
+        return self.pool.submit(self._update, path, info.episode, show)
+
+    def _forget(self, path: Path):
+        """
+        Lets an episode be submitted again on its next report
+
+        Args:
+            path: The path of the episode
+        """
+        with self._lock:
+            self._synced.discard(path)
+
+    def _update(self, path: Path, episode: int, show: Optional[str]) -> Optional[int]:
+        """
+        Queues the progress of a watched episode
+
+        Args:
+            path: The path of the episode
+            episode: The episode number
+            show: The show the episode belongs to
+
+        Returns:
+            The progress queued, None if nothing was queued
+        """
+        try:
+            return self._queue(episode, show)
+        except Exception:
+            # Not synced, try again on the next report
+            self._forget(path)
+            raise
+
+    def _queue(self, episode: int, show: Optional[str]) -> Optional[int]:
+        """
+        Queues the progress of a watched episode, unless it would lower the
+        progress on the list
+
+        Args:
+            episode: The episode number
+            show: The show the episode belongs to
+
+        Returns:
+            The progress queued, None if nothing was queued
+        """
+        media_id = self.matcher.media_id(show) if show is not None else None
+        if media_id is None:
+            return None
+        queued = self.outbox.pending().get(media_id, {}).get('progress')
+        entry = self.media_list.entry(media_id) if self.media_list is not None else None
+        progress = max(queued or 0, entry.progress if entry else 0)
+        if episode <= progress:
+            return None
+        status = None
+        if entry is None or entry.status is MediaListStatus.PLANNING:
+            status = MediaListStatus.CURRENT
+        self.outbox.queue(media_id, status=status, progress=episode)
+        return episode
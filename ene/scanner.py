@@ -0,0 +1,445 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module scans local directories for video files."""
+import json
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+
+class ScanStats:
+    """
+    Counters describing what a library scan did
+    """
+
+    def __init__(self):
+        self.dirs_walked = 0
+        self.dirs_skipped = 0
+        self.files_parsed = 0
+        self.files_reused = 0
+
+    def __repr__(self):
+        return (f'ScanStats(dirs_walked={self.dirs_walked}, '
+                f'dirs_skipped={self.dirs_skipped}, '
+                f'files_parsed={self.files_parsed}, '
+                f'files_reused={self.files_reused})')
+
+
+class DirectoryIndex:
+    """
+    Persisted per-directory index used to skip directories that have not
+    changed since the last scan.
+
+    Each directory is recorded with its mtime and inode, along with the video
+    files it contained and their parsed titles, and the names of its sub
+    directories. Adding, removing or renaming an entry changes the mtime of
+    its directory, so these are enough to detect a changed directory without
+    listing it.
+    """
+
+    def __init__(self, index_path: Path):
+        """
+        Args:
+            index_path: The file the index is persisted to
+        """
+        self.index_path = index_path
+        self.entries = self._read_index() if self.index_path.is_file() else {}
+
+    def _read_index(self) -> Dict[str, dict]:
+        """
+        Reads the index from file
+
+        Returns:
+            dict of directory path to index entry, empty if the file is corrupt
+        """
+        try:
+            with self.index_path.open() as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """Writes the index in memory to file."""
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            json.dump(self.entries, f)
+        os.replace(str(tmp), str(self.index_path))
+
+    def lookup(self, directory: str, stat: os.stat_result) -> Optional[dict]:
+        """
+        Looks up the index entry of an unchanged directory
+
+        Args:
+            directory: The directory path
+            stat: The current stat result of the directory
+
+        Returns:
+            The index entry if the directory has not changed, otherwise None
+        """
+        entry = self.entries.get(directory)
+        if entry is None:
+            return None
+        if entry['mtime'] != stat.st_mtime_ns or entry['inode'] != stat.st_ino:
+            return None
+        return entry
+
+    def update(self, directory: str, stat: os.stat_result, files: Dict[str, str],
+               dirs: List[str]):
+        """
+        Records the contents of a directory
+
+        Args:
+            directory: The directory path
+            stat: The stat result of the directory taken before it was listed
+            files: Mapping of video file names to their titles
+            dirs: Names of the sub directories
+        """
+        self.entries[directory] = {
+            'mtime': stat.st_mtime_ns,
+            'inode': stat.st_ino,
+            'files': files,
+            'dirs': dirs
+        }
+
+    def get_files(self, directory: str) -> Dict[str, str]:
+        """
+        Gets the files recorded for a directory
+
+        Args:
+            directory: The directory path
+
+        Returns:
+            Mapping of video file names to their titles
+        """
+        entry = self.entries.get(directory)
+        return entry['files'] if entry else {}
+
+    def prune(self, roots: Iterable[Path], seen: Set[str]):
+        """
+        Removes entries under the given roots that were not seen in a scan
+
+        Args:
+            roots: The scanned root directories
+            seen: The directories that were seen during the scan
+        """
+        roots = tuple(str(root) for root in roots)
+        prefixes = tuple(os.path.join(root, '') for root in roots)
+        for directory in list(self.entries):
+            if directory in seen:
+                continue
+            if directory in roots or directory.startswith(prefixes):
+                del self.entries[directory]
+
+
+class TokenIndex:
+    """
+    Inverted index of normalized tokens to the video files they appear in.
+
+    A file is indexed by the tokens of its name, the name of the directory it
+    is in and the title parsed from its name, so finding the files of a show
+    is an intersection of the sets of its title tokens.
+    """
+
+    _TOKEN = re.compile(r'[^\W_]+')
+
+    def __init__(self):
+        self.tokens: Dict[str, Set[Path]] = defaultdict(set)
+        self.paths: Dict[Path, Set[str]] = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    @classmethod
+    def tokenize(cls, text: str) -> Set[str]:
+        """
+        Splits text into normalized tokens
+
+        Args:
+            text: The text
+
+        Returns:
+            The lower case alphanumeric words of the text
+        """
+        return set(cls._TOKEN.findall(text.lower()))
+
+    def add(self, path: Path, title: str) -> Set[str]:
+        """
+        Adds a file to the index
+
+        Args:
+            path: The file path
+            title: The title of the show the file belongs to
+
+        Returns:
+            The tokens the file was indexed by, empty if it already was
+        """
+        if path in self.paths:
+            return set()
+        tokens = self.tokenize(f'{path.parent.name} {path.name} {title}')
+        self.insert(path, tokens)
+        return tokens
+
+    def insert(self, path: Path, tokens: Iterable[str]):
+        """
+        Adds a file to the index by the given tokens
+
+        Args:
+            path: The file path
+            tokens: The tokens to index the file by
+        """
+        indexed = self.paths.setdefault(path, set())
+        for token in tokens:
+            indexed.add(token)
+            self.tokens[token].add(path)
+
+    def remove(self, path: Path) -> bool:
+        """
+        Removes a file from the index
+
+        Args:
+            path: The file path
+
+        Returns:
+            True if the file was in the index
+        """
+        tokens = self.paths.pop(path, None)
+        if tokens is None:
+            return False
+        for token in tokens:
+            paths = self.tokens[token]
+            paths.discard(path)
+            if not paths:
+                del self.tokens[token]
+        return True
+
+    def remove_under(self, directory: Path) -> List[Path]:
+        """
+        Removes all files inside a directory from the index
+
+        Args:
+            directory: The directory path
+
+        Returns:
+            The removed paths
+        """
+        removed = [path for path in self.paths if directory in path.parents]
+        for path in removed:
+            self.remove(path)
+        return removed
+
+    def prune(self, roots: Iterable[Path], seen: Set[Path]) -> List[Path]:
+        """
+        Removes files under the given roots that were not seen in a scan
+
+        Args:
+            roots: The scanned root directories
+            seen: The files that were seen during the scan
+
+        Returns:
+            The removed paths
+        """
+        roots = {Path(root) for root in roots}
+        removed = [path for path in self.paths
+                   if path not in seen and not roots.isdisjoint(path.parents)]
+        for path in removed:
+            self.remove(path)
+        return removed
+
+    def lookup(self, name: str) -> Set[Path]:
+        """
+        Finds the files indexed by every token of a name
+
+        Args:
+            name: The name, usually the title of a show
+
+        Returns:
+            The matching file paths
+        """
+        tokens = self.tokenize(name)
+        if not tokens:
+            return set()
+        sets = sorted((self.tokens.get(token, set()) for token in tokens), key=len)
+        return sets[0].intersection(*sets[1:])
+
+
+class _DirScan(NamedTuple):
+    """The result of visiting a single directory."""
+    directory: str
+    stat: os.stat_result
+    walked: bool
+    files: Dict[str, str]
+    dirs: List[str]
+    parsed: int
+    reused: int
+    parses: List[Any]
+
+
+class LibraryScanner:
+    """
+    Incrementally scans directories for episodes using a DirectoryIndex.
+
+    A directory is only listed again if its mtime or inode changed since the
+    last scan, otherwise the files and sub directories recorded in the index
+    are reused. Sub directories are always checked since adding a file to a
+    sub directory does not change the mtime of its parent.
+
+    If an executor is given, every directory is visited as its own task so the
+    I/O latency of multiple roots and network mounts overlaps. File names are
+    parsed on those tasks, but the new parses are handed to `record`, and the
+    index and stats are updated, only on the thread consuming the scan.
+    """
+
+    def __init__(
+            self,
+            index: DirectoryIndex,
+            parse: Callable[[str], Tuple[Optional[str], Any]],
+            record: Optional[Callable[[Any], None]] = None,
+            pool: Optional[Executor] = None
+    ):
+        """
+        Args:
+            index: The directory index
+            parse:
+                Function that takes a file name and returns the title of the
+                show it belongs to, or None if the file is not an episode,
+                and a new parse to record, or None if nothing is new. It may
+                run on any thread so it must not modify shared state
+            record:
+                Function called with every new parse, on the thread
+                consuming the scan
+            pool: Executor to visit directories on, None to scan serially
+        """
+        self.index = index
+        self.parse = parse
+        self.record = record
+        self.pool = pool
+        self.stats = ScanStats()
+
+    def scan(self, roots: Iterable[Path]) -> Iterator[Tuple[Path, str]]:
+        """
+        Scans the root directories and all their sub directories
+
+        Args:
+            roots: The directories to scan
+
+        Yields:
+            Tuples of episode path and show title
+        """
+        roots = [str(root) for root in roots]
+        self.stats = ScanStats()
+        seen = set()
+        for res in self._visit_all(roots):
+            seen.add(res.directory)
+            if res.walked:
+                self.stats.dirs_walked += 1
+                self.index.update(res.directory, res.stat, res.files, res.dirs)
+            else:
+                self.stats.dirs_skipped += 1
+            self.stats.files_parsed += res.parsed
+            self.stats.files_reused += res.reused
+            if self.record is not None:
+                for parse in res.parses:
+                    self.record(parse)
+            for name, title in res.files.items():
+                yield Path(res.directory, name), title
+        self.index.prune(roots, seen)
+
+    def _visit_all(self, roots: List[str]) -> Iterator[_DirScan]:
+        """
+        Visits the root directories and all their sub directories
+
+        Args:
+            roots: The directories to visit
+
+        Yields:
+            The result of each visited directory
+        """
+        if self.pool is None:
+            stack = list(reversed(roots))
+            while stack:
+                res = self._visit(stack.pop())
+                if res is not None:
+                    yield res
+                    stack.extend(os.path.join(res.directory, name) for name in reversed(res.dirs))
+            return
+
+        pending = {self.pool.submit(self._visit, root) for root in roots}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                res = future.result()
+                if res is None:
+                    continue
+                for name in res.dirs:
+                    pending.add(self.pool.submit(self._visit, os.path.join(res.directory, name)))
+                yield res
+
+    def _visit(self, directory: str) -> Optional[_DirScan]:
+        """
+        Visits a directory, listing it only if it changed since the last scan.
+
+        This does not modify the index or record parses so it is safe to run
+        on any thread.
+
+        Args:
+            directory: The directory path
+
+        Returns:
+            The result of the visit, None if the directory can not be read
+        """
+        try:
+            stat = os.stat(directory)
+        except OSError:
+            return None
+        entry = self.index.lookup(directory, stat)
+        if entry is not None:
+            files = entry['files']
+            return _DirScan(directory, stat, False, files, entry['dirs'], 0, len(files), [])
+
+        old_files = self.index.get_files(directory)
+        files = {}
+        dirs = []
+        parses = []
+        parsed = reused = 0
+        try:
+            with os.scandir(directory) as entries:
+                for dir_entry in entries:
+                    if dir_entry.is_dir():
+                        if not dir_entry.is_symlink():
+                            dirs.append(dir_entry.name)
+                        continue
+                    title = old_files.get(dir_entry.name)
+                    if title is None:
+                        title, parse = self.parse(dir_entry.name)
+                        if parse is not None:
+                            parses.append(parse)
+                        parsed += 1
+                    else:
+                        reused += 1
+                    if title is not None:
+                        files[dir_entry.name] = title
+        except OSError:
+            return None
+        dirs.sort()
+        return _DirScan(directory, stat, True, files, dirs, parsed, reused, parses)
@@ -16,8 +16,9 @@
 
 """This module contains the main window."""
 from pathlib import Path
+from threading import Thread
 
-from PySide2.QtCore import Qt, Slot
+from PySide2.QtCore import QTimer, Qt, Signal, Slot
 from PySide2.QtWidgets import (
     QFileDialog,
     QGridLayout,
@@ -34,8 +35,13 @@ from PySide2.QtWidgets import (
 import ene.player
 from ene.constants import IS_WIN
 from ene.files import FileManager
+from ene.matcher import ShowMatcher
+from ene.medialist import MediaListMirror
+from ene.outbox import MediaListOutbox
+from ene.progress import ProgressTracker
 from ene.resources import Ui_window_main
 from ene.util import open_source_code
+from ene.watcher import Changes, LibraryWatcher
 from .custom import EpisodeButton, FlowLayout, SeriesButton
 from .media_browser import MediaBrowser
 
@@ -43,16 +49,45 @@ from .media_browser import MediaBrowser
 class MainWindow(QMainWindow, Ui_window_main):
     """Main window of the application."""
 
+    library_changed_signal = Signal(object)
+    library_rescanned_signal = Signal(object, object)
+    progress_signal = Signal(object, float)
+
     def __init__(self, app):
         """
         Initialize the ui files for the application
         """
         super().__init__()
         self.app = app
-        self.files = FileManager(self.app.config, self.app.data_home)
+        self.files = FileManager(self.app.config, self.app.data_home, self.app.pool)
+        self.matcher = ShowMatcher(self.app.api, self.files.db)
+        self.media_list = MediaListMirror(self.app.api, self.files.db)
+        self.app.pool.submit(self.media_list.refresh)
+        self.outbox = MediaListOutbox(self.app.api, self.files.db, self.media_list)
+        self.outbox.start()
+        self.progress = ProgressTracker.from_config(
+            self.app.config, self.files, self.matcher, self.outbox, self.app.pool, self.media_list
+        )
+        # Players report progress on their own threads, the tracker looks up
+        # the episode in the FileManager on the UI thread
+        self.progress_signal.connect(self.progress.update)
         self.player = None
         self.current_show = None
+        self._rescanning = False
+        self._pending_changes = []
         self.setupUi(self)
+        self.library_changed_signal.connect(self.on_library_changed)
+        self.library_rescanned_signal.connect(self.on_library_rescanned)
+        self.watcher = LibraryWatcher(self.files.dirs, self.library_changed_signal.emit)
+        self.watcher.start()
+
+    def closeEvent(self, event):  # pylint: disable=C0103
+        """Stops the background threads and the player when the window is closed."""
+        self.watcher.stop()
+        self.outbox.stop()
+        if self.player is not None:
+            self.player.close()
+        super().closeEvent(event)
 
     def setupUi(self, window_main):
         """Setup all the child widgets of the main window"""
@@ -138,12 +173,13 @@ class MainWindow(QMainWindow, Ui_window_main):
         Sets up the local files tab. Triggered when the tab is selected
         """
         # TODO: Refactor
-        self.files.build_all_from_db()
+        self.files.build_shows_from_db()
+        self.app.pool.submit(self.matcher.match, list(self.files.series))
         series_layout = FlowLayout()
         series_layout.setAlignment(Qt.AlignTop)
 
         for show in sorted(self.files.series):
-            button = SeriesButton(show, len(self.files.series[show]))
+            button = SeriesButton(show, self.files.episode_count(show))
             button.clicked.connect(self.on_series_click)
             series_layout.addWidget(button)
 
@@ -193,8 +229,7 @@ class MainWindow(QMainWindow, Ui_window_main):
         menu.setMinimumWidth(self.stack_local_files.width() / 2)
         layout.addWidget(menu)
 
-        self.files.series[show].sort()
-        for episode in self.files.series[show]:
+        for episode in self.files.sort_episodes(show):
             button = EpisodeButton(episode)
             button.clicked.connect(self.play_episode)
             layout.addWidget(button)
@@ -218,10 +253,12 @@ class MainWindow(QMainWindow, Ui_window_main):
         Plays the selected episode with the users player of choice
         """
         if self.player is not None and self.player.needs_destruction():
+            self.player.close()
             self.player = None
 
         if self.player is None:
             self.player = ene.player.get_player(self.app.config)
+            self.player.on_progress = self.progress_signal.emit
         episode = self.sender().path
         self.player.play(str(episode))
 
@@ -255,17 +292,107 @@ class MainWindow(QMainWindow, Ui_window_main):
         Triggers a full refresh of the users library, updating episode counts
         and adding new shows to the UI as needed
         """
+        changes = Changes()
+        changes.rescan = True
+        self.on_library_changed(changes)
+
+    def on_settings_changed(self):
+        """Watches and rescans the library directories if they changed."""
+        dirs = [Path(x) for x in self.app.config.get('Local Paths', [])]
+        if dirs != self.watcher.roots:
+            self.watcher.set_roots(dirs)
+            self.refresh_library()
+
+    @Slot(object)
+    def on_library_changed(self, changes: Changes):
+        """
+        Applies changes reported by the library watcher, updating episode
+        counts, adding new shows and reloading the current show as needed.
+
+        A rescan walks the whole library so it runs on its own thread, changes
+        reported meanwhile are applied once it is done.
+
+        Args:
+            changes:
+                The changes to the library directories
+        """
+        if self._rescanning:
+            self._pending_changes.append(changes)
+            return
         old = set(self.files.series.keys())
-        self.files.refresh_shows()
-        new = set(self.files.series.keys()) - old
+        if changes.rescan:
+            self._rescanning = True
+            Thread(target=self._rescan_library, args=(changes, old), name='LibraryRescan',
+                   daemon=True).start()
+            return
+        self._show_library_changes(old, self.files.apply_changes(changes))
+
+    def _rescan_library(self, changes: Changes, old):
+        """
+        Applies a rescan off the UI thread and reports it back to the UI
+
+        Args:
+            changes: The changes asking for a rescan
+            old: The shows before the rescan
+        """
+        shows = set()
+        try:
+            shows = self.files.apply_changes(changes)
+        finally:
+            self.library_rescanned_signal.emit(old, shows)
+
+    @Slot(object, object)
+    def on_library_rescanned(self, old, shows):
+        """
+        Shows the result of a rescan and applies the changes reported while
+        it ran
+
+        Args:
+            old: The shows before the rescan
+            shows: The shows whose episodes changed
+        """
+        self._rescanning = False
+        self._show_library_changes(old, shows)
+        pending, self._pending_changes = self._pending_changes, []
+        for changes in pending:
+            self.on_library_changed(changes)
+
+    def _show_library_changes(self, old, shows):
+        """
+        Updates the series buttons and reloads the current show if it changed
+
+        Args:
+            old: The shows before the changes
+            shows: The shows whose episodes changed
+        """
+        self._update_series_buttons(set(self.files.series.keys()) - old)
+        if self.current_show in shows:
+            show = self.current_show
+            self.on_back_click()
+            # The old layout is only deleted once control returns to the event
+            # loop, until then the page can not be given a new one
+            QTimer.singleShot(0, lambda: self.on_series_click(show=show))
+
+    def _update_series_buttons(self, new):
+        """
+        Updates the episode counts of all series buttons, removes the buttons
+        of shows that were merged into others and adds buttons for new shows
+
+        Args:
+            new:
+                The shows that do not have a button yet
+        """
         for show in self.page_widget.children():
-            if isinstance(show, SeriesButton):
-                show.update_episode_count(len(self.files.series[show.title]))
+            if not isinstance(show, SeriesButton):
+                continue
+            if show.title in self.files.series:
+                show.update_episode_count(self.files.episode_count(show.title))
+            else:
+                show.deleteLater()
         for show in sorted(new):
-            button = SeriesButton(show, len(self.files.series[show]))
+            button = SeriesButton(show, self.files.episode_count(show))
             button.clicked.connect(self.on_series_click)
             self.page_widget.layout().addWidget(button)
-        self.files.dump_to_db()
 
     def rename_show(self):
         """
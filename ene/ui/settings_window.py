@@ -19,6 +19,7 @@ from pathlib import Path
 from shutil import which
 
 import PySide2.QtGui
+from PySide2.QtCore import Signal
 from PySide2.QtWidgets import (
     QCheckBox,
     QComboBox,
@@ -50,6 +51,8 @@ CONFIG_ITEM = {
 class SettingsWindow(QMdiSubWindow, Ui_window_settings):
     """Class for the settings window."""
 
+    settings_saved_signal = Signal()
+
     def __init__(self, app):
         super().__init__()
         self.app = app
@@ -177,6 +180,7 @@ class SettingsWindow(QMdiSubWindow, Ui_window_settings):
             self.app.config.apply()
         self.changes = False
         self.button_apply.setEnabled(False)
+        self.settings_saved_signal.emit()
 
     @staticmethod
     def get_setting_from_child(child):
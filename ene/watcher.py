@@ -0,0 +1,537 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module watches the local library directories for changes."""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+from os.path import splitext
+from pathlib import Path
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from ene.files import EXTENSIONS
+
+# inotify event masks, see inotify(7)
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+CHILD_EVENTS = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+WATCH_MASK = CHILD_EVENTS | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Changes:
+    """
+    A batch of changes to the library directories.
+
+    Changes to the same path are coalesced, a file created and deleted in
+    the same batch does not show up at all.
+    """
+
+    __slots__ = ('created', 'deleted', 'deleted_dirs', 'rescan')
+
+    def __init__(self):
+        self.created: Set[Path] = set()
+        self.deleted: Set[Path] = set()
+        self.deleted_dirs: Set[Path] = set()
+        self.rescan = False
+
+    def __bool__(self):
+        return bool(self.created or self.deleted or self.deleted_dirs or self.rescan)
+
+    def __repr__(self):
+        return (f'Changes(created={self.created!r}, deleted={self.deleted!r}, '
+                f'deleted_dirs={self.deleted_dirs!r}, rescan={self.rescan!r})')
+
+    def add_file(self, path: Path):
+        """
+        Records a created video file, other files are ignored
+
+        Args:
+            path: The file path
+        """
+        if splitext(path.name)[1] in EXTENSIONS:
+            self.deleted.discard(path)
+            self.created.add(path)
+
+    def remove_file(self, path: Path):
+        """
+        Records a deleted video file, other files are ignored
+
+        Args:
+            path: The file path
+        """
+        if splitext(path.name)[1] not in EXTENSIONS:
+            return
+        if path in self.created:
+            self.created.discard(path)
+        else:
+            self.deleted.add(path)
+
+    def remove_dir(self, path: Path):
+        """
+        Records a deleted directory
+
+        Args:
+            path: The directory path
+        """
+        self.created = {file for file in self.created if path not in file.parents}
+        self.deleted_dirs.add(path)
+
+
+def _walk_files(directory: Path) -> Iterable[Tuple[Path, bool]]:
+    """
+    Lists a directory and all its sub directories, not following symlinks
+
+    Args:
+        directory: The directory
+
+    Yields:
+        Tuples of path and whether the path is a directory
+    """
+    stack = [str(directory)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if is_dir:
+                        stack.append(entry.path)
+                    yield Path(entry.path), is_dir
+        except OSError:
+            continue
+
+
+class _InotifyBackend:
+    """
+    Reports changes using the Linux inotify API.
+
+    Every directory under the roots has its own watch, new directories are
+    watched as they appear.
+    """
+
+    def __init__(self, roots: List[Path]):
+        """
+        Args:
+            roots: The directories to watch
+
+        Raises:
+            OSError: If inotify is not available or the watch limit is reached
+        """
+        libc_name = ctypes.util.find_library('c')
+        if not hasattr(os, 'pipe') or libc_name is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd = self._check(self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        self._wake_r, self._wake_w = os.pipe()
+        self._paths: Dict[int, Path] = {}
+        self._roots = set(roots)
+        try:
+            for root in roots:
+                self._watch_tree(root, None)
+        except OSError:
+            self.close()
+            raise
+
+    @staticmethod
+    def _check(res: int) -> int:
+        if res < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return res
+
+    def _watch(self, directory: Path) -> bool:
+        """
+        Adds a watch for a single directory
+
+        Args:
+            directory: The directory
+
+        Returns:
+            True if the directory is watched, False if it does not exist
+
+        Raises:
+            OSError: If the watch could not be added for any other reason
+        """
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(directory)), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return False
+            raise OSError(err, os.strerror(err))
+        self._paths[wd] = directory
+        return True
+
+    def _watch_tree(self, directory: Path, changes: Optional[Changes]):
+        """
+        Watches a directory and all its sub directories
+
+        Args:
+            directory: The directory
+            changes: Changes to record the video files found in it, if any
+        """
+        if not self._watch(directory):
+            return
+        for path, is_dir in _walk_files(directory):
+            if is_dir:
+                self._watch(path)
+            elif changes is not None:
+                changes.add_file(path)
+
+    def _unwatch_tree(self, directory: Path):
+        """
+        Removes the watches of a directory and all its sub directories
+
+        Args:
+            directory: The directory
+        """
+        for wd, path in list(self._paths.items()):
+            if path == directory or directory in path.parents:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._paths[wd]
+
+    def read(self, changes: Changes, timeout: Optional[float]) -> int:
+        """
+        Waits for events and records them
+
+        Args:
+            changes: The changes to record events in
+            timeout: Seconds to wait for events, None to wait until woken up
+
+        Returns:
+            The number of events read
+        """
+        readable, _, _ = select.select([self._fd, self._wake_r], [], [], timeout)
+        if self._wake_r in readable:
+            os.read(self._wake_r, 1024)
+        if self._fd not in readable:
+            return 0
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return 0
+        count = 0
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            count += 1
+            self._handle(wd, mask, os.fsdecode(name), changes)
+        return count
+
+    def _handle(self, wd: int, mask: int, name: str, changes: Changes):
+        """
+        Records a single inotify event
+
+        Args:
+            wd: The watch descriptor
+            mask: The event mask
+            name: The file name the event refers to, if any
+            changes: The changes to record the event in
+        """
+        if mask & IN_Q_OVERFLOW:
+            changes.rescan = True
+            return
+        directory = self._paths.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            del self._paths[wd]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            if directory in self._roots:
+                changes.remove_dir(directory)
+                self._unwatch_tree(directory)
+            return
+        path = directory / name
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._watch_tree(path, changes)
+                except OSError:
+                    # Out of watches, the new directory is picked up by a
+                    # rescan instead
+                    changes.rescan = True
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                changes.remove_dir(path)
+                self._unwatch_tree(path)
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            changes.add_file(path)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            changes.remove_file(path)
+
+    def wake(self):
+        """Wakes up a thread blocked in read."""
+        os.write(self._wake_w, b'\0')
+
+    def close(self):
+        """Closes the inotify instance."""
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class _PollingBackend:
+    """
+    Reports changes by periodically comparing directory listings.
+
+    Only directories whose mtime changed are listed again, the others are
+    only stat'd.
+    """
+
+    def __init__(self, roots: List[Path], interval: float):
+        """
+        Args:
+            roots: The directories to watch
+            interval: Seconds between polls
+        """
+        self.roots = roots
+        self.interval = interval
+        self._wake = threading.Event()
+        self._next_poll = monotonic() + interval
+        self._snapshot: Dict[Path, Tuple[int, Set[str], Set[str]]] = {}
+        self.poll(Changes())
+
+    def poll(self, changes: Changes) -> int:
+        """
+        Compares the directories to the last snapshot and records the
+        differences
+
+        Args:
+            changes: The changes to record differences in
+
+        Returns:
+            The number of differences found
+        """
+        snapshot = {}
+        count = 0
+        stack = list(self.roots)
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = os.stat(str(directory)).st_mtime_ns
+            except OSError:
+                continue
+            old = self._snapshot.get(directory)
+            if old is not None and old[0] == mtime:
+                snapshot[directory] = old
+                stack.extend(directory / name for name in old[2])
+                continue
+            files = set()
+            dirs = set()
+            try:
+                with os.scandir(str(directory)) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.add(entry.name)
+                        else:
+                            files.add(entry.name)
+            except OSError:
+                continue
+            old_files = old[1] if old is not None else set()
+            for name in files - old_files:
+                changes.add_file(directory / name)
+            for name in old_files - files:
+                changes.remove_file(directory / name)
+            count += len(files ^ old_files)
+            snapshot[directory] = (mtime, files, dirs)
+            stack.extend(directory / name for name in dirs)
+        for directory in self._snapshot.keys() - snapshot.keys():
+            if directory.parent not in self._snapshot.keys() - snapshot.keys():
+                changes.remove_dir(directory)
+                count += 1
+        self._snapshot = snapshot
+        return count
+
+    def read(self, changes: Changes, timeout: Optional[float]) -> int:
+        """
+        Waits until the next poll and records the changes found
+
+        Args:
+            changes: The changes to record differences in
+            timeout: Maximum seconds to wait, None to wait until the next poll
+
+        Returns:
+            The number of differences found
+        """
+        wait = self._next_poll - monotonic()
+        if timeout is not None and timeout < wait:
+            self._wake.wait(timeout)
+            self._wake.clear()
+            return 0
+        self._wake.wait(max(wait, 0))
+        self._wake.clear()
+        self._next_poll = monotonic() + self.interval
+        return self.poll(changes)
+
+    def wake(self):
+        """Wakes up a thread blocked in read."""
+        self._wake.set()
+
+    def close(self):
+        """Nothing to release."""
+
+
+class LibraryWatcher:
+    """
+    Watches the library directories and reports batches of changes.
+
+    inotify is used when available, otherwise the directories are polled.
+    Events are batched until no new event arrived for `delay` seconds, or
+    at most `max_delay` seconds after the first event of a batch, so copying
+    a whole season results in a single batch.
+
+    The callback is called on the watcher thread, use a queued signal to
+    hand the changes to the UI thread.
+    """
+
+    def __init__(
+            self,
+            roots: Iterable[Path],
+            callback: Callable[[Changes], None],
+            delay: float = 1.0,
+            max_delay: float = 5.0,
+            poll_interval: float = 5.0,
+            polling: bool = False
+    ):
+        """
+        Args:
+            roots: The directories to watch
+            callback: Function called with every batch of changes
+            delay: Seconds without events before a batch is reported
+            max_delay: Maximum seconds a batch is held back
+            poll_interval: Seconds between polls when inotify is not used
+            polling: True to always poll instead of using inotify
+        """
+        self.roots = [Path(root) for root in roots]
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.polling = polling
+        self._backend = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.ready = threading.Event()
+
+    @property
+    def backend(self) -> Optional[str]:
+        """The name of the backend in use, None if not started."""
+        if self._backend is None:
+            return None
+        return 'polling' if isinstance(self._backend, _PollingBackend) else 'inotify'
+
+    def set_roots(self, roots: Iterable[Path]):
+        """
+        Changes the watched directories, restarting the watcher if it is
+        running
+
+        Args:
+            roots: The directories to watch
+        """
+        roots = [Path(root) for root in roots]
+        if roots == self.roots:
+            return
+        running = self._thread is not None
+        self.stop()
+        self.roots = roots
+        if running:
+            self.start()
+
+    def start(self):
+        """
+        Starts watching the directories on a background thread.
+
+        The backend is set up on that thread as it walks the whole library,
+        `ready` is set once it is watching.
+        """
+        if self._thread is not None:
+            return
+        self._backend = None
+        self._stop.clear()
+        self.ready.clear()
+        self._thread = threading.Thread(target=self._run, name='LibraryWatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops watching and waits for the background thread to exit."""
+        if self._thread is None:
+            return
+        with self._lock:
+            self._stop.set()
+            if self._backend is not None:
+                self._backend.wake()
+        self._thread.join()
+        self._backend.close()
+        self._thread = None
+
+    def _create_backend(self):
+        """Sets up inotify, falling back to polling when it is unavailable."""
+        if not self.polling:
+            try:
+                return _InotifyBackend(self.roots)
+            except OSError:
+                pass
+        return _PollingBackend(self.roots, self.poll_interval)
+
+    def _run(self):
+        backend = self._create_backend()
+        with self._lock:
+            self._backend = backend
+        self.ready.set()
+        changes = Changes()
+        first = last = None
+        while not self._stop.is_set():
+            timeout = None
+            if first is not None:
+                timeout = max(min(last + self.delay, first + self.max_delay) - monotonic(), 0)
+            if backend.read(changes, timeout):
+                last = monotonic()
+                if first is None:
+                    first = last
+            if first is None or self._stop.is_set():
+                continue
+            now = monotonic()
+            if now < last + self.delay and now < first + self.max_delay:
+                continue
+            if changes:
+                self.callback(changes)
+            changes = Changes()
+            first = last = None
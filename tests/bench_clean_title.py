@@ -0,0 +1,56 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmark for ene.files.clean_title
+
+Run with: python -m tests.bench_clean_title
+"""
+from timeit import timeit
+
+from ene.files import clean_title
+from .title_corpus import corpus, legacy_clean_title
+
+
+def bench(func, stems, repeat=5):
+    """
+    Measure how many titles per second a function cleans
+
+    Args:
+        func: The title cleaning function
+        stems: The file name stems to clean
+        repeat: Number of passes over the stems
+
+    Returns:
+        Titles cleaned per second
+    """
+    seconds = timeit(lambda: [func(stem) for stem in stems], number=repeat)
+    return len(stems) * repeat / seconds
+
+
+def main():
+    stems = corpus()
+    uncached = clean_title.__wrapped__
+    clean_title.cache_clear()
+    [clean_title(stem) for stem in stems]  # pylint: disable=W0106
+    print(f'{len(stems)} titles')
+    print(f'legacy re.sub chain: {bench(legacy_clean_title, stems):>12,.0f} titles/sec')
+    print(f'precompiled:         {bench(uncached, stems):>12,.0f} titles/sec')
+    print(f'precompiled, cached: {bench(clean_title, stems):>12,.0f} titles/sec')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark for ene.cluster.cluster_titles on a synthetic library
+
+Run with: python -m tests.bench_cluster
+"""
+import random
+from time import perf_counter
+
+from Levenshtein import ratio
+
+from ene.cluster import THRESHOLD, cluster_titles, title_key
+
+SYLLABLES = ['ka', 'ri', 'no', 'sei', 'to', 'ma', 'shi', 'ku', 'ra', 'yo', 'hi', 'mei', 'zu',
+             'ta', 'chi', 'ha', 'ru', 'ne', 'ko', 'sa']
+SEASONS = ['{} S{}', '{} Season {}', '{} {}nd Season']
+
+
+def word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def typo(rng, title):
+    i = rng.randrange(len(title) - 1)
+    return title[:i] + title[i + 1] + title[i] + title[i + 2:]
+
+
+def library(size, seed=0):
+    """
+    Generates show titles the way clean_title leaves them, with season
+    spellings and typos of the same show mixed in
+
+    Args:
+        size: Number of titles
+        seed: Random seed
+
+    Returns:
+        The titles
+    """
+    rng = random.Random(seed)
+    titles = set()
+    while len(titles) < size:
+        title = ' '.join(word(rng) for _ in range(rng.randint(1, 4)))
+        titles.add(title)
+        variant = rng.random()
+        if variant < 0.3:
+            season = rng.randint(2, 4)
+            titles.update(pattern.format(title, season) for pattern in SEASONS)
+        elif variant < 0.5:
+            titles.add(typo(rng, title))
+    return sorted(titles)[:size]
+
+
+def naive(titles):
+    """All pairs comparison of normalized titles, for reference."""
+    keys = [title_key(title) for title in titles]
+    return sum(1 for i, a in enumerate(keys) for b in keys[i + 1:]
+               if a.season == b.season and ratio(a.base, b.base) >= THRESHOLD)
+
+
+def main():
+    for size in (1000, 5000, 20000):
+        titles = library(size)
+        start = perf_counter()
+        res = cluster_titles(titles)
+        seconds = perf_counter() - start
+        print(f'{size:>6} titles: {seconds * 1000:>8.1f} ms, '
+              f'{len(set(res.values())):>6} series')
+    titles = library(1000)
+    start = perf_counter()
+    naive(titles)
+    seconds = perf_counter() - start
+    print(f'all pairs, 1000 titles: {seconds * 1000:.1f} ms, '
+          f'~{seconds * 25 * 1000:.0f} ms estimated for 5000')
+
+
+if __name__ == '__main__':
+    main()
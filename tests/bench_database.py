@@ -0,0 +1,92 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark for bulk episode writes in ene.database
+
+Run with: python -m tests.bench_database
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from ene.database import Database
+
+SIZES = (1000, 10000, 100000)
+EPISODES_PER_SHOW = 12
+
+
+def make_series(size):
+    """
+    Make a series dictionary
+
+    Args:
+        size: The total number of episodes
+
+    Returns:
+        A dictionary of show names to episode paths
+    """
+    series = {}
+    for i in range(size):
+        show = f'show {i // EPISODES_PER_SHOW}'
+        series.setdefault(show, []).append(Path(f'/library/{show}/{show} - {i:02}.mkv'))
+    return series
+
+
+def legacy_write(db, series):
+    """The previous row by row autocommit implementation"""
+    for show in series:
+        key = db.get_show_id_by_name(show)
+        if key is None:
+            key = db.add_show(show)
+        delta = set(series[show]) - set(db.get_episodes_by_show_id(key))
+        for episode in sorted(delta):
+            db.add_episode_by_show_id(str(episode), key)
+
+
+def bench(write, series):
+    """
+    Measure rows per second of a write into an empty database file
+
+    Args:
+        write: Function that takes a Database and the series
+        series: The series to write
+
+    Returns:
+        Rows written per second
+    """
+    size = sum(len(episodes) for episodes in series.values())
+    with TemporaryDirectory() as path:
+        db = Database(Path(path, 'ene.db'))
+        start = perf_counter()
+        write(db, series)
+        seconds = perf_counter() - start
+        del db
+    return size / seconds
+
+
+def main():
+    for size in SIZES:
+        series = make_series(size)
+        bulk = bench(lambda db, s: db.write_all_episodes_delta(s), series)
+        print(f'{size:>7} episodes, bulk:   {bulk:>12,.0f} rows/sec')
+        if size <= 1000:
+            legacy = bench(legacy_write, series)
+            print(f'{size:>7} episodes, legacy: {legacy:>12,.0f} rows/sec')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Lock
+from time import sleep
+
+import pytest
+import responses
+
+from ene.api import API
+from ene.constants import GRAPHQL_URL
+
+
+@pytest.fixture
+def api():
+    with TemporaryDirectory() as path:
+        Path(path, 'token').write_text('token')
+        yield API(Path(path))
+
+
+class Pages:
+    """Mock paged endpoint that records the pages requested concurrently."""
+
+    def __init__(self, last, report_last=True):
+        self.last = last
+        self.report_last = report_last
+        self.requested = []
+        self.active = self.max_active = 0
+        self.lock = Lock()
+
+    def __call__(self, request):
+        page = json.loads(request.body)['variables']['page']
+        with self.lock:
+            self.requested.append(page)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        page_info = {'hasNextPage': page < self.last, 'currentPage': page}
+        if self.report_last:
+            page_info['lastPage'] = self.last
+        return 200, {}, json.dumps({'data': {'Page': {'pageInfo': page_info}}})
+
+
+def current_pages(pages):
+    return [res['data']['Page']['pageInfo']['currentPage'] for res in pages]
+
+
+@responses.activate
+def test_query_pages_prefetch(api):
+    pages = Pages(10)
+    responses.add_callback(responses.POST, GRAPHQL_URL, callback=pages)
+    assert current_pages(api.query_pages('{a}', 50, prefetch=4)) == list(range(1, 11))
+    assert sorted(pages.requested) == list(range(1, 11))
+    assert 1 < pages.max_active <= 4
+
+
+@responses.activate
+def test_query_pages_unknown_last(api):
+    pages = Pages(5, report_last=False)
+    responses.add_callback(responses.POST, GRAPHQL_URL, callback=pages)
+    assert current_pages(api.query_pages('{a}', 50, prefetch=3)) == list(range(1, 6))
+    assert len(pages.requested) <= 5 + 2
+
+
+@responses.activate
+def test_query_pages_sequential(api):
+    pages = Pages(3)
+    responses.add_callback(responses.POST, GRAPHQL_URL, callback=pages)
+    assert current_pages(api.query_pages('{a}', 50, prefetch=1)) == [1, 2, 3]
+    assert pages.max_active == 1
+
+
+@responses.activate
+def test_query_pages_close(api):
+    pages = Pages(100)
+    responses.add_callback(responses.POST, GRAPHQL_URL, callback=pages)
+    gen = api.query_pages('{a}', 50, prefetch=4)
+    assert current_pages([next(gen), next(gen)]) == [1, 2]
+    gen.close()
+    assert len(pages.requested) <= 2 + 4
@@ -0,0 +1,133 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from concurrent.futures import wait
+from threading import Lock
+
+import pytest
+
+from ene.api import QueryBatcher, Subquery
+from ene.api.batch import merge, split
+from ene.errors import APIError
+
+
+def media(id_):
+    return Subquery('Media(id: $id) { id }', {'id': id_}, {'id': 'Int'})
+
+
+class FakeAnilist:
+    """Answers merged Media queries, failing the whole request for missing ids."""
+
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.requests = []
+        self.lock = Lock()
+
+    def query(self, query, variables=None):
+        with self.lock:
+            self.requests.append(variables)
+        if self.missing.intersection(variables.values()):
+            raise APIError(404, 'Not Found.')
+        return {'data': {name.split('_')[0]: {'id': id_} for name, id_ in variables.items()}}
+
+
+def test_merge():
+    query, variables = merge([media(1), Subquery('GenreCollection'), media(2)])
+    assert query == ('query ($a0_id: Int, $a2_id: Int) {\n'
+                     'a0: Media(id: $a0_id) { id }\n'
+                     'a1: GenreCollection\n'
+                     'a2: Media(id: $a2_id) { id }\n'
+                     '}')
+    assert variables == {'a0_id': 1, 'a2_id': 2}
+    assert merge([Subquery('GenreCollection')])[0] == 'query {\na0: GenreCollection\n}'
+
+
+def test_split():
+    res = split({'data': {'a0': {'id': 1}, 'a1': None},
+                 'errors': [{'message': 'Not Found.', 'path': ['a1']}]}, 3)
+    assert res[0] == {'id': 1}
+    assert isinstance(res[1], APIError)
+    assert res[2] is None
+
+
+def test_run_size_cap():
+    api = FakeAnilist()
+    batcher = QueryBatcher(api.query, max_size=4)
+    assert batcher.run([media(i) for i in range(10)]) == [{'id': i} for i in range(10)]
+    assert [len(variables) for variables in api.requests] == [4, 4, 2]
+
+
+def test_run_length_cap():
+    api = FakeAnilist()
+    batcher = QueryBatcher(api.query, max_length=100)
+    batcher.run([media(i) for i in range(10)])
+    assert [len(variables) for variables in api.requests] == [2] * 5
+
+
+def test_run_isolates_failures():
+    api = FakeAnilist(missing={5})
+    batcher = QueryBatcher(api.query, max_size=8)
+    res = batcher.run([media(i) for i in range(8)], return_exceptions=True)
+    assert isinstance(res[5], APIError)
+    assert [item['id'] for i, item in enumerate(res) if i != 5] == [0, 1, 2, 3, 4, 6, 7]
+    with pytest.raises(APIError):
+        batcher.run([media(i) for i in range(8)])
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_run_does_not_split_request_failures(status):
+    calls = []
+
+    def query(query, variables=None):
+        calls.append(variables)
+        raise APIError(status, 'Too Many Requests.')
+
+    batcher = QueryBatcher(query, max_size=10)
+    res = batcher.run([media(i) for i in range(10)], return_exceptions=True)
+    assert all(isinstance(item, APIError) for item in res)
+    assert len(calls) == 1
+    with pytest.raises(APIError):
+        batcher.run([media(0)])
+
+
+def test_run_keeps_sent_chunks():
+    api = FakeAnilist()
+    calls = []
+
+    def query(query, variables=None):
+        calls.append(variables)
+        if len(calls) > 1:
+            raise APIError(503, 'Service Unavailable.')
+        return api.query(query, variables)
+
+    batcher = QueryBatcher(query, max_size=2)
+    res = batcher.run([media(i) for i in range(6)], return_exceptions=True)
+    assert res[:2] == [{'id': 0}, {'id': 1}]
+    assert all(isinstance(item, APIError) for item in res[2:])
+    assert len(calls) == 2
+
+
+def test_submit_coalesces():
+    api = FakeAnilist(missing={3})
+    batcher = QueryBatcher(api.query, max_size=4, window=0.5)
+    futures = [batcher.submit(media(i)) for i in range(6)]
+    wait(futures, timeout=5)
+    assert [len(variables) for variables in api.requests[:1]] == [4]
+    assert futures[0].result() == {'id': 0}
+    assert futures[5].result() == {'id': 5}
+    with pytest.raises(APIError):
+        futures[3].result()
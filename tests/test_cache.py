@@ -0,0 +1,122 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import sleep
+
+import pytest
+import responses
+
+from ene.api import API, ResponseCache
+from ene.api.cache import cache_key
+from ene.constants import GRAPHQL_URL
+
+GENRES = {'data': {'GenreCollection': ['Action', 'Comedy']}}
+
+
+@pytest.fixture
+def cache_home():
+    with TemporaryDirectory() as path:
+        yield Path(path)
+
+
+@pytest.fixture
+def api(cache_home):
+    with TemporaryDirectory() as path, ThreadPoolExecutor() as pool:
+        Path(path, 'token').write_text('token')
+        yield API(Path(path), cache_home, pool)
+
+
+def test_cache_key():
+    assert cache_key('{a}', {'x': 1, 'y': 2}) == cache_key('{a}', {'y': 2, 'x': 1})
+    assert cache_key('{a}', {'x': 1}) != cache_key('{a}', {'x': 2})
+    assert cache_key('{a}', None) == cache_key('{a}', {})
+    assert cache_key('{a}', {'x': 1}, 'alice') != cache_key('{a}', {'x': 1}, 'bob')
+
+
+def test_cache_ttl(cache_home):
+    cache = ResponseCache(cache_home / 'responses.db', ttls={'browse': (0, 60)})
+    cache.put('genres', 'taxonomy', GENRES)
+    cache.put('page', 'browse', {'data': {}}, etag='"abc"')
+    assert cache.get('missing') is None
+    genres = cache.get('genres')
+    assert genres.response == GENRES and genres.fresh
+    page = cache.get('page')
+    assert not page.fresh and page.usable and page.etag == '"abc"'
+
+    cache = ResponseCache(cache_home / 'responses.db')
+    assert cache.get('genres').response == GENRES
+    assert cache.size > 0
+
+
+def test_cache_eviction(cache_home):
+    cache = ResponseCache(cache_home / 'responses.db', max_bytes=1000)
+    body = {'data': 'x' * 300}
+    for key in ('a', 'b', 'c'):
+        cache.put(key, 'default', body)
+    cache.get('a')
+    cache.put('d', 'default', body)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.size <= 1000
+
+
+@responses.activate
+def test_cached_query(api):
+    responses.add(responses.POST, GRAPHQL_URL, json=GENRES)
+    assert api.get_genres() == ['Action', 'Comedy']
+    assert api.get_genres() == ['Action', 'Comedy']
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_cached_query_per_viewer(api, cache_home):
+    responses.add(responses.POST, GRAPHQL_URL, json=GENRES)
+    api.get_genres()
+    with TemporaryDirectory() as path:
+        Path(path, 'token').write_text('other token')
+        other = API(Path(path), cache_home)
+    other.get_genres()
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_stale_while_revalidate(api):
+    api.cache.ttls['browse'] = (0, 60)
+    responses.add(responses.POST, GRAPHQL_URL, json={'data': {'Page': {'media': [1]}}})
+    responses.add(responses.POST, GRAPHQL_URL, json={'data': {'Page': {'media': [2]}}})
+    assert api.browse_anime()[0] == [1]
+    assert api.browse_anime()[0] == [1]
+    for _ in range(100):
+        if not api._refreshing:
+            break
+        sleep(0.01)
+    assert len(responses.calls) == 2
+    api.cache.ttls['browse'] = (60, 60)
+    assert api.browse_anime()[0] == [2]
+
+
+@responses.activate
+def test_etag_revalidation(api):
+    api.cache.ttls['default'] = (0, 0)
+    responses.add(responses.POST, GRAPHQL_URL, json=GENRES, headers={'ETag': '"v1"'})
+    responses.add(responses.POST, GRAPHQL_URL, status=304)
+    assert api.cached_query('{GenreCollection}') == GENRES
+    assert api.cached_query('{GenreCollection}') == GENRES
+    assert responses.calls[1].request.headers['If-None-Match'] == '"v1"'
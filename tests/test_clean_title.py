@@ -0,0 +1,50 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from ene.files import clean_title
+from .title_corpus import corpus, legacy_clean_title
+
+CORPUS = corpus()
+
+
+def test_corpus_size():
+    assert len(CORPUS) > 10000
+
+
+@pytest.mark.parametrize('start', range(0, len(CORPUS), 1000))
+def test_clean_title_golden(start):
+    clean_title.cache_clear()
+    for stem in CORPUS[start:start + 1000]:
+        assert clean_title(stem) == legacy_clean_title(stem), stem
+
+
+@pytest.mark.parametrize('stem', [
+    '', ' ', '1', '1.', '[]', '()', '(O)', '[a(b]c)', '(x[O]y)', 'S1', 's01e01', 'ss11',
+    '-', '- 1', 'foo -  v', 'foo\nbar e1', 'foo__bar,,baz', '12. [x] 34. foo',
+])
+def test_clean_title_edge_cases(stem):
+    assert clean_title(stem) == legacy_clean_title(stem)
+
+
+def test_clean_title_cached():
+    clean_title.cache_clear()
+    clean_title('[Group] foo - 01')
+    clean_title('[Group] foo - 01')
+    info = clean_title.cache_info()
+    assert info.hits == 1
+    assert info.misses == 1
@@ -0,0 +1,76 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+from ene.cluster import TitleKey, cluster_titles, same_show, title_key
+
+
+@pytest.mark.parametrize('title,expected', [
+    ('Show', TitleKey('show', 1, ())),
+    ('Show S2', TitleKey('show', 2, ())),
+    ('Show Season 2', TitleKey('show', 2, ())),
+    ('Show 2nd Season', TitleKey('show', 2, ())),
+    ('Show Second Season', TitleKey('show', 2, ())),
+    ('Steins;Gate 0', TitleKey('steins gate 0', 1, ('0',))),
+    ('Re:Zero kara Hajimeru Isekai Seikatsu', TitleKey('re zero kara hajimeru isekai seikatsu',
+                                                       1, ())),
+    ("Gintama'", TitleKey('gintama', 1, (), "'")),
+    ('K-On!!', TitleKey('k on', 1, (), '!!')),
+])
+def test_title_key(title, expected):
+    assert title_key(title) == expected
+
+
+def test_cluster_titles():
+    titles = ['Show S2', 'Show 2nd Season', 'Show Season 2', 'Show', 'Steins Gate',
+              'Steins;Gate', 'Steins Gate 0', 'Isekai Fooo', 'Isekai Foo', 'Sekai Foo Bar']
+    weights = {'Show Season 2': 3, 'Isekai Foo': 12, 'Isekai Fooo': 1}
+    res = cluster_titles(titles, weights)
+    assert set(res) == set(titles)
+    assert res['Show S2'] == res['Show 2nd Season'] == 'Show Season 2'
+    assert res['Show'] == 'Show'
+    assert res['Steins;Gate'] == 'Steins Gate'
+    assert res['Steins Gate 0'] == 'Steins Gate 0'
+    assert res['Isekai Fooo'] == 'Isekai Foo'
+    assert res['Sekai Foo Bar'] == 'Sekai Foo Bar'
+
+
+def test_cluster_typo_in_first_word():
+    res = cluster_titles(['Boku no Hero Academia', 'Voku no Hero Academia'])
+    assert len(set(res.values())) == 1
+
+
+@pytest.mark.parametrize('a,b', [
+    ('Mob Psycho 100', 'Mob Psycho 100 II'),
+    ('Sword Art Online', 'Sword Art Online II'),
+    ('Natsume Yuujinchou San', 'Natsume Yuujinchou Shi'),
+    ('Gintama', "Gintama'"),
+    ("Gintama'", "Gintama''"),
+    ('Toaru Majutsu no Index II', 'Toaru Majutsu no Index III'),
+])
+def test_sequels_do_not_merge(a, b):
+    res = cluster_titles([a, b])
+    assert res[a] == a and res[b] == b
+    assert not same_show(a, b)
+
+
+def test_same_show():
+    assert same_show('Steins;Gate', 'Steins Gate')
+    assert same_show('Show S2', 'Show 2nd Season')
+    assert same_show('Isekai Foo', 'Isekai Fooo')
+    assert not same_show('Show', 'Show S2')
@@ -1,10 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
-from sqlite3 import DatabaseError
+from tempfile import TemporaryDirectory
+from sqlite3 import DatabaseError, IntegrityError
 from pathlib import Path
 
 import pytest
 
-from ene.database import Database
+from ene.database import MIGRATIONS, Database
 from . import HERE
 
 MOCK_SQL = HERE / 'mock_db.sql'
@@ -32,6 +34,14 @@ def empty_db() -> Database:
     del db
 
 
+@pytest.fixture
+def file_db() -> Database:
+    with TemporaryDirectory() as path:
+        db = Database(Path(path, 'ene.db'))
+        yield db
+        del db
+
+
 @pytest.fixture
 def mock_db() -> Database:
     db = Database(Path(':memory:'))
@@ -106,4 +116,193 @@ def test_write_all_episodes_delta(empty_db):
     for key in MOCK_SHOWS:
         empty_db.add_episode_by_show_name(MOCK_SHOWS[key][0], key)
     empty_db.write_all_episodes_delta(MOCK_SHOWS)
-    assert MOCK_SHOWS == empty_db.get_all()
\ No newline at end of file
+    assert MOCK_SHOWS == empty_db.get_all()
+
+
+def test_file_parses(empty_db):
+    parses = [('foo - 01.mkv', 'foo', 1, None, 'Group', None, 1080, 'ABCD1234'),
+              ('foo NCOP.mkv', None, None, None, None, None, None, None)]
+    empty_db.add_file_parses(parses)
+    assert empty_db.get_file_parses() == {parse[0]: parse[1:] for parse in parses}
+    empty_db.add_file_parses([('foo - 01.mkv', 'foo', 1, 1, 'Group', 2, None, None)])
+    assert empty_db.get_file_parses()['foo - 01.mkv'] == ('foo', 1, 1, 'Group', 2, None, None)
+
+
+def test_add_missing_columns(empty_db):
+    empty_db.cursor.executescript("""
+        DROP TABLE FileParse;
+        CREATE TABLE FileParse(filename TEXT PRIMARY KEY, title TEXT, episode INTEGER,
+            season INTEGER, release_group TEXT, version INTEGER);
+        INSERT INTO FileParse VALUES ('foo - 01.mkv', 'foo', 1, NULL, NULL, NULL);
+        PRAGMA user_version = 0;
+    """)
+    empty_db.initial_setup()
+    assert empty_db.get_file_parses() == {
+        'foo - 01.mkv': ('foo', 1, None, None, None, None, None)
+    }
+
+
+def test_transaction_rollback(empty_db):
+    with pytest.raises(ValueError):
+        with empty_db.transaction():
+            empty_db.add_show('foo')
+            raise ValueError()
+    assert empty_db.get_all_shows() == []
+
+
+def test_write_all_episodes_delta_idempotent(empty_db):
+    empty_db.write_all_episodes_delta(MOCK_SHOWS)
+    empty_db.write_all_episodes_delta(MOCK_SHOWS)
+    assert MOCK_SHOWS == empty_db.get_all()
+    assert not empty_db.connection.in_transaction
+
+
+def test_write_all_episodes_delta_rollback(empty_db):
+    def broken():
+        yield Path('qux episode 1')
+        raise OSError()
+
+    series = dict(MOCK_SHOWS)
+    series['qux'] = broken()
+    with pytest.raises(OSError):
+        empty_db.write_all_episodes_delta(series)
+    assert empty_db.get_all_shows() == []
+    assert not empty_db.connection.in_transaction
+
+
+def test_migrate_unversioned(empty_db):
+    empty_db.cursor.executescript("""
+        DROP INDEX Episode_episode_path;
+        DROP INDEX Episode_show_ID;
+        INSERT INTO Show(show_name) VALUES ('foo');
+        INSERT INTO Episode(episode_path, show_ID) VALUES ('foo episode 1', 1);
+        INSERT INTO Episode(episode_path, show_ID) VALUES ('foo episode 1', 1);
+        INSERT INTO Episode(episode_path, show_ID) VALUES ('foo episode 2', 1);
+        PRAGMA user_version = 0;
+    """)
+    empty_db.initial_setup()
+    assert empty_db.get_episodes_by_show_name('foo') == [Path('foo episode 1'),
+                                                         Path('foo episode 2')]
+    assert empty_db.cursor.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+
+
+def test_episode_path_unique(empty_db):
+    empty_db.add_episode_by_show_name(Path('foo episode 1'), 'foo')
+    with pytest.raises(IntegrityError):
+        empty_db.add_episode_by_show_name(Path('foo episode 1'), 'bar')
+
+
+def test_show_id_index(empty_db):
+    plan = empty_db.cursor.execute(
+        'EXPLAIN QUERY PLAN SELECT episode_path FROM Episode WHERE show_ID = ?', (1,)
+    ).fetchall()
+    assert any('Episode_show_ID' in row[-1] for row in plan)
+
+
+def test_wal_mode(file_db):
+    assert file_db.cursor.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert file_db.cursor.execute('PRAGMA synchronous').fetchone()[0] == 1
+
+
+@pytest.mark.parametrize('db', ['empty_db', 'file_db'])
+def test_connection_per_thread(db, request):
+    db = request.getfixturevalue(db)
+    with ThreadPoolExecutor(4) as pool:
+        connections = set(pool.map(lambda _: id(db.connection), range(16)))
+    assert id(db.connection) not in connections
+
+
+def test_concurrent_writes(file_db):
+    db = file_db
+    with ThreadPoolExecutor(4) as pool:
+        def write(show):
+            db.write_all_episodes_delta({show: MOCK_SHOWS[show]})
+            return db.get_episodes_by_show_name(show)
+
+        futures = {show: pool.submit(write, show) for show in MOCK_SHOWS}
+        for show, future in futures.items():
+            assert future.result() == MOCK_SHOWS[show]
+    assert db.get_all() == MOCK_SHOWS
+
+
+def test_get_as_str(mock_db):
+    as_str = {show: list(map(str, episodes)) for show, episodes in MOCK_SHOWS.items()}
+    assert mock_db.get_all(as_path=False) == as_str
+    assert mock_db.get_all_episodes(as_path=False) == list(chain.from_iterable(as_str.values()))
+    for show in MOCK_SHOWS:
+        assert mock_db.get_episodes_by_show_name(show, as_path=False) == as_str[show]
+
+
+def test_concurrent_reads_types(file_db):
+    file_db.write_all_episodes_delta(MOCK_SHOWS)
+
+    def read(i):
+        if i % 3 == 0:
+            return file_db.get_all_shows() == list(MOCK_SHOWS)
+        if i % 3 == 1:
+            return file_db.get_all() == MOCK_SHOWS
+        return file_db.get_show_id_by_name('bar') == 2
+
+    with ThreadPoolExecutor(8) as pool:
+        assert all(pool.map(read, range(300)))
+
+
+def test_get_episode_counts(mock_db):
+    mock_db.add_show('qux')
+    expected = {show: len(episodes) for show, episodes in MOCK_SHOWS.items()}
+    expected['qux'] = 0
+    assert mock_db.get_episode_counts() == expected
+
+
+def test_get_episodes_under(empty_db):
+    root = Path('/videos/foo')
+    empty_db.write_all_shows_delta(['foo', 'bar'])
+    empty_db.write_all_episodes_delta({
+        'foo': [root / 'foo 1.mkv', root / 'sub' / 'foo 2.mkv', Path('/videos/foobar/foo 3.mkv')],
+        'bar': [root / 'bar 1.mkv']
+    })
+    assert empty_db.get_episodes_under(root) == {
+        'foo': [root / 'foo 1.mkv', root / 'sub' / 'foo 2.mkv'],
+        'bar': [root / 'bar 1.mkv']
+    }
+    assert empty_db.get_episode_shows([root / 'bar 1.mkv', root / 'baz.mkv']) == {
+        'bar': [root / 'bar 1.mkv']
+    }
+    empty_db.delete_episodes([root / 'foo 1.mkv', root / 'bar 1.mkv'])
+    assert empty_db.get_episodes_under(root) == {'foo': [root / 'sub' / 'foo 2.mkv']}
+
+
+def test_split_sequel_aliases(empty_db):
+    empty_db.write_all_episodes_delta({'Sword Art Online': [
+        Path('/a/[G] Sword Art Online - 01.mkv'), Path('/a/[G] Sword Art Online II - 01.mkv')
+    ]})
+    empty_db.add_file_parses([
+        ('[G] Sword Art Online - 01.mkv', 'Sword Art Online', 1, None, 'G', None, None, None),
+        ('[G] Sword Art Online II - 01.mkv', 'Sword Art Online II', 1, None, 'G', None, None,
+         None),
+    ])
+    empty_db.cursor.executescript("""
+        INSERT INTO ShowAlias VALUES ('Sword Art Online II', 'Sword Art Online');
+        INSERT INTO ShowAlias VALUES ('Show S2', 'Show Season 2');
+        INSERT INTO ShowAlias VALUES ('My Rename', 'Sword Art Online');
+        PRAGMA user_version = 7;
+    """)
+    empty_db.initial_setup()
+    assert empty_db.get_show_aliases() == {'Show S2': 'Show Season 2',
+                                           'My Rename': 'Sword Art Online'}
+    assert empty_db.get_episodes_by_show_name('Sword Art Online II') == [
+        Path('/a/[G] Sword Art Online II - 01.mkv')]
+    assert empty_db.get_episodes_by_show_name('Sword Art Online') == [
+        Path('/a/[G] Sword Art Online - 01.mkv')]
+
+
+def test_rename_show_to_alias(empty_db):
+    empty_db.write_all_episodes_delta({'Show': [Path('/a/Show - 01.mkv')],
+                                       'Other': [Path('/a/Other - 01.mkv')]})
+    empty_db.rename_show('Show', 'Other')
+    assert empty_db.get_show_aliases() == {'Show': 'Other'}
+    # Show is the name of a show again, not an alias of Other
+    empty_db.write_all_episodes_delta({'Third': [Path('/a/Third - 01.mkv')]})
+    empty_db.rename_show('Third', 'Show')
+    assert empty_db.get_show_aliases() == {'Third': 'Show'}
+    assert empty_db.get_episodes_by_show_name('Show') == [Path('/a/Third - 01.mkv')]
@@ -1,9 +1,13 @@
 import ene.files
+from ene.scanner import TokenIndex
+from ene.watcher import Changes
 from . import HERE
 
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
-import re
+from shutil import rmtree
 from tempfile import TemporaryDirectory
+from threading import current_thread
 from pathlib import Path
 import pytest
 
@@ -56,12 +60,6 @@ def directory():
         yield Path(path)
 
 
-def test_regex():
-    expected = re.compile(r'.*foo.*bar.*')
-    actual = ene.files._build_regex('foo bar')
-    assert actual == expected
-
-
 def test_clean_titles():
     test_titles = ['[Bar] foo',
                    '(Bar) foo',
@@ -86,3 +84,293 @@ def test_find(manager, mock_shows):
         manager.refresh_single_show(show)
         assert mock_shows[show] == manager.series[show]
 
+
+@pytest.fixture()
+def data_home():
+    with TemporaryDirectory() as path:
+        yield Path(path)
+
+
+@pytest.fixture()
+def nested(data_home):
+    with TemporaryDirectory() as path:
+        root = Path(path)
+        (root / 'isekai foo').mkdir()
+        (root / 'bar quest').mkdir()
+        for episode in MOCK_FILES:
+            folder = 'isekai foo' if episode.startswith('isekai') else 'bar quest'
+            Path(root, folder, episode).touch()
+        yield root
+
+
+def test_rescan_skips_unchanged(nested, data_home):
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    stats = manager.refresh_shows()
+    assert stats.dirs_walked == 3
+    assert stats.dirs_skipped == 0
+    assert stats.files_parsed == len(MOCK_FILES)
+    assert (data_home / 'dir_index.json').is_file()
+    for entry in manager.scanner.index.entries.values():
+        assert set(entry) == {'mtime', 'inode', 'files', 'dirs'}
+
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    stats = manager.refresh_shows()
+    assert stats.dirs_walked == 0
+    assert stats.dirs_skipped == 3
+    assert stats.files_parsed == 0
+    assert len(manager.series['isekai foo']) == 5
+    assert len(manager.series['bar quest']) == 3
+
+
+def test_rescan_walks_changed(nested, data_home):
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    manager.refresh_shows()
+    new = nested / 'isekai foo' / 'isekai foo e6.mkv'
+    new.touch()
+    stats = manager.refresh_shows()
+    assert stats.dirs_walked == 1
+    assert stats.dirs_skipped == 2
+    assert stats.files_parsed == 1
+    assert manager.series['isekai foo'].count(new) == 1
+    assert len(manager.series['isekai foo']) == 6
+
+
+def test_rescan_prunes_removed(nested, data_home):
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    manager.refresh_shows()
+    rmtree(str(nested / 'bar quest'))
+    manager.refresh_shows()
+    assert str(nested / 'bar quest') not in manager.scanner.index.entries
+
+
+def test_parallel_scan(nested, data_home):
+    with TemporaryDirectory() as serial_home:
+        serial = ene.files.FileManager({'Local Paths': [str(nested)]}, Path(serial_home))
+        serial.refresh_shows()
+    with ThreadPoolExecutor(4) as pool:
+        manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home, pool)
+        stats = manager.refresh_shows()
+        assert stats.dirs_walked == 3
+        assert stats.files_parsed == len(MOCK_FILES)
+        assert set(manager.series) == set(serial.series)
+        for show in serial.series:
+            assert sorted(manager.series[show]) == sorted(serial.series[show])
+        stats = manager.refresh_shows()
+        assert stats.dirs_skipped == 3
+
+
+def test_parallel_scan_records_on_consumer(nested, data_home):
+    threads = set()
+    with ThreadPoolExecutor(4) as pool:
+        manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home, pool)
+        record = manager.scanner.record
+
+        def record_parse(row):
+            threads.add(current_thread())
+            record(row)
+
+        manager.scanner.record = record_parse
+        manager.refresh_shows()
+    assert threads == {current_thread()}
+    assert set(manager.parses) == set(MOCK_FILES)
+    assert manager.db.get_file_parses().keys() == set(MOCK_FILES)
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('[HorribleSubs] Boku no Hero Academia - 05 [1080p].mkv',
+     ('Boku no Hero Academia', 5, None, 'HorribleSubs', None, 1080, None)),
+    ('Shingeki no Kyojin S02E11 (BD 1920x1080).mkv',
+     ('Shingeki no Kyojin Season 2', 11, 2, None, None, 1080, None)),
+    ('Haikyuu!! 2nd Season - 12v2 [ABCD1234].mkv',
+     ('Haikyuu!! 2nd Season', 12, 2, None, 2, None, 'ABCD1234')),
+    ('Mob Psycho 100 - 03 [720p][deadbeef].mp4',
+     ('Mob Psycho 100', 3, None, None, None, 720, 'DEADBEEF')),
+    ('01. foo.mkv', ('foo', 1, None, None, None, None, None)),
+    ('adventures of baz ep4.mp4', ('adventures of baz', 4, None, None, None, None, None)),
+    ('[Judas] Show NCOP1.mkv', None),
+    ('notes.txt', None),
+])
+def test_parse_episode(name, expected):
+    info = ene.files.parse_episode(name)
+    if expected is None:
+        assert info is None
+    else:
+        assert info.to_row() == expected
+
+
+def test_sort_episodes(data_home):
+    with TemporaryDirectory() as path:
+        names = ['foo - 10.mkv', 'foo - 9.mkv', 'foo - 01v2.mkv', 'foo - 01.mkv', 'foo - 2.mkv']
+        for name in names:
+            Path(path, name).touch()
+        manager = ene.files.FileManager({'Local Paths': [path]}, data_home)
+        manager.refresh_shows()
+        episodes = manager.sort_episodes('foo')
+        assert [p.name for p in episodes] == ['foo - 01.mkv', 'foo - 01v2.mkv', 'foo - 2.mkv',
+                                              'foo - 9.mkv', 'foo - 10.mkv']
+        assert manager.episode_info(Path(path, 'foo - 10.mkv')).episode == 10
+
+
+def test_rescan_uses_parse_cache(nested, data_home):
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    manager.refresh_shows()
+    assert set(manager.db.get_file_parses()) == set(MOCK_FILES)
+    (data_home / 'dir_index.json').unlink()
+    ene.files.clean_title.cache_clear()
+
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    stats = manager.refresh_shows()
+    assert stats.dirs_walked == 3
+    assert ene.files.clean_title.cache_info().misses == 0
+    assert len(manager.series['isekai foo']) == 5
+
+
+def test_lazy_series(manager, mock_shows, directory):
+    manager.refresh_shows()
+    manager.dump_to_db()
+
+    manager = ene.files.FileManager(manager.config, directory)
+    manager.series.max_loaded = 1
+    manager.build_shows_from_db()
+    assert set(manager.series) == set(mock_shows)
+    assert manager.series.loaded() == 0
+    assert manager.episode_count('isekai foo') == 5
+
+    for show in mock_shows:
+        assert set(manager.series[show]) == set(mock_shows[show])
+    assert manager.series.loaded() == 1
+    assert manager.episode_count('isekai foo') == 5
+
+
+def test_lazy_series_dirty_pinned(manager, mock_shows):
+    manager.refresh_shows()
+    manager.dump_to_db()
+    manager.series.max_loaded = 0
+    new = manager.dirs[0] / 'isekai foo e6.mkv'
+    manager.series['isekai foo'].append(new)
+    manager.series.mark_dirty('isekai foo')
+    for show in mock_shows:
+        manager.series[show]
+    assert new in manager.series['isekai foo']
+    assert list(manager.series.dirty()) == ['isekai foo']
+
+    manager.dump_to_db()
+    assert manager.series.dirty() == {}
+    assert manager.series.loaded() == 0
+    assert manager.episode_count('isekai foo') == 6
+    assert new in manager.series['isekai foo']
+
+
+def test_apply_changes(nested, data_home):
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    manager.refresh_shows()
+    manager.dump_to_db()
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    manager.build_shows_from_db()
+
+    new = nested / 'isekai foo' / 'isekai foo e6.mkv'
+    new.touch()
+    gone = nested / 'isekai foo' / 'isekai foo e1.mkv'
+    gone.unlink()
+    changes = Changes()
+    changes.add_file(new)
+    changes.remove_file(gone)
+    assert manager.apply_changes(changes) == {'isekai foo'}
+    assert manager.episode_count('isekai foo') == 5
+    assert set(manager.db.get_episodes_by_show_name('isekai foo')) == set(
+        manager.series['isekai foo'])
+    assert new in manager.series['isekai foo']
+
+    rmtree(str(nested / 'bar quest'))
+    changes = Changes()
+    changes.remove_dir(nested / 'bar quest')
+    assert manager.apply_changes(changes) == {'bar quest', 'adventures of baz'}
+    assert manager.episode_count('bar quest') == 0
+    assert manager.db.get_episodes_by_show_name('bar quest') == []
+    assert manager.series.loaded() == 1
+
+
+def test_apply_changes_recreated_dir(nested, data_home):
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    manager.refresh_shows()
+    manager.dump_to_db()
+    directory = nested / 'isekai foo'
+    episodes = sorted(manager.series['isekai foo'])
+    count = manager.episode_count('isekai foo')
+
+    # Deleted and created again within one batch of the watcher
+    rmtree(str(directory))
+    directory.mkdir()
+    for episode in episodes[1:]:
+        episode.touch()
+    changes = Changes()
+    changes.remove_dir(directory)
+    for episode in episodes[1:]:
+        changes.add_file(episode)
+    assert manager.apply_changes(changes) == {'isekai foo'}
+    assert manager.episode_count('isekai foo') == count - 1
+    assert set(manager.db.get_episodes_by_show_name('isekai foo')) == set(episodes[1:])
+    assert set(manager.find_episodes('isekai foo', directory)) == set(episodes[1:])
+
+
+def test_token_index():
+    index = TokenIndex()
+    episode = Path('/videos/Isekai Foo/[Group] Isekai_Foo - 01 [1080p].mkv')
+    assert index.add(episode, 'Isekai Foo') >= {'isekai', 'foo', '01', '1080p'}
+    assert index.add(episode, 'Isekai Foo') == set()
+    index.add(Path('/videos/Isekai Foo Season 2/Isekai Foo S2 - 01.mkv'), 'Isekai Foo Season 2')
+    assert index.lookup('isekai foo') == set(index.paths)
+    assert index.lookup('Isekai Foo Season 2') == {
+        Path('/videos/Isekai Foo Season 2/Isekai Foo S2 - 01.mkv')}
+    assert index.lookup('bar') == set()
+    assert index.remove_under(Path('/videos/Isekai Foo')) == [episode]
+    assert 'group' not in index.tokens
+
+
+def test_find_uses_persisted_index(nested, data_home):
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    manager.refresh_shows()
+    manager.dump_to_db()
+    missing = nested / 'isekai foo' / 'isekai foo e1.mkv'
+    manager.db.delete_episodes([missing])
+
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    manager.build_shows_from_db()
+    assert manager.refresh_single_show('isekai foo') == [missing]
+    assert manager.scanner.stats.dirs_walked == 0
+    assert len(manager.series['isekai foo']) == 5
+    assert len(manager.find_episodes('isekai foo', nested / 'bar quest')) == 0
+
+
+def test_refresh_single_show_finds_new_files(nested, data_home):
+    manager = ene.files.FileManager({'Local Paths': [str(nested)]}, data_home)
+    manager.refresh_shows()
+    manager.dump_to_db()
+    new = nested / 'isekai foo' / 'isekai foo e7.mkv'
+    new.touch()
+    # Named unlike the show, but in the show's folder
+    extra = nested / 'isekai foo' / 'Special 01.mkv'
+    extra.touch()
+    assert set(manager.refresh_single_show('isekai foo')) == {new, extra}
+    assert manager.scanner.stats.dirs_walked == 1
+
+
+def test_cluster_shows(data_home):
+    with TemporaryDirectory() as path:
+        names = ['Show S2 - 01.mkv', 'Show Season 2 - 02.mkv', 'Show 2nd Season - 03.mkv',
+                 'Show - 01.mkv']
+        for name in names:
+            Path(path, name).touch()
+        manager = ene.files.FileManager({'Local Paths': [path]}, data_home)
+        manager.refresh_shows()
+        manager.dump_to_db()
+        assert sorted(manager.series) == ['Show', 'Show Season 2']
+        assert manager.episode_count('Show Season 2') == 3
+
+        Path(path, 'Show 2nd Season - 04.mkv').touch()
+        manager = ene.files.FileManager({'Local Paths': [path]}, data_home)
+        manager.build_shows_from_db()
+        manager.refresh_shows()
+        assert sorted(manager.series) == ['Show', 'Show Season 2']
+        assert manager.episode_count('Show Season 2') == 4
+        assert len(manager.refresh_single_show('Show Season 2')) == 0
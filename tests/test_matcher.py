@@ -0,0 +1,103 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from pathlib import Path
+
+import pytest
+
+from ene.api import QueryBatcher
+from ene.database import Database
+from ene.errors import APIError
+from ene.matcher import ShowMatcher, match_subquery
+
+MEDIA = {
+    'isekai foo': [{'id': 2, 'title': {'romaji': 'Isekai Foo Bar'}, 'synonyms': []},
+                   {'id': 1, 'title': {'romaji': 'Isekai Foo', 'english': None},
+                    'synonyms': ['Foo in Another World']}],
+    'bar quest': [{'id': 3, 'title': {'romaji': 'Bar Quest!'}, 'synonyms': None}],
+}
+
+
+class FakeAPI:
+    """Answers merged searches from MEDIA and records the queries."""
+
+    def __init__(self, batch_size=10):
+        self.queries = []
+        self.batcher = QueryBatcher(self.query, max_size=batch_size)
+
+    def query(self, query, variables=None):
+        self.queries.append((query, variables))
+        if 'down' in variables.values():
+            raise APIError(503, 'Service Unavailable.')
+        return {'data': {name.split('_')[0]: {'media': MEDIA.get(show, [])}
+                         for name, show in variables.items()}}
+
+    def query_batch(self, subqueries, return_exceptions=False):
+        return self.batcher.run(subqueries, return_exceptions)
+
+
+@pytest.fixture
+def db() -> Database:
+    db = Database(Path(':memory:'))
+    db.initial_setup()
+    yield db
+    del db
+
+
+def test_match_subquery():
+    sub = match_subquery('foo')
+    assert sub.field.startswith('Page (perPage: 3) { media (search: $search, type: ANIME)')
+    assert sub.variables == {'search': 'foo'}
+    assert sub.types == {'search': 'String'}
+
+
+def test_match_batches(db):
+    api = FakeAPI(batch_size=2)
+    matcher = ShowMatcher(api, db)
+    res = matcher.match(['isekai foo', 'bar quest', 'baz', 'isekai foo'])
+    assert len(api.queries) == 2
+    assert api.queries[0][1] == {'a0_search': 'isekai foo', 'a1_search': 'bar quest'}
+    assert res['isekai foo'].media_id == 1
+    assert res['isekai foo'].confidence == 1
+    assert res['bar quest'].media_id == 3
+    assert res['baz'].media_id is None
+    assert matcher.media_id('baz') is None
+
+
+def test_match_cached(db):
+    ShowMatcher(FakeAPI(), db).match(['isekai foo', 'baz'])
+
+    api = FakeAPI()
+    matcher = ShowMatcher(api, db)
+    assert matcher.cached('isekai foo').media_id == 1
+    assert matcher.media_id('isekai foo') == 1
+    assert matcher.match(['baz'])['baz'].media_id is None
+    assert api.queries == []
+
+    matcher = ShowMatcher(api, db, retry_after=0)
+    matcher.match(['isekai foo', 'baz'])
+    assert [variables for _, variables in api.queries] == [{'a0_search': 'baz'}]
+
+
+def test_match_stores_before_failure(db):
+    api = FakeAPI(batch_size=2)
+    matcher = ShowMatcher(api, db)
+    with pytest.raises(APIError):
+        matcher.match(['isekai foo', 'bar quest', 'down'])
+    assert matcher.media_id('isekai foo') == 1
+    assert matcher.media_id('bar quest') == 3
+    assert len(api.queries) == 2
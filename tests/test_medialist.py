@@ -0,0 +1,115 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from ene.api import MediaListStatus
+from ene.database import Database
+from ene.medialist import COLLECTION_QUERY, MediaListMirror, UPDATED_QUERY, VIEWER_QUERY
+
+
+def entry(media_id, updated_at, status='CURRENT', progress=0):
+    return {'id': media_id * 10, 'mediaId': media_id, 'status': status, 'score': 0,
+            'progress': progress, 'repeat': 0, 'private': False,
+            'startedAt': {'year': 2018, 'month': 4, 'day': None},
+            'completedAt': {'year': None, 'month': None, 'day': None},
+            'updatedAt': updated_at}
+
+
+class FakeAPI:
+    """Serves a media list and records the queries."""
+
+    def __init__(self, entries, user_id=1):
+        self.entries = entries
+        self.user_id = user_id
+        self.queries = []
+
+    def query(self, query, variables=None):
+        self.queries.append(query)
+        if query == VIEWER_QUERY:
+            return {'data': {'Viewer': {'id': self.user_id}}}
+        assert query == COLLECTION_QUERY
+        lists = [{'entries': self.entries}, {'entries': self.entries[:1]}]
+        return {'data': {'MediaListCollection': {'lists': lists}}}
+
+    def query_pages(self, query, per_page, variables=None, prefetch=4):
+        assert query == UPDATED_QUERY
+        entries = sorted(self.entries, key=lambda e: -e['updatedAt'])
+        for start in range(0, len(entries), per_page):
+            self.queries.append(query)
+            yield {'data': {'Page': {'mediaList': entries[start:start + per_page]}}}
+
+
+@pytest.fixture
+def db() -> Database:
+    db = Database(Path(':memory:'))
+    db.initial_setup()
+    yield db
+    del db
+
+
+def test_full_refresh(db):
+    api = FakeAPI([entry(1, 100, progress=3), entry(2, 200, 'COMPLETED')])
+    mirror = MediaListMirror(api, db)
+    assert mirror.refresh() == 2
+    one = mirror.entry(1)
+    assert one.progress == 3 and one.status is MediaListStatus.CURRENT
+    assert one.started_at == date(2018, 4, 1) and one.completed_at is None
+    assert mirror.progress(3) is None
+    assert [e.media_id for e in mirror.entries()] == [2, 1]
+    assert [e.media_id for e in mirror.entries(MediaListStatus.COMPLETED)] == [2]
+    assert mirror.statuses() == {1: MediaListStatus.CURRENT, 2: MediaListStatus.COMPLETED}
+
+
+def test_incremental_refresh(db, monkeypatch):
+    monkeypatch.setattr('ene.medialist.PER_PAGE', 1)
+    api = FakeAPI([entry(media_id, media_id * 100) for media_id in range(1, 6)])
+    mirror = MediaListMirror(api, db)
+    mirror.refresh()
+    api.entries[1] = entry(2, 600, progress=5)
+    api.entries.append(entry(7, 700))
+    api.queries.clear()
+    assert mirror.refresh() == 3
+    # Stops at the first page older than the mirror
+    assert api.queries == [UPDATED_QUERY] * 4
+    assert mirror.progress(2) == 5
+    assert mirror.entry(7) is not None
+
+
+def test_full_refresh_drops_deleted(db):
+    api = FakeAPI([entry(1, 100), entry(2, 200)])
+    mirror = MediaListMirror(api, db, full_refresh_after=0)
+    mirror.refresh()
+    del api.entries[0]
+    mirror.refresh()
+    assert mirror.entry(1) is None
+
+
+def test_user_change(db):
+    MediaListMirror(FakeAPI([entry(1, 100)]), db).refresh()
+    mirror = MediaListMirror(FakeAPI([entry(2, 100)], user_id=2), db)
+    mirror.refresh()
+    assert [e.media_id for e in mirror.entries()] == [2]
+
+
+def test_store(db):
+    mirror = MediaListMirror(FakeAPI([]), db)
+    mirror.store([entry(4, 300, 'PAUSED', 2)])
+    assert mirror.entry(4).status is MediaListStatus.PAUSED
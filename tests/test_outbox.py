@@ -0,0 +1,186 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from pathlib import Path
+from time import sleep
+
+import pytest
+
+from ene.api import MediaListStatus
+from ene.database import Database
+from ene.errors import APIError
+from ene.medialist import MediaListMirror
+from ene.outbox import MAX_ATTEMPTS, MediaListOutbox, save_entry_subquery
+
+
+class FakeAPI:
+    """Answers merged SaveMediaListEntry mutations and records them."""
+
+    def __init__(self):
+        self.requests = []
+        self.offline = False
+        self.status = None
+        self.rejected = set()
+        self.unknown = set()
+
+    def query(self, query, variables=None, priority=None):
+        if self.offline:
+            raise ConnectionError('offline')
+        self.requests.append((query, variables))
+        if self.status is not None:
+            raise APIError(self.status, 'Internal Server Error')
+        if self.unknown.intersection(variables.values()):
+            raise APIError(404, 'Not Found.')
+        data = {}
+        errors = []
+        aliases = sorted({name.split('_')[0] for name in variables})
+        for alias in aliases:
+            media_id = variables[f'{alias}_mediaId']
+            if media_id in self.rejected:
+                data[alias] = None
+                errors.append({'message': 'Invalid media', 'path': [alias]})
+                continue
+            data[alias] = {'id': media_id * 10, 'mediaId': media_id, 'updatedAt': 1,
+                           'status': variables.get(f'{alias}_status'),
+                           'progress': variables.get(f'{alias}_progress')}
+        return {'data': data, 'errors': errors}
+
+
+@pytest.fixture
+def db() -> Database:
+    db = Database(Path(':memory:'))
+    db.initial_setup()
+    yield db
+    del db
+
+
+def test_save_entry_subquery():
+    sub = save_entry_subquery(1, {'progress': 3})
+    assert sub.field.startswith('SaveMediaListEntry (progress: $progress, mediaId: $mediaId)')
+    assert sub.variables == {'progress': 3, 'mediaId': 1}
+    assert sub.types == {'progress': 'Int', 'mediaId': 'Int'}
+
+
+def test_queue_coalesces(db):
+    outbox = MediaListOutbox(FakeAPI(), db)
+    outbox.queue(1, status=MediaListStatus.CURRENT, progress=1)
+    for progress in range(2, 6):
+        outbox.queue(1, progress=progress)
+    outbox.queue(2, progress=1)
+    assert outbox.pending() == {1: {'status': 'CURRENT', 'progress': 5}, 2: {'progress': 1}}
+
+
+def test_flush(db):
+    api = FakeAPI()
+    mirror = MediaListMirror(api, db)
+    outbox = MediaListOutbox(api, db, mirror, batch_size=2)
+    for media_id in range(1, 4):
+        outbox.queue(media_id, progress=media_id)
+    outbox.queue(1, progress=7)
+    assert outbox.flush() == 3
+    assert len(api.requests) == 2
+    assert api.requests[0][0].startswith('mutation (')
+    assert outbox.pending() == {}
+    assert mirror.progress(1) == 7
+
+
+def test_flush_offline(db):
+    api = FakeAPI()
+    outbox = MediaListOutbox(api, db)
+    outbox.queue(1, progress=1)
+    api.offline = True
+    assert outbox.flush() == 0
+    assert outbox.pending() == {1: {'progress': 1}}
+    # Backing off until retry_at
+    api.offline = False
+    db.retry_media_list_outbox([(1, 1, 0)])
+    assert outbox.flush() == 1
+    assert outbox.pending() == {}
+
+
+def test_flush_rejected(db):
+    api = FakeAPI()
+    api.rejected.add(2)
+    outbox = MediaListOutbox(api, db)
+    outbox.queue(1, progress=1)
+    outbox.queue(2, progress=1)
+    assert outbox.flush() == 1
+    assert list(outbox.pending()) == [2]
+    for _ in range(MAX_ATTEMPTS):
+        db.retry_media_list_outbox([(2, 1, 0)])
+    outbox.flush()
+    assert outbox.pending() == {}
+
+
+def test_flush_request_rejected(db):
+    api = FakeAPI()
+    api.unknown.add(2)
+    outbox = MediaListOutbox(api, db)
+    for media_id in range(1, 5):
+        outbox.queue(media_id, progress=1)
+    assert outbox.flush() == 3
+    assert list(outbox.pending()) == [2]
+    for _ in range(MAX_ATTEMPTS):
+        db.retry_media_list_outbox([(2, 1, 0)])
+    outbox.flush()
+    assert outbox.pending() == {}
+
+
+def test_flush_server_error_kept(db):
+    api = FakeAPI()
+    api.status = 503
+    outbox = MediaListOutbox(api, db)
+    outbox.queue(1, progress=1)
+    outbox.queue(2, progress=1)
+    for _ in range(MAX_ATTEMPTS + 1):
+        assert outbox.flush() == 0
+        db.retry_media_list_outbox([(1, 1, 0), (2, 1, 0)])
+    assert len(api.requests) == MAX_ATTEMPTS + 1
+    assert list(outbox.pending()) == [1, 2]
+
+
+def test_queue_during_flush_kept(db):
+    api = FakeAPI()
+    outbox = MediaListOutbox(api, db)
+    outbox.queue(1, progress=1)
+    query = api.query
+
+    def queue_while_sending(*args, **kwargs):
+        outbox.queue(1, progress=2)
+        return query(*args, **kwargs)
+
+    api.query = queue_while_sending
+    outbox.flush()
+    assert outbox.pending() == {1: {'progress': 2}}
+
+
+def test_background_flush(db):
+    api = FakeAPI()
+    outbox = MediaListOutbox(api, db, interval=10, delay=0.05)
+    outbox.start()
+    try:
+        outbox.queue(1, progress=1)
+        outbox.queue(1, progress=2)
+        for _ in range(100):
+            if not outbox.pending():
+                break
+            sleep(0.02)
+    finally:
+        outbox.stop()
+    assert outbox.pending() == {}
+    assert len(api.requests) == 1
+    assert api.requests[0][1]['a0_progress'] == 2
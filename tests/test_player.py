@@ -0,0 +1,443 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import base64
+import json
+import os
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+from threading import Event, Thread, Timer, current_thread
+from time import monotonic
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import ene.player
+from ene.errors import PlayerError
+from ene.player import (
+    AbstractPlayer,
+    HttpVlcPlayer,
+    MpvIpcPlayer,
+    PlaybackEvent,
+    PlaybackEventType,
+    StatusPoller,
+    status_events,
+)
+
+
+class FakePlayer(AbstractPlayer):
+    def play(self, path):
+        self.start_playback(path)
+
+    def stop(self):
+        pass
+
+    def needs_destruction(self):
+        return False
+
+
+def test_emit():
+    player = FakePlayer()
+    events = []
+    progress = []
+    player.on_event = events.append
+    player.on_progress = lambda path, position: progress.append((path, position))
+    player.play('a.mkv')
+    player.confirm_playback()
+    player.emit(PlaybackEventType.POSITION, 0.5)
+    player.emit(PlaybackEventType.POSITION, 0.25)
+    player.emit(PlaybackEventType.PAUSED)
+    assert not player.wait_for_playback_end(0)
+    player.emit(PlaybackEventType.ENDED)
+    assert player.wait_for_playback_end(0)
+    assert events == [PlaybackEvent(PlaybackEventType.POSITION, 'a.mkv', 0.5),
+                      PlaybackEvent(PlaybackEventType.POSITION, 'a.mkv', 0.25),
+                      PlaybackEvent(PlaybackEventType.PAUSED, 'a.mkv'),
+                      PlaybackEvent(PlaybackEventType.ENDED, 'a.mkv')]
+    # Only the furthest position is progress
+    assert progress == [('a.mkv', 0.5)]
+    player.play('b.mkv')
+    assert not player.wait_for_playback_end(0) and player.watched == 0
+
+
+def test_switch_drops_old_events():
+    player = FakePlayer()
+    progress = []
+    player.on_progress = lambda path, position: progress.append((path, position))
+    player.play('a.mkv')
+    player.confirm_playback()
+    player.emit(PlaybackEventType.POSITION, 0.9)
+    player.play('b.mkv')
+    # Still arriving from a.mkv
+    player.emit(PlaybackEventType.POSITION, 0.97)
+    player.emit(PlaybackEventType.ENDED)
+    assert not player.wait_for_playback_end(0)
+    player.confirm_playback()
+    player.emit(PlaybackEventType.POSITION, 0.1)
+    assert progress == [('a.mkv', 0.9), ('b.mkv', 0.1)]
+
+
+def test_status_events():
+    playing = {'state': 'playing', 'position': 0.1}
+    assert status_events(None, playing) == [(PlaybackEventType.POSITION, 0.1)]
+    assert status_events(playing, dict(playing, position=0.2)) == [
+        (PlaybackEventType.POSITION, 0.2)]
+    paused = {'state': 'paused', 'position': 0.2}
+    assert status_events(playing, paused) == [(PlaybackEventType.PAUSED, 0.2)]
+    assert status_events(paused, dict(paused, state='playing')) == [
+        (PlaybackEventType.RESUMED, 0.2)]
+    assert status_events(paused, {'state': 'stopped'}) == [(PlaybackEventType.ENDED, None)]
+    assert status_events({'state': 'stopped'}, {'state': 'stopped'}) == []
+
+
+def test_status_poller():
+    statuses = [None, {'n': 1}, {'n': 1}, {'n': 2}]
+    changes = []
+    done = Event()
+
+    def fetch():
+        return statuses.pop(0) if statuses else {'n': 2}
+
+    def callback(old, new):
+        changes.append((old, new))
+        if new == {'n': 2}:
+            done.set()
+
+    poller = StatusPoller(fetch, callback, min_interval=0.001, max_interval=0.01)
+    poller.start()
+    assert done.wait(5)
+    poller.stop()
+    assert poller.ready.is_set()
+    assert changes == [(None, {'n': 1}), ({'n': 1}, {'n': 2})]
+
+
+def test_status_poller_stops_when_dead():
+    poller = StatusPoller(lambda: {}, lambda old, new: None, alive=lambda: False)
+    poller.start()
+    poller._thread.join(5)
+    assert not poller._thread.is_alive()
+    poller.stop()
+
+
+def test_status_poller_call():
+    threads = []
+    done = Event()
+
+    def func():
+        threads.append(current_thread())
+        done.set()
+
+    poller = StatusPoller(lambda: {}, lambda old, new: None, max_interval=60)
+    poller.start()
+    poller.call(func)
+    assert done.wait(5)
+    thread = poller._thread
+    poller.stop()
+    # Once stopped calls run right away
+    poller.call(func)
+    assert threads == [thread, current_thread()]
+
+
+class VlcHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        auth = base64.b64encode(b':' + HttpVlcPlayer.PASSWORD.encode()).decode()
+        url = urlsplit(self.path)
+        if self.headers.get('Authorization') != f'Basic {auth}':
+            self.send_response(401)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.server.requests.append(parse_qs(url.query))
+        data = json.dumps(self.server.status).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeProcess:
+    def __init__(self, args):
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(port):
+    httpd = ThreadingHTTPServer(('127.0.0.1', port), VlcHandler)
+    httpd.daemon_threads = True
+    httpd.connections = 0
+    httpd.requests = []
+    httpd.status = {'state': 'stopped'}
+    Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+@pytest.fixture
+def vlc(monkeypatch):
+    monkeypatch.setattr(ene.player.subprocess, 'Popen', FakeProcess)
+    port = free_port()
+    servers = []
+    player = HttpVlcPlayer(f'127.0.0.1:{port}')
+    yield player, port, servers
+    player.process.returncode = 0
+    player.poller.stop()
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_http_vlc_ready_backoff(vlc):
+    player, port, servers = vlc
+    assert not player.needs_destruction()
+    timer = Timer(0.3, lambda: servers.append(serve(port)))
+    timer.start()
+    assert player.wait_ready(5)
+    timer.join()
+    ready = Event()
+    player.on_event = lambda event: ready.set()
+    player.play('/anime/a b&c.mkv')
+    assert ready.wait(5)
+    assert {'command': ['in_play'], 'input': ['/anime/a b&c.mkv']} in servers[0].requests
+
+
+def test_http_vlc_play_async(vlc):
+    player, port, servers = vlc
+    events = []
+    ready = Event()
+
+    def on_event(event):
+        events.append(event)
+        ready.set()
+
+    player.on_event = on_event
+    start = monotonic()
+    player.play('/anime/a.mkv')
+    # The interface is not up yet, play does not wait for it
+    assert monotonic() - start < 0.2
+    assert not events
+    servers.append(serve(port))
+    assert ready.wait(5)
+    assert events == [PlaybackEvent(PlaybackEventType.READY, '/anime/a.mkv')]
+    assert {'command': ['in_play'], 'input': ['/anime/a.mkv']} in servers[0].requests
+
+
+def test_http_vlc_play_failed(vlc, monkeypatch):
+    player, port, servers = vlc
+    monkeypatch.setattr(player, 'READY_TIMEOUT', 0.2)
+    events = []
+    player.on_event = events.append
+    player.play('/anime/a.mkv')
+    assert player.wait_for_playback_end(5)
+    assert events == [PlaybackEvent(PlaybackEventType.FAILED, '/anime/a.mkv')]
+
+
+def test_http_vlc_switch(vlc):
+    player, port, servers = vlc
+    servers.append(serve(port))
+    assert player.wait_ready(5)
+    player.poller.stop()
+    progress = []
+    player.on_progress = lambda path, position: progress.append((path, position))
+
+    def status(name, position):
+        return {'state': 'playing', 'position': position,
+                'information': {'category': {'meta': {'filename': name}}}}
+
+    player.play('/anime/a.mkv')
+    player._on_status(None, status('a.mkv', 0.5))
+    player.play('/anime/b.mkv')
+    player._on_status(status('a.mkv', 0.5), status('a.mkv', 0.97))
+    player._on_status(status('a.mkv', 0.97), status('b.mkv', 0.01))
+    assert progress == [('/anime/a.mkv', 0.5), ('/anime/b.mkv', 0.01)]
+
+
+def test_http_vlc_keep_alive(vlc):
+    player, port, servers = vlc
+    servers.append(serve(port))
+    assert player.wait_ready(5)
+    player.poller.stop()
+    httpd = servers[0]
+    connections = httpd.connections
+    requests = len(httpd.requests)
+    for _ in range(5):
+        assert not player.needs_destruction()
+        player.play('/anime/a.mkv')
+    # Liveness is cached, only the plays are requests
+    assert len(httpd.requests) - requests == 5
+    assert httpd.connections == connections
+    player.process.returncode = 0
+    assert player.needs_destruction()
+
+
+class FakeMpv:
+    """Unix socket server answering mpv JSON IPC commands."""
+
+    def __init__(self, path):
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(1)
+        self.commands = []
+        self.conn = None
+        self.thread = Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        self.conn, _ = self.server.accept()
+        with self.conn.makefile('rb') as lines:
+            for line in lines:
+                message = json.loads(line)
+                self.commands.append(message['command'])
+                if message['command'][0] == 'fail':
+                    reply = {'request_id': message['request_id'], 'error': 'invalid parameter'}
+                else:
+                    reply = {'request_id': message['request_id'], 'error': 'success',
+                             'data': message['command'][0]}
+                self.send(reply)
+                if message['command'][0] == 'quit':
+                    break
+        self.conn.close()
+
+    def send(self, message):
+        self.conn.sendall(json.dumps(message).encode() + b'\n')
+
+    def close(self):
+        self.server.close()
+
+
+@pytest.fixture
+def mpv():
+    with TemporaryDirectory() as path:
+        socket_path = os.path.join(path, 'mpv.sock')
+        fake = FakeMpv(socket_path)
+        player = MpvIpcPlayer(socket_path)
+        yield player, fake
+        player.close()
+        fake.close()
+
+
+def test_mpv_ipc_commands(mpv):
+    player, fake = mpv
+    assert player.command('get_property', 'pause').result(5) == 'get_property'
+    with pytest.raises(PlayerError, match='invalid parameter'):
+        player.command('fail').result(5)
+    player.play('/anime/a.mkv')
+    player.play('/anime/b.mkv')
+    player.command('noop').result(5)
+    assert fake.commands[:2] == [['observe_property', 1, 'percent-pos'],
+                                 ['observe_property', 2, 'pause']]
+    assert fake.commands[-3:-1] == [['loadfile', '/anime/a.mkv', 'replace'],
+                                    ['loadfile', '/anime/b.mkv', 'replace']]
+    assert not player.needs_destruction()
+
+
+def test_mpv_ipc_events(mpv):
+    player, fake = mpv
+    events = []
+    player.on_event = events.append
+    player.play('/anime/a.mkv')
+    player.command('noop').result(5)
+    fake.send({'event': 'start-file'})
+    fake.send({'event': 'file-loaded'})
+    fake.send({'event': 'property-change', 'id': 1, 'name': 'percent-pos', 'data': 50.0})
+    fake.send({'event': 'property-change', 'id': 2, 'name': 'pause', 'data': True})
+    fake.send({'event': 'end-file', 'reason': 'stop'})
+    fake.send({'event': 'end-file', 'reason': 'eof'})
+    assert player.wait_for_playback_end(5)
+    assert events == [PlaybackEvent(PlaybackEventType.POSITION, '/anime/a.mkv', 0.5),
+                      PlaybackEvent(PlaybackEventType.PAUSED, '/anime/a.mkv'),
+                      PlaybackEvent(PlaybackEventType.ENDED, '/anime/a.mkv')]
+
+
+def test_mpv_ipc_switch(mpv):
+    player, fake = mpv
+    progress = []
+    player.on_progress = lambda path, position: progress.append((path, position))
+    player.play('/anime/a.mkv')
+    player.command('noop').result(5)
+    for event in ({'event': 'start-file'}, {'event': 'file-loaded'},
+                  {'event': 'property-change', 'id': 1, 'data': 90.0}):
+        fake.send(event)
+    player.command('noop').result(5)
+    player.play('/anime/b.mkv')
+    player.command('noop').result(5)
+    # Old file events still arriving after loadfile
+    for event in ({'event': 'property-change', 'id': 1, 'data': 97.0},
+                  {'event': 'end-file', 'reason': 'stop'},
+                  {'event': 'start-file'}, {'event': 'file-loaded'},
+                  {'event': 'property-change', 'id': 1, 'data': 1.0},
+                  {'event': 'end-file', 'reason': 'eof'}):
+        fake.send(event)
+    assert player.wait_for_playback_end(5)
+    assert progress == [('/anime/a.mkv', 0.9), ('/anime/b.mkv', 0.01)]
+
+
+def test_mpv_ipc_closed(mpv):
+    player, fake = mpv
+    player.command('quit').result(5)
+    player._reader.join(5)
+    assert player.needs_destruction()
+    with pytest.raises(PlayerError):
+        player.command('noop').result(5)
+
+
+def test_mpv_ipc_connect_timeout(monkeypatch):
+    monkeypatch.setattr(MpvIpcPlayer, 'CONNECT_TIMEOUT', 0.1)
+    with TemporaryDirectory() as path:
+        with pytest.raises(PlayerError):
+            MpvIpcPlayer(os.path.join(path, 'missing.sock'))
+
+
+def test_mpv_ipc_launch(monkeypatch):
+    servers = []
+
+    class MpvProcess(FakeProcess):
+        def __init__(self, args):
+            super().__init__(args)
+            self.socket_path = args[-1].split('=', 1)[1]
+            servers.append(FakeMpv(self.socket_path))
+
+        def wait(self, timeout=None):
+            # The fake exits once it has answered quit
+            servers[0].thread.join(timeout)
+            self.returncode = 0
+
+    monkeypatch.setattr(ene.player.subprocess, 'Popen', MpvProcess)
+    player = MpvIpcPlayer.launch('mpv')
+    socket_dir = os.path.dirname(player.socket_path)
+    assert player.socket_dir == socket_dir
+    assert os.stat(socket_dir).st_mode & 0o077 == 0
+    player.close()
+    servers[0].close()
+    assert servers[0].commands[-1] == ['quit']
+    assert not os.path.exists(socket_dir)
@@ -0,0 +1,119 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from ene.database import Database
+from ene.files import parse_episode
+from ene.medialist import MediaListMirror
+from ene.outbox import MediaListOutbox
+from ene.progress import ProgressTracker, WATCHED_THRESHOLD
+
+EPISODE = Path('/anime/[Group] Isekai Foo - 05 [1080p].mkv')
+
+
+class FakeFiles:
+    def episode_info(self, path):
+        return parse_episode(path.name)
+
+    def show_of(self, path):
+        return parse_episode(path.name).title
+
+
+class FakeMatcher:
+    def __init__(self):
+        self.shows = []
+
+    def media_id(self, show):
+        self.shows.append(show)
+        return 1 if show == 'Isekai Foo' else None
+
+
+@pytest.fixture
+def db() -> Database:
+    db = Database(Path(':memory:'))
+    db.initial_setup()
+    yield db
+    del db
+
+
+@pytest.fixture
+def tracker(db):
+    with ThreadPoolExecutor() as pool:
+        outbox = MediaListOutbox(None, db)
+        yield ProgressTracker(FakeFiles(), FakeMatcher(), outbox, pool, MediaListMirror(None, db),
+                              threshold=0.8)
+
+
+def test_below_threshold(tracker):
+    assert tracker.update(EPISODE, 0.5) is None
+    assert tracker.outbox.pending() == {}
+
+
+def test_watched(tracker):
+    assert tracker.update(str(EPISODE), 0.9).result() == 5
+    assert tracker.outbox.pending() == {1: {'status': 'CURRENT', 'progress': 5}}
+    assert tracker.matcher.shows == ['Isekai Foo']
+    # Only synced once
+    assert tracker.update(EPISODE, 0.95) is None
+
+
+def test_submits_once(db):
+    class CountingPool(ThreadPoolExecutor):
+        submitted = 0
+
+        def submit(self, *args, **kwargs):
+            self.submitted += 1
+            return super().submit(*args, **kwargs)
+
+    with CountingPool() as pool:
+        tracker = ProgressTracker(FakeFiles(), FakeMatcher(), MediaListOutbox(None, db), pool,
+                                  threshold=0.8)
+        futures = [tracker.update(EPISODE, 0.8 + i / 1000) for i in range(100)]
+        assert futures[0].result() == 5
+        assert futures[1:] == [None] * 99
+        assert pool.submitted == 1
+
+
+def test_never_lowers_progress(tracker):
+    tracker.media_list.store([{'id': 10, 'mediaId': 1, 'status': 'CURRENT', 'progress': 7,
+                               'updatedAt': 1}])
+    assert tracker.update(EPISODE, 1).result() is None
+    assert tracker.outbox.pending() == {}
+
+
+def test_keeps_status(tracker):
+    tracker.media_list.store([{'id': 10, 'mediaId': 1, 'status': 'REPEATING', 'progress': 2,
+                               'updatedAt': 1}])
+    assert tracker.update(EPISODE, 1).result() == 5
+    assert tracker.outbox.pending() == {1: {'progress': 5}}
+
+
+def test_unmatched(tracker):
+    path = Path('/anime/[Group] Bar Quest - 02.mkv')
+    assert tracker.update(path, 1, show='Bar Quest').result() is None
+    assert tracker.outbox.pending() == {}
+
+
+def test_from_config(db):
+    tracker = ProgressTracker.from_config({'Watched Threshold': 0.5}, FakeFiles(), FakeMatcher(),
+                                          MediaListOutbox(None, db), None)
+    assert tracker.threshold == 0.5
+    assert ProgressTracker.from_config({}, None, None, None, None).threshold == WATCHED_THRESHOLD
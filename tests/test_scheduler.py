@@ -0,0 +1,109 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import monotonic, sleep
+
+import pytest
+import responses
+
+from ene.api import API, Priority, RequestScheduler
+from ene.constants import GRAPHQL_URL
+from ene.errors import APIError
+
+
+@pytest.fixture
+def api() -> API:
+    with TemporaryDirectory() as path:
+        Path(path, 'token').write_text('token')
+        api = API(Path(path))
+        api.scheduler.base_delay = 0.01
+        yield api
+
+
+def test_token_bucket():
+    scheduler = RequestScheduler(limit=600)
+    for _ in range(600):
+        scheduler.acquire()
+    start = monotonic()
+    scheduler.acquire()
+    assert 0.05 < monotonic() - start < 1
+    assert scheduler.metrics.requests == 601
+    assert scheduler.metrics.queue_depth == 0
+
+
+def test_priority_order():
+    scheduler = RequestScheduler(limit=60)
+    scheduler.update({'Retry-After': '1'})
+    order = []
+
+    def request(priority, name):
+        scheduler.acquire(priority)
+        order.append(name)
+
+    threads = [Thread(target=request, args=(Priority.BACKGROUND, 'background'))]
+    threads[0].start()
+    sleep(0.2)
+    threads.append(Thread(target=request, args=(Priority.INTERACTIVE, 'interactive')))
+    threads[1].start()
+    sleep(0.2)
+    assert scheduler.metrics.queue_depth == 2
+    for thread in threads:
+        thread.join()
+    assert order == ['interactive', 'background']
+    assert scheduler.metrics.max_wait >= 0.5
+
+
+def test_update_remaining():
+    scheduler = RequestScheduler()
+    scheduler.update({'X-RateLimit-Limit': '60', 'X-RateLimit-Remaining': '3'})
+    assert scheduler.limit == 60
+    assert scheduler.tokens < 4
+
+
+def test_retry_delay():
+    scheduler = RequestScheduler(max_retries=2, base_delay=1)
+    assert scheduler.retry_delay(400, 0) is None
+    assert 0 <= scheduler.retry_delay(429, 0) <= 1
+    assert 0 <= scheduler.retry_delay(503, 1) <= 2
+    assert scheduler.retry_delay(503, 2) is None
+    assert scheduler.metrics.retries == 2
+    assert scheduler.metrics.throttled == 1
+
+
+@responses.activate
+def test_query_retries(api):
+    responses.add(responses.POST, GRAPHQL_URL, status=429, headers={'Retry-After': '0'},
+                  json={'errors': [{'message': 'Too Many Requests.'}]})
+    responses.add(responses.POST, GRAPHQL_URL, status=502, body='Bad Gateway')
+    responses.add(responses.POST, GRAPHQL_URL, json={'data': {'GenreCollection': ['Action']}},
+                  headers={'X-RateLimit-Remaining': '80'})
+    assert api.query('{GenreCollection}') == {'data': {'GenreCollection': ['Action']}}
+    assert len(responses.calls) == 3
+    assert api.scheduler.metrics.retries == 2
+
+
+@responses.activate
+def test_query_gives_up(api):
+    api.scheduler.max_retries = 1
+    responses.add(responses.POST, GRAPHQL_URL, status=500,
+                  json={'errors': [{'message': 'Internal Server Error'}]})
+    with pytest.raises(APIError):
+        api.query('{GenreCollection}')
+    assert len(responses.calls) == 2
@@ -0,0 +1,153 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import errno
+from pathlib import Path
+from queue import Queue
+from shutil import rmtree
+from tempfile import TemporaryDirectory
+from threading import current_thread
+
+import pytest
+
+from ene.watcher import (
+    IN_CREATE,
+    IN_ISDIR,
+    Changes,
+    LibraryWatcher,
+    _InotifyBackend,
+    _PollingBackend,
+)
+
+
+@pytest.fixture()
+def directory():
+    with TemporaryDirectory() as path:
+        Path(path, 'foo').mkdir()
+        Path(path, 'foo', 'foo - 01.mkv').touch()
+        yield Path(path)
+
+
+def collect(directory, polling):
+    batches = Queue()
+    watcher = LibraryWatcher([directory], batches.put, delay=0.2, max_delay=1,
+                             poll_interval=0.1, polling=polling)
+    return watcher, batches
+
+
+def test_changes_coalesce(directory):
+    changes = Changes()
+    changes.add_file(directory / 'foo - 02.mkv')
+    changes.add_file(directory / 'foo - 02.txt')
+    assert changes.created == {directory / 'foo - 02.mkv'}
+    changes.remove_file(directory / 'foo - 02.mkv')
+    assert not changes
+    changes.add_file(directory / 'foo' / 'foo - 03.mkv')
+    changes.remove_dir(directory / 'foo')
+    assert changes.created == set()
+    assert changes.deleted_dirs == {directory / 'foo'}
+
+
+def test_polling_backend(directory):
+    backend = _PollingBackend([directory], 1)
+    changes = Changes()
+    assert backend.poll(changes) == 0
+    Path(directory, 'bar').mkdir()
+    Path(directory, 'bar', 'bar - 01.mkv').touch()
+    Path(directory, 'foo', 'foo - 01.mkv').unlink()
+    backend.poll(changes)
+    assert changes.created == {directory / 'bar' / 'bar - 01.mkv'}
+    assert changes.deleted == {directory / 'foo' / 'foo - 01.mkv'}
+    rmtree(str(directory / 'bar'))
+    changes = Changes()
+    backend.poll(changes)
+    assert changes.deleted_dirs == {directory / 'bar'}
+
+
+@pytest.mark.parametrize('polling', [False, True])
+def test_watcher(directory, polling):
+    watcher, batches = collect(directory, polling)
+    watcher.start()
+    try:
+        assert watcher.ready.wait(5)
+        if not polling and watcher.backend != 'inotify':
+            pytest.skip('inotify is not available')
+        Path(directory, 'bar').mkdir()
+        for i in range(1, 4):
+            Path(directory, 'bar', f'bar - 0{i}.mkv').touch()
+        Path(directory, 'foo', 'foo - 02.mkv').touch()
+        changes = batches.get(timeout=5)
+        assert changes.created == {directory / 'bar' / 'bar - 01.mkv',
+                                   directory / 'bar' / 'bar - 02.mkv',
+                                   directory / 'bar' / 'bar - 03.mkv',
+                                   directory / 'foo' / 'foo - 02.mkv'}
+
+        rmtree(str(directory / 'foo'))
+        changes = batches.get(timeout=5)
+        assert directory / 'foo' in changes.deleted_dirs
+    finally:
+        watcher.stop()
+
+
+def test_watcher_backend_on_thread(directory, monkeypatch):
+    threads = []
+    create = LibraryWatcher._create_backend
+
+    def create_backend(self):
+        threads.append(current_thread())
+        return create(self)
+
+    monkeypatch.setattr(LibraryWatcher, '_create_backend', create_backend)
+    watcher, _ = collect(directory, True)
+    watcher.start()
+    watcher.stop()
+    assert threads and threads[0] is not current_thread()
+    assert watcher.backend == 'polling'
+
+
+def test_inotify_out_of_watches(directory, monkeypatch):
+    try:
+        backend = _InotifyBackend([directory])
+    except OSError:
+        pytest.skip('inotify is not available')
+
+    def watch_tree(path, changes):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr(backend, '_watch_tree', watch_tree)
+    wd = next(wd for wd, path in backend._paths.items() if path == directory)
+    changes = Changes()
+    try:
+        backend._handle(wd, IN_CREATE | IN_ISDIR, 'bar', changes)
+    finally:
+        backend.close()
+    assert changes.rescan
+
+
+def test_watcher_set_roots(directory):
+    watcher, batches = collect(directory / 'foo', True)
+    watcher.start()
+    try:
+        (directory / 'bar').mkdir()
+        watcher.set_roots([directory / 'bar'])
+        assert watcher.ready.wait(5)
+        (directory / 'bar' / 'bar - 01.mkv').touch()
+        (directory / 'foo' / 'foo - 02.mkv').touch()
+        changes = batches.get(timeout=5)
+        assert changes.created == {directory / 'bar' / 'bar - 01.mkv'}
+    finally:
+        watcher.stop()
@@ -0,0 +1,58 @@
+#  ENE, Automatically track and sync anime watching progress
+#  Copyright (C) 2018 Peijun Ma, Justin Sedge
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Release file names used to check and benchmark title cleaning."""
+import re
+from itertools import product
+
+GROUPS = ['', '[HorribleSubs] ', '[Erai-raws] ', '[SubsPlease] ', '(Hi10)_', '[Coalgirls]_',
+          '[Judas] ', '01. ']
+TITLES = ['Boku no Hero Academia', 'Steins;Gate', 'Re:Zero kara Hajimeru Isekai Seikatsu',
+          'Shingeki no Kyojin S2', 'Shingeki no Kyojin Season 3', 'Mob Psycho 100',
+          'Made in Abyss', 'Kono Subarashii Sekai ni Shukufuku wo! 2', 'Yuru Camp',
+          'Hataraku_Saibou', 'Overlord III', 'Gintama.', 'Sword Art Online - Alicization',
+          'Violet Evergarden', 'Cowboy Bebop (Sessions)', 'K-On!!', 'Natsume Yuujinchou Go',
+          'Mahou Shoujo Madoka Magica', 'Tensei Shitara Slime Datta Ken', 'JoJo S04',
+          'Fate,Zero', 'Haikyuu!! 2nd Season', 'Gekijouban OVA (OAD)', 'Little Witch Academia']
+EPISODES = ['', ' - 01', ' - 12v2', ' E05', ' Ep 07', ' ep10', ' S01E03', ' S02E11', ' 08',
+            ' - Episode 4', '_-_03', ' - 06 - The Episode Title', ' NCOP1', ' 13.5', ' v2']
+TAGS = ['', ' [1080p]', ' (720p)', ' [ABCD1234]', ' (BD 1080p HEVC FLAC)', ' [v2][480p]',
+        ' [Dual Audio]', ' (OVA)']
+
+
+def corpus():
+    """
+    Builds file name stems shaped like real anime releases
+
+    Returns:
+        A list of file name stems
+    """
+    return [''.join(parts) for parts in product(GROUPS, TITLES, EPISODES, TAGS)]
+
+
+def legacy_clean_title(title):
+    """The original chained re.sub implementation of ene.files.clean_title"""
+    title = re.sub(r'[_,]', ' ', title)
+    title = re.sub(r'\[[^]]*\]', '', title)
+    title = re.sub(r'\([^O)]*\)', '', title)
+    title = re.sub(r'[sS]0?1', '', title)
+    title = re.sub(r'^[0-9]+\.', '', title)
+    title = re.sub(r'[eE][pP]?[0-9]+.*', '', title)
+    title = re.sub(r'-?\s+[0-9v]*\s*$', '', title)
+    title = re.sub(r'-\s(Episode)?\s?([0-9v])+.*', '', title)
+    title = re.sub(r'[sS]0?([2-9])', r'Season \1', title)
+    title = title.strip()
+    return title